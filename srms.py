@@ -1,17 +1,588 @@
 import sqlite3
 import os
 import getpass # For hiding password input
+import sys
+import io
+import itertools
+import math
+import bisect
+import functools
+import collections
+import collections.abc
+import array
+import operator
+import contextlib
+import threading
+import atexit
+import heapq
+import zlib
+import mmap
+import struct
+import time
 
 DATABASE_NAME = "student_results.db"
 
+# --- Connection Settings ---
+# Pragmas applied to every new connection (tune per deployment, e.g. synchronous=FULL
+# for stricter durability or a larger cache_size on big servers).
+DB_PRAGMAS = {
+    "journal_mode": "WAL",    # Readers don't block the writer
+    "synchronous": "NORMAL",  # Safe with WAL, avoids an fsync per commit
+    "cache_size": -20000,     # Negative means KiB, so ~20 MB page cache
+    "mmap_size": 268435456,   # 256 MB of memory-mapped I/O
+    "foreign_keys": "ON",     # Required for ON DELETE CASCADE on Marks
+    "busy_timeout": 5000,     # ms to wait when another writer holds the lock
+}
+STATEMENT_CACHE_SIZE = 256 # Prepared statements kept per connection
+PAGE_SIZE = 20             # Rows per page in the interactive listings
+FETCH_BATCH_SIZE = 500     # Rows per fetchmany() when streaming a query
+
 # --- User Data (for basic login - NOT SECURE FOR PRODUCTION) ---
 ADMIN_CREDENTIALS = {"admin": "admin123"}
 CURRENT_USER_ROLE = None # 'admin', 'student'
 CURRENT_USER_ID = None   # student_id if role is 'student'
 
+# --- Connection Manager ---
+# One long-lived connection per (thread, database file) instead of a connect/close
+# per function call. Connections are closed at exit or via close_connection().
+_local = threading.local()
+_open_connections = []
+_connections_lock = threading.Lock()
+_connections_generation = 0 # Bumped by close_all_connections(); threads holding older connections reopen
+
+def calculate_percentage(total_obtained, total_max_marks):
+    # Rounded half up to 2 places in exact integer arithmetic, the same sum StudentTotals does in SQL.
+    if not total_max_marks or total_max_marks <= 0: return 0.0
+    return int((20000 * (total_obtained or 0) + total_max_marks) // (2 * total_max_marks)) / 100
+
+def configure_connection(conn, read_only=False):
+    for pragma, value in DB_PRAGMAS.items():
+        if read_only and pragma == "journal_mode": continue # Can't be changed without write access
+        conn.execute(f"PRAGMA {pragma} = {value}")
+    if read_only: conn.execute("PRAGMA query_only = ON")
+
+def use_read_only_connections():
+    # Called in a worker thread (e.g. a pool initializer): every connection this thread
+    # opens from now on is read-only.
+    _local.read_only = True
+
+def get_connection(database=None):
+    database = database or DATABASE_NAME
+    connections = getattr(_local, "connections", None)
+    if connections is None or getattr(_local, "generation", None) != _connections_generation:
+        connections = _local.connections = {} # Another thread closed them all
+        _local.generation = _connections_generation
+    conn = connections.get(database)
+    if conn is None and database in _memory_sessions: # Shared by every thread; it lives as long as the session
+        conn = connections[database] = _memory_sessions[database]["conn"]
+    if conn is None:
+        # check_same_thread=False only so close_all_connections() can run at exit;
+        # each connection is still used by the thread that opened it.
+        read_only = getattr(_local, "read_only", False)
+        if read_only:
+            import urllib.parse
+            uri = "file:" + urllib.parse.quote(os.path.abspath(database)) + "?mode=ro"
+        else: uri = database
+        factory = InstrumentedConnection if _instrumentation["enabled"] else sqlite3.Connection
+        conn = sqlite3.connect(uri, uri=read_only, cached_statements=STATEMENT_CACHE_SIZE, check_same_thread=False, factory=factory)
+        configure_connection(conn, read_only)
+        _count_connection_opened()
+        connections[database] = conn
+        with _connections_lock: _open_connections.append(conn)
+    return conn
+
+def close_connection(database=None):
+    database = database or DATABASE_NAME
+    conn = getattr(_local, "connections", {}).pop(database, None)
+    if conn is None or database in _memory_sessions: return # The session closes its own connection
+    with _connections_lock:
+        if conn in _open_connections: _open_connections.remove(conn)
+    conn.close()
+    with _instrumentation["lock"]: _instrumentation["connections_closed"] += 1
+
+def close_all_connections():
+    # Closes every thread's connections; each thread opens fresh ones on its next get_connection().
+    global _connections_generation
+    with _connections_lock:
+        connections = list(_open_connections)
+        _open_connections.clear()
+        _connections_generation += 1
+    for conn in connections:
+        try: conn.close()
+        except sqlite3.Error: pass
+    with _instrumentation["lock"]: _instrumentation["connections_closed"] += len(connections)
+    _local.connections = {}
+
+atexit.register(close_all_connections)
+
+# --- Instrumentation ---
+# Off by default; SRMS_INSTRUMENT=1, `srms --instrument ...` or the admin menu turn it on.
+# While on, new connections use the Connection/Cursor subclasses below, which time every
+# statement (execute plus fetches) and count the rows it returns, and @timed_operation
+# functions and menu choices record their wall time, statements, rows and connections opened.
+# Statements slower than SLOW_QUERY_MS are logged with their EXPLAIN QUERY PLAN. While off,
+# connections are plain sqlite3 ones and a timed operation costs one flag check.
+SLOW_QUERY_MS = 100.0
+SLOW_QUERY_LOG_SIZE = 50 # Most recent slow queries kept for the stats screen
+SLOW_QUERY_LOG_FILE = os.environ.get("SRMS_SLOW_QUERY_LOG") # Also appended here when set
+HISTOGRAM_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000) # Bucket upper bounds; the last bucket is open-ended
+
+_instrumentation = {"enabled": os.environ.get("SRMS_INSTRUMENT") == "1", "lock": threading.Lock(),
+                    "statements": {}, "operations": {}, "slow_queries": collections.deque(maxlen=SLOW_QUERY_LOG_SIZE),
+                    "connections_opened": 0, "connections_closed": 0}
+
+def _new_timing():
+    return {"calls": 0, "total_ms": 0.0, "max_ms": 0.0, "rows": 0, "statements": 0, "connections": 0,
+            "histogram": [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)}
+
+def _add_timing(table, key, elapsed_ms, rows=0, statements=0, connections=0):
+    with _instrumentation["lock"]:
+        timing = table.get(key)
+        if timing is None: timing = table[key] = _new_timing()
+        timing["calls"] += 1
+        timing["total_ms"] += elapsed_ms
+        timing["max_ms"] = max(timing["max_ms"], elapsed_ms)
+        timing["rows"] += rows
+        timing["statements"] += statements
+        timing["connections"] += connections
+        timing["histogram"][bisect.bisect_left(HISTOGRAM_BOUNDS_MS, elapsed_ms)] += 1
+
+def _active_operations():
+    stack = getattr(_local, "operations", None)
+    if stack is None: stack = _local.operations = []
+    return stack
+
+def _count_connection_opened():
+    with _instrumentation["lock"]: _instrumentation["connections_opened"] += 1
+    if _instrumentation["enabled"]:
+        for frame in _active_operations(): frame["connections"] += 1
+
+def _log_slow_query(conn, sql, params, elapsed_ms):
+    plan = []
+    if params is not None and sql.lstrip().upper().startswith(("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")):
+        try: plan = [row[3] for row in sqlite3.Connection.execute(conn, "EXPLAIN QUERY PLAN " + sql, params)]
+        except sqlite3.Error: pass # e.g. the connection was closed meanwhile
+    entry = {"time": time.strftime("%Y-%m-%d %H:%M:%S"), "ms": round(elapsed_ms, 2), "sql": " ".join(sql.split()), "plan": plan}
+    with _instrumentation["lock"]: _instrumentation["slow_queries"].append(entry)
+    if SLOW_QUERY_LOG_FILE:
+        try:
+            with open(SLOW_QUERY_LOG_FILE, "a", encoding="utf-8") as f:
+                f.write(f"{entry['time']} {entry['ms']:.2f} ms {entry['sql']}\n" + "".join(f"    {p}\n" for p in plan))
+        except OSError: pass
+
+class InstrumentedCursor(sqlite3.Cursor):
+    # A statement is recorded once it is finished: its rows are exhausted, the cursor runs
+    # another statement, or the cursor is closed or garbage collected.
+    _pending = None # [sql, params (None for executemany), elapsed_ms, rows]
+
+    def _finish(self):
+        pending, self._pending = self._pending, None
+        if pending is None: return
+        sql, params, elapsed_ms, rows = pending
+        _add_timing(_instrumentation["statements"], " ".join(sql.split()), elapsed_ms, rows)
+        for frame in _active_operations():
+            frame["statements"] += 1
+            frame["rows"] += rows
+        if elapsed_ms >= SLOW_QUERY_MS: _log_slow_query(self.connection, sql, params, elapsed_ms)
+
+    def _run(self, method, sql, params):
+        self._finish()
+        started = time.perf_counter()
+        try: return method(sql, params)
+        finally: self._pending = [sql, params, (time.perf_counter() - started) * 1000, 0]
+
+    def execute(self, sql, parameters=()):
+        return self._run(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        result = self._run(super().executemany, sql, seq_of_parameters)
+        self._pending[1] = None # No single parameter set to explain the plan with
+        return result
+
+    def _fetched(self, started, rows, exhausted):
+        if self._pending is None: return
+        self._pending[2] += (time.perf_counter() - started) * 1000
+        self._pending[3] += rows
+        if exhausted: self._finish()
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started, row is not None, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(started, len(rows), not rows)
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, len(rows), True)
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        try: row = super().__next__()
+        except StopIteration:
+            self._fetched(started, 0, True)
+            raise
+        self._fetched(started, 1, False)
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try: self._finish()
+        except Exception: pass # Never raise from a finalizer
+
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+def begin_operation(name):
+    # Returns a token for end_operation(), or None while instrumentation is off.
+    if not _instrumentation["enabled"]: return None
+    frame = {"name": name, "started": time.perf_counter(), "statements": 0, "rows": 0, "connections": 0}
+    _active_operations().append(frame)
+    return frame
+
+def end_operation(frame):
+    if frame is None: return
+    stack = _active_operations()
+    if frame in stack: stack.remove(frame)
+    _add_timing(_instrumentation["operations"], frame["name"], (time.perf_counter() - frame["started"]) * 1000,
+                frame["rows"], frame["statements"], frame["connections"])
+
+def timed_operation(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _instrumentation["enabled"]: return func(*args, **kwargs)
+        frame = begin_operation(func.__name__)
+        try: return func(*args, **kwargs)
+        finally: end_operation(frame)
+    return wrapper
+
+def enable_instrumentation(enabled=True):
+    # Reopens connections so they pick up (or drop) the instrumented classes.
+    if _instrumentation["enabled"] == enabled: return
+    _instrumentation["enabled"] = enabled
+    close_all_connections()
+
+def reset_instrumentation():
+    with _instrumentation["lock"]:
+        for key in ("statements", "operations"): _instrumentation[key].clear()
+        _instrumentation["slow_queries"].clear()
+        _instrumentation["connections_opened"] = _instrumentation["connections_closed"] = 0
+
+def instrumentation_snapshot():
+    # A copy of every counter, safe to read while other threads keep recording.
+    with _instrumentation["lock"]:
+        return {"enabled": _instrumentation["enabled"], "slow_query_ms": SLOW_QUERY_MS,
+                "connections_opened": _instrumentation["connections_opened"],
+                "connections_closed": _instrumentation["connections_closed"],
+                "operations": {k: dict(v, histogram=list(v["histogram"])) for k, v in _instrumentation["operations"].items()},
+                "statements": {k: dict(v, histogram=list(v["histogram"])) for k, v in _instrumentation["statements"].items()},
+                "slow_queries": list(_instrumentation["slow_queries"]), "lookup_caches": lookup_cache_stats(),
+                "ranking_indexes": {database: index.stats() for database, index in list(_ranking_indexes.items())},
+                "marks_writer": {"mode": MARKS_WRITE_BEHIND, "batches": _marks_writer["batches"], "writes": _marks_writer["writes"],
+                                 "failed": _marks_writer["failed"]},
+                "memory_sessions": {database: {"checkpoints": session["checkpoints"]} for database, session in list(_memory_sessions.items())}}
+
+def _histogram_labels():
+    return [f"<{b}ms" for b in HISTOGRAM_BOUNDS_MS] + [f">={HISTOGRAM_BOUNDS_MS[-1]}ms"]
+
+def _print_histogram(histogram, width=40):
+    peak = max(histogram) or 1
+    for label, count in zip(_histogram_labels(), histogram):
+        if count: print(f"  {label:>9} | {'#' * max(1, round(count / peak * width)):<{width}} {count}")
+
+def view_performance_stats(top=10):
+    stats = instrumentation_snapshot()
+    print(f"\n--- Performance Stats (instrumentation {'on' if stats['enabled'] else 'off'}, "
+          f"slow-query threshold {stats['slow_query_ms']:g} ms) ---")
+    print(f"Connections: opened {stats['connections_opened']}, closed {stats['connections_closed']}, "
+          f"open {len(_open_connections)}")
+    for cache in stats["lookup_caches"]:
+        print(f"Lookup cache '{cache['cache']}': {cache['hits']} hits, {cache['misses']} misses "
+              f"({cache['hit_rate']}% hit rate), {cache['entries']} entries")
+    for database, index in stats["ranking_indexes"].items():
+        print(f"Ranking index '{database}': {index['students']} students, {index['builds']} builds, "
+              f"{index['updates']} in-place updates")
+    if stats["marks_writer"]["mode"] != "off":
+        writer = stats["marks_writer"]
+        print(f"Marks write-behind ({writer['mode']}): {writer['writes']} marks in {writer['batches']} batches, "
+              f"{writer['failed']} queued marks not saved")
+    for database, session in stats["memory_sessions"].items():
+        print(f"In-memory session '{database}': {session['checkpoints']} checkpoints to disk")
+    if not stats["operations"] and not stats["statements"]:
+        print("No timings recorded yet." + ("" if stats["enabled"] else " Turn instrumentation on to collect them."))
+        return stats
+
+    operations = sorted(stats["operations"].items(), key=lambda kv: kv[1]["total_ms"], reverse=True)
+    print("\nOperation                    | Calls | Total ms | Avg ms  | Max ms  | SQL   | Rows    | Conns")
+    print("-----------------------------|-------|----------|---------|---------|-------|---------|------")
+    for name, t in operations[:top]:
+        print(f"{name[:28]:<28} | {t['calls']:<5} | {t['total_ms']:<8.1f} | {t['total_ms'] / t['calls']:<7.2f} | "
+              f"{t['max_ms']:<7.2f} | {t['statements']:<5} | {t['rows']:<7} | {t['connections']}")
+    statements = sorted(stats["statements"].items(), key=lambda kv: kv[1]["total_ms"], reverse=True)
+    print("\nCalls | Total ms | Avg ms  | Max ms  | Rows    | Statement")
+    print("------|----------|---------|---------|---------|----------------------------------------")
+    for sql, t in statements[:top]:
+        print(f"{t['calls']:<5} | {t['total_ms']:<8.1f} | {t['total_ms'] / t['calls']:<7.2f} | {t['max_ms']:<7.2f} | "
+              f"{t['rows']:<7} | {sql[:60]}{'...' if len(sql) > 60 else ''}")
+
+    if operations:
+        print("\nOperation latency (all operations):")
+        _print_histogram([sum(col) for col in zip(*(t["histogram"] for _, t in operations))])
+    print("\nStatement latency (all statements):")
+    _print_histogram([sum(col) for col in zip(*(t["histogram"] for _, t in statements))])
+    if stats["slow_queries"]:
+        print(f"\nRecent slow queries (>= {stats['slow_query_ms']:g} ms):")
+        for entry in stats["slow_queries"][-top:]:
+            print(f"  {entry['time']}  {entry['ms']:.1f} ms  {entry['sql'][:90]}")
+            for line in entry["plan"]: print(f"      {line}")
+    return stats
+
+def performance_stats_menu():
+    while True:
+        view_performance_stats()
+        action = input("\n(t)oggle instrumentation, (r)eset counters, Enter to return: ").lower().strip()
+        if action == 't':
+            enable_instrumentation(not _instrumentation["enabled"])
+            print(f"Instrumentation {'on' if _instrumentation['enabled'] else 'off'}.")
+        elif action == 'r':
+            reset_instrumentation()
+            print("Counters reset.")
+        else: break
+
+# --- Lookup Cache ---
+# Bounded LRU cache in front of the by-ID student/subject lookups and the full subject list,
+# which every flow repeats (add_marks checks both per mark, a profile fetches the student twice).
+# Writes made through this module invalidate exactly the entries they touch. A commit from any
+# other connection (another thread or process) moves PRAGMA data_version, and the next lookup
+# that sees it empties both caches (_check_lookup_caches). Misses ("no such ID") are never
+# cached. Keys include the database file, so switching DATABASE_NAME never serves another
+# file's rows.
+LOOKUP_CACHE_SIZE = 4096 # Entries per cache
+LOOKUP_CACHE_TTL = 300.0 # Seconds an entry may live; 0 disables caching
+
+class LookupCache:
+    def __init__(self, name, maxsize=LOOKUP_CACHE_SIZE, ttl=LOOKUP_CACHE_TTL):
+        self.name, self.maxsize, self.ttl = name, maxsize, ttl
+        self.hits = self.misses = 0
+        self._entries = collections.OrderedDict() # key -> (expires_at, value), least recent first
+        self._lock = threading.Lock() # The API's query threads share the cache
+        self._generation = 0 # Bumped by every invalidation
+
+    def get(self, key, load):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+        value = load()
+        with self._lock:
+            # Skip the store if anything was invalidated during the load: the value may predate that write.
+            if value is not None and generation == self._generation and self.ttl > 0:
+                self._entries[key] = (now + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize: self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"cache": self.name, "entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                    "hit_rate": round(self.hits / lookups * 100, 1) if lookups else 0.0}
+
+_student_cache = LookupCache("students")
+_subject_cache = LookupCache("subjects") # Also holds the full list under subject ID None
+
+def invalidate_student(student_id):
+    _student_cache.invalidate((DATABASE_NAME, student_id))
+
+def invalidate_subject(subject_id=None):
+    # The subject list changes with any subject, so it goes too.
+    if subject_id is not None: _subject_cache.invalidate((DATABASE_NAME, subject_id))
+    _subject_cache.invalidate((DATABASE_NAME, None))
+
+def _check_lookup_caches(database=None):
+    # data_version moves only for other connections' commits; it is compared per connection,
+    # so a thread's first lookup (or one on a new connection) starts from an empty cache.
+    conn = get_connection(database)
+    stamp = (conn, conn.execute("PRAGMA data_version").fetchone()[0])
+    stamps = getattr(_local, "lookup_stamps", None)
+    if stamps is None: stamps = _local.lookup_stamps = {}
+    if stamps.get(database or DATABASE_NAME) != stamp:
+        clear_lookup_caches()
+        stamps[database or DATABASE_NAME] = stamp
+
+def clear_lookup_caches():
+    _student_cache.clear()
+    _subject_cache.clear()
+
+def lookup_cache_stats():
+    return [_student_cache.stats(), _subject_cache.stats()]
+
+# --- In-Memory Session ---
+# Optional (SRMS_IN_MEMORY=1): the interactive session copies the database file into a private
+# in-memory database with the backup API, and get_connection() for that file hands every thread
+# the one connection holding the copy, so reports never touch the disk. Threads take turns on
+# it (see SessionConnection). The copy is written back every MEMORY_CHECKPOINT_INTERVAL seconds
+# when it has changed, on logout() and at exit, by backing it up into the file itself: that is
+# one ordinary write transaction, so processes reading the file meanwhile (the results API, the
+# CLI) see the old or the new contents through the usual locking and WAL, never a mix, and a
+# crash leaves the old contents. The session owns the file meanwhile; changes made to it by
+# other processes are overwritten.
+MEMORY_SESSION = os.environ.get("SRMS_IN_MEMORY", "") not in ("", "0")
+MEMORY_CHECKPOINT_INTERVAL = 60.0 # Seconds between checkpoints (only taken when something changed)
+
+_memory_sessions = {} # database path -> session dict (see start_memory_session)
+
+class SessionCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        with self.connection.turn():
+            return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        with self.connection.turn():
+            return super().executemany(sql, seq_of_parameters)
+
+class InstrumentedSessionCursor(SessionCursor, InstrumentedCursor):
+    pass
+
+class SessionConnection(sqlite3.Connection):
+    # The connection every thread of an in-memory session shares. A statement holds it for its
+    # call; one that opens a transaction keeps it for its thread until commit or rollback. Other
+    # threads wait up to busy_timeout, then get "database is locked" like any busy SQLite writer.
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._turn = threading.RLock()
+        self._transaction_held = False
+
+    @contextlib.contextmanager
+    def turn(self):
+        if not self._turn.acquire(timeout=DB_PRAGMAS["busy_timeout"] / 1000):
+            raise sqlite3.OperationalError("database is locked")
+        try:
+            yield
+        finally:
+            held = self._transaction_held
+            self._transaction_held = self.in_transaction
+            if held and not self.in_transaction: self._turn.release() # The finished transaction's hold
+            if held or not self.in_transaction: self._turn.release() # This call's (or it becomes the transaction's)
+
+    def cursor(self, factory=None):
+        # The cursor class follows the instrumentation switch; this connection is never reopened.
+        return super().cursor(factory or (InstrumentedSessionCursor if _instrumentation["enabled"] else SessionCursor))
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        with self.turn():
+            super().commit()
+
+    def rollback(self):
+        with self.turn():
+            super().rollback()
+
+def _session_stamp(conn):
+    # Changes whenever the copy does: rows written (by any thread) or the schema.
+    return (conn.total_changes, conn.execute("PRAGMA schema_version").fetchone()[0])
+
+def start_memory_session(database=None, checkpoint_interval=MEMORY_CHECKPOINT_INTERVAL):
+    database = database or DATABASE_NAME
+    if database in _memory_sessions: return _memory_sessions[database]
+    close_all_connections() # Checkpoints the file's WAL; every thread picks up the session connection next
+    conn = sqlite3.connect(":memory:", cached_statements=STATEMENT_CACHE_SIZE, check_same_thread=False, factory=SessionConnection)
+    source = sqlite3.connect(database)
+    try: source.backup(conn)
+    finally: source.close()
+    configure_connection(conn)
+    _count_connection_opened()
+    session = {"path": os.path.abspath(database), "conn": conn, "lock": threading.Lock(),
+               "saved_stamp": _session_stamp(conn), "checkpoints": 0, "stop": threading.Event(), "timer": None}
+    _memory_sessions[database] = session
+    if checkpoint_interval:
+        session["timer"] = threading.Thread(target=_memory_checkpoint_loop, args=(database, session, checkpoint_interval),
+                                            name="srms-memory-checkpoint", daemon=True)
+        session["timer"].start()
+    return session
+
+def _memory_checkpoint_loop(database, session, interval):
+    while not session["stop"].wait(interval):
+        try: checkpoint_memory_session(database)
+        except (sqlite3.Error, OSError) as e: print(f"\nIn-memory checkpoint failed: {e}", file=sys.stderr)
+
+def checkpoint_memory_session(database=None, force=False):
+    # Writes the in-memory copy back to its file if it changed. Returns True if it wrote.
+    session = _memory_sessions.get(database or DATABASE_NAME)
+    if session is None: return False
+    conn = session["conn"]
+    with session["lock"], conn.turn(): # No other thread is inside a transaction: the copy is all committed
+        stamp = _session_stamp(conn)
+        if stamp == session["saved_stamp"] and not force: return False
+        target = sqlite3.connect(session["path"], timeout=DB_PRAGMAS["busy_timeout"] / 1000)
+        try:
+            target.execute("PRAGMA synchronous = FULL") # A finished checkpoint must survive a power cut
+            conn.backup(target)
+        finally: target.close()
+        session["saved_stamp"] = stamp
+        session["checkpoints"] += 1
+    return True
+
+def end_memory_session(database=None):
+    # Final checkpoint, then back to the file itself.
+    database = database or DATABASE_NAME
+    session = _memory_sessions.get(database)
+    if session is None: return
+    session["stop"].set()
+    if session["timer"] is not None: session["timer"].join()
+    checkpoint_memory_session(database)
+    del _memory_sessions[database]
+    close_all_connections() # Threads drop the session connection and reopen the file
+    session["conn"].close()
+    with _instrumentation["lock"]: _instrumentation["connections_closed"] += 1
+
+def _end_memory_sessions():
+    for database in list(_memory_sessions):
+        try: end_memory_session(database)
+        except (sqlite3.Error, OSError) as e: print(f"Could not save the in-memory session to '{database}': {e}", file=sys.stderr)
+
+atexit.register(_end_memory_sessions) # Before close_all_connections, after the marks writer drains (atexit is LIFO)
+
 # --- Database Initialization ---
-def initialize_database():
-    conn = sqlite3.connect(DATABASE_NAME)
+def initialize_database(database=None):
+    conn = get_connection(database)
     cursor = conn.cursor()
 
     cursor.execute('''
@@ -41,9 +612,409 @@ def initialize_database():
         UNIQUE(student_id, subject_id)
     )''')
     conn.commit()
-    conn.close()
-    print(f"Database '{DATABASE_NAME}' initialized/checked successfully.")
+    apply_migrations(conn, verbose=False)
+    print(f"Database '{database or DATABASE_NAME}' initialized/checked successfully.")
+
+
+# --- Schema Migrations ---
+# The schema version lives in PRAGMA user_version. Migrations run in order at startup;
+# each one is applied in its own transaction together with the version bump. A step is
+# either a SQL statement or a callable taking the connection.
+def _add_student_password_column(conn):
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(Students)")]
+    if "password_hash" not in columns: # Databases created before student login existed
+        conn.execute("ALTER TABLE Students ADD COLUMN password_hash TEXT")
+
+# Per-student totals aggregated straight from Marks; StudentTotals caches exactly this.
+_LIVE_TOTALS_SQL = '''
+    SELECT st.student_id, COALESCE(SUM(m.marks_obtained), 0) AS total_obtained,
+           COALESCE(SUM(su.max_marks), 0) AS total_max_marks
+    FROM Students st
+    LEFT JOIN Marks m ON st.student_id = m.student_id
+    LEFT JOIN Subjects su ON m.subject_id = su.subject_id
+    GROUP BY st.student_id '''
+
+_REBUILD_TOTALS_SQL = [
+    "DELETE FROM StudentTotals",
+    f"INSERT INTO StudentTotals (student_id, total_obtained, total_max_marks) {_LIVE_TOTALS_SQL}",
+]
+
+# StudentTotals is kept current by triggers. The Subjects delete trigger runs BEFORE the
+# delete because the cascaded Marks deletes can no longer see the subject's max_marks.
+# percentage is plain SQL (no application functions), so any SQLite client can write to the
+# tables; it rounds exactly like calculate_percentage(), which SQLite's ROUND() does not on ties.
+_STUDENT_TOTALS_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS StudentTotals (
+        student_id INTEGER PRIMARY KEY,
+        total_obtained INTEGER NOT NULL DEFAULT 0,
+        total_max_marks INTEGER NOT NULL DEFAULT 0,
+        percentage REAL GENERATED ALWAYS AS (CASE WHEN total_max_marks > 0
+            THEN CAST((20000 * total_obtained + total_max_marks) / (2 * total_max_marks) AS INTEGER) / 100.0
+            ELSE 0.0 END) STORED
+    )''',
+    "CREATE INDEX IF NOT EXISTS idx_totals_percentage ON StudentTotals(percentage DESC, student_id)",
+    "CREATE INDEX IF NOT EXISTS idx_totals_obtained ON StudentTotals(total_obtained DESC, student_id)",
+    '''CREATE TRIGGER IF NOT EXISTS trg_totals_student_insert AFTER INSERT ON Students BEGIN
+        INSERT OR REPLACE INTO StudentTotals (student_id, total_obtained, total_max_marks)
+        SELECT NEW.student_id, COALESCE(SUM(m.marks_obtained), 0), COALESCE(SUM(su.max_marks), 0)
+        FROM Marks m LEFT JOIN Subjects su ON m.subject_id = su.subject_id WHERE m.student_id = NEW.student_id;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_totals_student_delete AFTER DELETE ON Students BEGIN
+        DELETE FROM StudentTotals WHERE student_id = OLD.student_id;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_totals_marks_insert AFTER INSERT ON Marks BEGIN
+        UPDATE StudentTotals SET total_obtained = total_obtained + COALESCE(NEW.marks_obtained, 0),
+            total_max_marks = total_max_marks + COALESCE((SELECT max_marks FROM Subjects WHERE subject_id = NEW.subject_id), 0)
+        WHERE student_id = NEW.student_id;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_totals_marks_delete AFTER DELETE ON Marks BEGIN
+        UPDATE StudentTotals SET total_obtained = total_obtained - COALESCE(OLD.marks_obtained, 0),
+            total_max_marks = total_max_marks - COALESCE((SELECT max_marks FROM Subjects WHERE subject_id = OLD.subject_id), 0)
+        WHERE student_id = OLD.student_id;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_totals_marks_update AFTER UPDATE OF student_id, subject_id, marks_obtained ON Marks BEGIN
+        UPDATE StudentTotals SET total_obtained = total_obtained - COALESCE(OLD.marks_obtained, 0),
+            total_max_marks = total_max_marks - COALESCE((SELECT max_marks FROM Subjects WHERE subject_id = OLD.subject_id), 0)
+        WHERE student_id = OLD.student_id;
+        UPDATE StudentTotals SET total_obtained = total_obtained + COALESCE(NEW.marks_obtained, 0),
+            total_max_marks = total_max_marks + COALESCE((SELECT max_marks FROM Subjects WHERE subject_id = NEW.subject_id), 0)
+        WHERE student_id = NEW.student_id;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_totals_subject_insert AFTER INSERT ON Subjects BEGIN
+        UPDATE StudentTotals SET total_max_marks = total_max_marks + COALESCE(NEW.max_marks, 0)
+        WHERE student_id IN (SELECT student_id FROM Marks WHERE subject_id = NEW.subject_id);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_totals_subject_update AFTER UPDATE OF max_marks ON Subjects BEGIN
+        UPDATE StudentTotals SET total_max_marks = total_max_marks - COALESCE(OLD.max_marks, 0) + COALESCE(NEW.max_marks, 0)
+        WHERE student_id IN (SELECT student_id FROM Marks WHERE subject_id = NEW.subject_id);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_totals_subject_delete BEFORE DELETE ON Subjects BEGIN
+        UPDATE StudentTotals SET total_max_marks = total_max_marks - COALESCE(OLD.max_marks, 0)
+        WHERE student_id IN (SELECT student_id FROM Marks WHERE subject_id = OLD.subject_id);
+    END''',
+    *_REBUILD_TOTALS_SQL,
+]
+
+# Full-text search shadow tables (FTS5, trigram tokenizer) over student and subject names.
+# External-content tables store only the index; triggers keep them in step with the base
+# tables. Skipped when this SQLite build lacks FTS5/trigram, and search falls back to LIKE.
+_SEARCH_INDEX_SCHEMA = [
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS StudentSearch USING fts5(
+        first_name, last_name, content='Students', content_rowid='student_id', tokenize='trigram')''',
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS SubjectSearch USING fts5(
+        subject_name, content='Subjects', content_rowid='subject_id', tokenize='trigram')''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_search_student_insert AFTER INSERT ON Students BEGIN
+        INSERT INTO StudentSearch (rowid, first_name, last_name) VALUES (NEW.student_id, NEW.first_name, NEW.last_name);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_search_student_delete AFTER DELETE ON Students BEGIN
+        INSERT INTO StudentSearch (StudentSearch, rowid, first_name, last_name)
+        VALUES ('delete', OLD.student_id, OLD.first_name, OLD.last_name);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_search_student_update AFTER UPDATE OF first_name, last_name ON Students BEGIN
+        INSERT INTO StudentSearch (StudentSearch, rowid, first_name, last_name)
+        VALUES ('delete', OLD.student_id, OLD.first_name, OLD.last_name);
+        INSERT INTO StudentSearch (rowid, first_name, last_name) VALUES (NEW.student_id, NEW.first_name, NEW.last_name);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_search_subject_insert AFTER INSERT ON Subjects BEGIN
+        INSERT INTO SubjectSearch (rowid, subject_name) VALUES (NEW.subject_id, NEW.subject_name);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_search_subject_delete AFTER DELETE ON Subjects BEGIN
+        INSERT INTO SubjectSearch (SubjectSearch, rowid, subject_name) VALUES ('delete', OLD.subject_id, OLD.subject_name);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_search_subject_update AFTER UPDATE OF subject_name ON Subjects BEGIN
+        INSERT INTO SubjectSearch (SubjectSearch, rowid, subject_name) VALUES ('delete', OLD.subject_id, OLD.subject_name);
+        INSERT INTO SubjectSearch (rowid, subject_name) VALUES (NEW.subject_id, NEW.subject_name);
+    END''',
+    "INSERT INTO StudentSearch (StudentSearch) VALUES ('rebuild')",
+    "INSERT INTO SubjectSearch (SubjectSearch) VALUES ('rebuild')",
+]
+
+def _rebuild_old_student_totals(conn):
+    # Migration 3 once computed percentage with an application function (srms_percentage)
+    # that other SQLite clients don't have. Newer databases already have the plain-SQL column.
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'StudentTotals'").fetchone()
+    if row is None or "srms_percentage" not in row[0]: return
+    conn.execute("DROP TABLE StudentTotals") # Its indexes go with it; the triggers are kept
+    for sql in _STUDENT_TOTALS_SCHEMA: conn.execute(sql)
+
+def fts5_trigram_available(conn):
+    try: conn.execute("CREATE VIRTUAL TABLE temp.srms_fts_probe USING fts5(x, tokenize='trigram')")
+    except sqlite3.OperationalError: return False
+    conn.execute("DROP TABLE temp.srms_fts_probe")
+    return True
+
+def create_search_index(conn):
+    if not fts5_trigram_available(conn): return False
+    for sql in _SEARCH_INDEX_SCHEMA: conn.execute(sql)
+    return True
+
+# Terms (see Academic Terms). Existing marks become the first term's.
+_TERMS_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS Terms (
+        term_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE,
+        started_at TEXT NOT NULL DEFAULT (datetime('now')),
+        closed_at TEXT,   -- NULL while the term is current
+        archive_path TEXT -- Relative to the database's directory
+    )''',
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_terms_current ON Terms((closed_at IS NULL)) WHERE closed_at IS NULL",
+    "INSERT INTO Terms (name) SELECT 'Term 1' WHERE NOT EXISTS (SELECT 1 FROM Terms)",
+]
+
+# Change log (see Change Data Capture). Logging starts when the migration runs; older rows
+# were never logged, so a replica starts from a full copy plus the current sequence number.
+CHANGE_LOG_COLUMNS = { # Columns exported per table; Students.password_hash never leaves the database
+    "Students": ("student_id", "first_name", "last_name", "class_section"),
+    "Subjects": ("subject_id", "subject_name", "max_marks"),
+    "Marks": ("mark_id", "student_id", "subject_id", "marks_obtained"),
+}
+
+def _change_log_triggers():
+    for table, columns in CHANGE_LOG_COLUMNS.items():
+        for op, row in (("insert", "NEW"), ("update", "NEW"), ("delete", "OLD")):
+            image = ", ".join(f"'{column}', {row}.{column}" for column in columns)
+            when = " WHEN " + " OR ".join(f"OLD.{column} IS NOT NEW.{column}" for column in columns) if op == "update" else ""
+            yield f'''CREATE TRIGGER IF NOT EXISTS trg_changes_{table.lower()}_{op} AFTER {op.upper()} ON {table}{when} BEGIN
+        INSERT INTO ChangeLog (table_name, op, row_id, data) VALUES ('{table}', '{op}', {row}.{columns[0]}, json_object({image}));
+    END'''
+
+_CHANGE_LOG_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS ChangeLog (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT, -- Never reused, so export cursors stay meaningful
+        table_name TEXT NOT NULL,
+        op TEXT NOT NULL,   -- insert, update, delete, or clear (every row of the table removed)
+        row_id INTEGER,     -- Primary key of the changed row; NULL for clear
+        changed_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+        data TEXT           -- JSON image of the row after the change (before it, for a delete)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS ChangeLogState (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        purged_through INTEGER NOT NULL DEFAULT 0 -- Entries up to this seq are gone; older cursors must resync
+    )''',
+    "INSERT OR IGNORE INTO ChangeLogState (id) VALUES (1)",
+    *_change_log_triggers(),
+]
+
+MIGRATIONS = [
+    (1, "Add Students.password_hash to early databases", [_add_student_password_column]),
+    (2, "Secondary indexes for the hot queries", [
+        "CREATE INDEX IF NOT EXISTS idx_marks_subject ON Marks(subject_id)",
+        "CREATE INDEX IF NOT EXISTS idx_students_class_section ON Students(class_section)",
+        "CREATE INDEX IF NOT EXISTS idx_students_first_name ON Students(first_name COLLATE NOCASE)",
+        "CREATE INDEX IF NOT EXISTS idx_students_last_name ON Students(last_name COLLATE NOCASE)",
+    ]),
+    (3, "Trigger-maintained StudentTotals for reports", _STUDENT_TOTALS_SCHEMA),
+    (4, "FTS5 trigram search index for students and subjects", [create_search_index]),
+    (5, "Academic terms", _TERMS_SCHEMA),
+    (6, "Shard map (empty unless the database is sharded)", [
+        "CREATE TABLE IF NOT EXISTS Shards (shard_index INTEGER PRIMARY KEY, path TEXT NOT NULL UNIQUE)",
+    ]),
+    (7, "Change log for incremental exports", _CHANGE_LOG_SCHEMA),
+    (8, "StudentTotals.percentage without an application function", [_rebuild_old_student_totals]),
+    (9, "Covering index for per-subject mark distributions", [ # Also serves every lookup the old index did
+        "CREATE INDEX IF NOT EXISTS idx_marks_subject_marks ON Marks(subject_id, marks_obtained)",
+        "DROP INDEX IF EXISTS idx_marks_subject",
+    ]),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(conn=None):
+    conn = conn or get_connection()
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def apply_migrations(conn=None, verbose=True):
+    conn = conn or get_connection()
+    applied = []
+    for version, description, steps in MIGRATIONS:
+        if version <= get_schema_version(conn): continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if version <= get_schema_version(conn): # Another process got here first
+                conn.rollback()
+                continue
+            for step in steps:
+                if callable(step): step(conn)
+                else: conn.execute(step)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        applied.append(version)
+        clear_lookup_caches() # Cached rows may predate the new schema
+        if verbose: print(f"Applied migration {version}: {description}")
+    if conn is get_connection(): # Migrating the primary: bring its shards along too
+        for shard in get_shards()[1:]: apply_migrations(get_connection(shard), verbose)
+    return applied
+
+# --- Query Plan Checks ---
+# Queries that must be answered from an index. check_query_plans() returns a list of
+# (name, plan) for every query whose plan full-scans a table not listed in allow_scan.
+HOT_QUERIES = [
+    ("marksheet for student", '''
+        SELECT s.subject_name, m.marks_obtained, s.max_marks
+        FROM Marks m JOIN Subjects s ON m.subject_id = s.subject_id
+        WHERE m.student_id = ? ''', (1,), ()),
+    ("marks for subject", "SELECT student_id, marks_obtained FROM Marks WHERE subject_id = ?", (1,), ()),
+    ("mark distribution", "SELECT subject_id, marks_obtained, COUNT(*) FROM Marks GROUP BY 1, 2", (), ()),
+    ("live totals aggregate", _LIVE_TOTALS_SQL, (), ("st",)),
+    ("top N by percentage", '''
+        SELECT t.student_id, st.first_name, t.percentage FROM StudentTotals t
+        JOIN Students st ON st.student_id = t.student_id
+        ORDER BY t.percentage DESC, t.student_id LIMIT 10''', (), ()),
+    ("top N by total", '''
+        SELECT t.student_id, st.first_name, t.total_obtained FROM StudentTotals t
+        JOIN Students st ON st.student_id = t.student_id
+        ORDER BY t.total_obtained DESC, t.student_id LIMIT 10''', (), ()),
+    ("students below threshold", '''
+        SELECT t.student_id, t.percentage FROM StudentTotals t
+        WHERE t.percentage < ? AND t.total_max_marks > 0''', (40.0,), ()),
+    ("students in class", "SELECT student_id, first_name, last_name FROM Students WHERE class_section = ?", ("10A",), ()),
+    ("class_section grouping", "SELECT class_section, COUNT(*) FROM Students GROUP BY class_section", (), ()),
+    ("first name prefix", "SELECT student_id FROM Students WHERE first_name LIKE ?", ("ab%",), ()),
+    ("last name prefix", "SELECT student_id FROM Students WHERE last_name LIKE ?", ("ab%",), ()),
+]
+
+def check_query_plans(database=None):
+    # Uses a private connection without a statement cache: a cached EXPLAIN statement
+    # keeps reporting the plan from when it was first prepared, even after DDL.
+    conn = sqlite3.connect(database or DATABASE_NAME, cached_statements=0)
+    failures = []
+    try:
+        for name, sql, params, allow_scan in HOT_QUERIES:
+            plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+            for detail in plan:
+                words = detail.split()
+                if words[0] == "SCAN" and "INDEX" not in words and words[1] not in allow_scan:
+                    failures.append((name, plan))
+                    break
+    finally: conn.close()
+    return failures
+
+def run_query_plan_check():
+    failures = check_query_plans()
+    if not failures: print(f"All {len(HOT_QUERIES)} hot queries use an index."); return True
+    for name, plan in failures: print(f"Full scan in '{name}': {' / '.join(plan)}")
+    return False
+
+# --- Sharding ---
+# Optional: a database whose Shards table lists several files is sharded. Each student (with
+# their marks and totals) lives in the shard picked by crc32(class_section) when the student is
+# added, and the student ID encodes that shard (student_id % SHARD_ID_STRIDE), so anything keyed
+# by student ID goes straight to the right file. A student keeps their shard if their class
+# changes later. Subjects (and terms, the change log and other single-file features) stay
+# in the primary database, shard 0; subjects are replicated to every shard under the same IDs
+# so marks keep their foreign keys. Search, statistics, totals checks and marksheets visit
+# every shard. Reports fan out to the shards in a process pool and merge
+# the per-shard sorted results; global ranks come from a k-way merge of the shard streams.
+SHARD_ID_STRIDE = 64        # Most shards a database can have
+SHARD_FANOUT_WORKERS = None # Processes for fan-out queries (default: one per shard)
+
+_shard_maps = {} # DATABASE_NAME -> shard paths ([] when not sharded)
+_shard_pool = None
+
+def get_shards():
+    # Shard database paths in shard order (shard 0 is DATABASE_NAME itself), or [] when unsharded.
+    shards = _shard_maps.get(DATABASE_NAME)
+    if shards is None:
+        try: rows = get_connection().execute("SELECT shard_index, path FROM Shards ORDER BY shard_index").fetchall()
+        except sqlite3.OperationalError: return [] # Not migrated yet; look again next time
+        base = os.path.dirname(os.path.abspath(DATABASE_NAME))
+        shards = _shard_maps[DATABASE_NAME] = [DATABASE_NAME if index == 0 else os.path.join(base, path) for index, path in rows]
+    return shards
+
+def shard_index_for_class(class_section):
+    shards = get_shards()
+    return zlib.crc32((class_section or "").encode("utf-8")) % len(shards) if shards else 0
+
+def shard_for_class(class_section):
+    shards = get_shards()
+    return shards[shard_index_for_class(class_section)] if shards else DATABASE_NAME
+
+def shard_for_student(student_id):
+    # The database holding this student, or None if the ID can't belong to any shard.
+    shards = get_shards()
+    if not shards: return DATABASE_NAME
+    index = student_id % SHARD_ID_STRIDE
+    return shards[index] if index < len(shards) else None
+
+def configure_shards(paths):
+    # Turns the (empty) DATABASE_NAME into a sharded database with DATABASE_NAME as shard 0
+    # and `paths` as shards 1..n, creating and migrating the shard files.
+    if len(paths) + 1 > SHARD_ID_STRIDE: raise ValueError(f"At most {SHARD_ID_STRIDE} shards are supported.")
+    conn = get_connection()
+    if get_shards(): raise ValueError(f"'{DATABASE_NAME}' is already sharded.")
+    if conn.execute("SELECT 1 FROM Students LIMIT 1").fetchone():
+        raise ValueError("Sharding can only be set up before any students are added.")
+    base = os.path.dirname(os.path.abspath(DATABASE_NAME))
+    subjects = get_all_subjects()
+    for path in paths:
+        shard = os.path.abspath(path)
+        initialize_database(shard)
+        shard_conn = get_connection(shard)
+        shard_conn.executemany("INSERT OR IGNORE INTO Subjects (subject_id, subject_name, max_marks) VALUES (?, ?, ?)", subjects)
+        shard_conn.commit()
+    try:
+        conn.executemany("INSERT INTO Shards (shard_index, path) VALUES (?, ?)",
+                         enumerate([os.path.basename(DATABASE_NAME)] + [os.path.relpath(os.path.abspath(p), base) for p in paths]))
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    _shard_maps.pop(DATABASE_NAME, None)
+    return get_shards()
+
+def _shard_worker_query(database, sql, params):
+    # Runs in a fan-out worker process, on a private read-only connection.
+    import urllib.parse
+    conn = sqlite3.connect("file:" + urllib.parse.quote(os.path.abspath(database)) + "?mode=ro", uri=True)
+    try:
+        configure_connection(conn, read_only=True)
+        return conn.execute(sql, params).fetchall()
+    finally: conn.close()
+
+def fan_out_query(sql, params=()):
+    # Runs sql on every shard in parallel; returns one row list per shard, in shard order.
+    global _shard_pool
+    shards = get_shards()
+    if _shard_pool is None:
+        import concurrent.futures
+        _shard_pool = concurrent.futures.ProcessPoolExecutor(max_workers=SHARD_FANOUT_WORKERS or len(shards))
+        atexit.register(_shard_pool.shutdown)
+    return list(_shard_pool.map(_shard_worker_query, shards, itertools.repeat(sql), itertools.repeat(params)))
+
+def iter_all_shards(sql, params=(), key=None):
+    # Streams sql from every shard in this process, merged on key (each shard's rows must
+    # already be sorted on it). Cheap enough for paging; reports use fan_out_query().
+    return heapq.merge(*(iter_query(sql, params, database=shard) for shard in get_shards()), key=key)
+
+def _class_order(class_section):
+    return (class_section is not None, class_section or "") # SQLite sorts NULL first
 
+def _merge_ranked(streams, sort_key, limit=None, by_class=False):
+    # k-way merge of per-shard rows (RANKING_COLUMNS[1:], each stream sorted by class when
+    # by_class, then score descending, then ID) into ranked dicts. Ranks match what RANK()
+    # gives over a single database; limit applies per class when by_class is set.
+    score_at = RANKING_COLUMNS.index(sort_key) - 1
+    key = lambda row: (_class_order(row[3]) if by_class else (), -row[score_at], row[0])
+    ranked, group, position, rank, last_score = [], object(), 0, 0, None
+    for row in heapq.merge(*streams, key=key):
+        if by_class and row[3] != group: group, position, last_score = row[3], 0, None
+        if limit is not None and position >= limit:
+            if by_class: continue # Rest of this class
+            break
+        position += 1
+        if row[score_at] != last_score: rank, last_score = position, row[score_at]
+        ranked.append(dict(zip(RANKING_COLUMNS, (rank,) + tuple(row))))
+    return ranked
+
+def run_configure_shards(paths):
+    if CURRENT_USER_ROLE != "admin": print("Access Denied."); return None
+    try: shards = configure_shards(paths)
+    except (ValueError, sqlite3.Error, OSError) as e: print(f"Could not set up sharding: {e}"); return None
+    print(f"'{DATABASE_NAME}' is now sharded across {len(shards)} databases:")
+    for index, path in enumerate(shards): print(f"  shard {index}: {path}")
+    return shards
 
 # --- Login Functions ---
 def login():
@@ -104,51 +1075,63 @@ def login():
 
 def logout():
     global CURRENT_USER_ROLE, CURRENT_USER_ID
+    flush_marks_queue() # Queued marks are written before the session ends
+    try:
+        if checkpoint_memory_session(): print("In-memory changes saved to disk.")
+    except (sqlite3.Error, OSError) as e: print(f"Could not save in-memory changes: {e}")
     CURRENT_USER_ROLE = None
     CURRENT_USER_ID = None
     print("Logged out successfully.")
 
 # --- Student Management Functions ---
+@timed_operation
 def add_student(first_name, last_name, class_section, password=None):
     password_to_store = password # HASH THIS IN PRODUCTION!
-    conn = sqlite3.connect(DATABASE_NAME)
+    conn = get_connection(shard_for_class(class_section))
     cursor = conn.cursor()
+    changes_before = conn.total_changes
     try:
-        cursor.execute("INSERT INTO Students (first_name, last_name, class_section, password_hash) VALUES (?, ?, ?, ?)",
-                       (first_name, last_name, class_section, password_to_store))
+        if get_shards(): # Next ID in this shard's residue class, so the ID says where the student lives.
+            # sqlite_sequence holds the highest ID this shard ever issued (explicit IDs advance it
+            # too), so like AUTOINCREMENT a deleted student's ID is never handed out again.
+            cursor.execute('''
+                INSERT INTO Students (student_id, first_name, last_name, class_section, password_hash)
+                VALUES ((SELECT COALESCE(MAX(seq), ?) FROM sqlite_sequence WHERE name = 'Students') + ?, ?, ?, ?, ?)''',
+                (shard_index_for_class(class_section), SHARD_ID_STRIDE, first_name, last_name, class_section, password_to_store))
+        else:
+            cursor.execute("INSERT INTO Students (first_name, last_name, class_section, password_hash) VALUES (?, ?, ?, ?)",
+                           (first_name, last_name, class_section, password_to_store))
         conn.commit()
         student_id = cursor.lastrowid
+        invalidate_student(student_id)
+        refresh_ranking(conn, student_id, changes_before)
         print(f"Student '{first_name} {last_name}' added successfully with ID: {student_id}.")
         return student_id
     except sqlite3.Error as e:
+        conn.rollback()
         print(f"Error adding student: {e}")
         return None
-    finally:
-        conn.close()
 
-def view_all_students():
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT student_id, first_name, last_name, class_section FROM Students ORDER BY student_id")
-    students = cursor.fetchall()
-    conn.close()
-    if not students: print("No students found."); return []
-    print("\n--- All Students ---")
-    print("ID | First Name | Last Name  | Class/Section")
-    print("---|------------|------------|---------------")
-    for student in students:
-        print(f"{student[0]:<3}| {student[1]:<10} | {student[2]:<10} | {student[3]}")
-    print("-------------------------------------------")
-    return students
+def view_all_students(page_size=PAGE_SIZE):
+    if not browse_pages(lambda after, before: get_students_page(after, before, page_size),
+                        lambda student: student[0], _print_students_page, "All Students"):
+        print("No students found.")
 
-def get_student_by_id(student_id):
-    conn = sqlite3.connect(DATABASE_NAME)
+def _load_student(student_id):
+    database = shard_for_student(student_id)
+    if database is None: return None
+    conn = get_connection(database)
     cursor = conn.cursor()
     cursor.execute("SELECT student_id, first_name, last_name, class_section, password_hash FROM Students WHERE student_id = ?", (student_id,))
     student = cursor.fetchone()
-    conn.close()
     return student
 
+def get_student_by_id(student_id):
+    database = shard_for_student(student_id)
+    if database is not None: _check_lookup_caches(database)
+    return _student_cache.get((DATABASE_NAME, student_id), lambda: _load_student(student_id))
+
+@timed_operation
 def view_student_profile(student_id_to_view):
     student_data = get_student_by_id(student_id_to_view)
     if not student_data: print(f"Student with ID {student_id_to_view} not found."); return
@@ -159,6 +1142,7 @@ def view_student_profile(student_id_to_view):
     print("\n--- Academic Record ---")
     view_student_marks(student_id_to_view, print_header=False)
 
+@timed_operation
 def update_student_details(student_id_to_update):
     if CURRENT_USER_ROLE != "admin": print("Access Denied."); return
     student = get_student_by_id(student_id_to_update)
@@ -171,7 +1155,7 @@ def update_student_details(student_id_to_update):
     new_password = getpass.getpass(f"New password (Enter to keep current or leave blank): ").strip()
     password_to_update = student[4] if not new_password else new_password # HASH new_password!
 
-    conn = sqlite3.connect(DATABASE_NAME)
+    conn = get_connection(shard_for_student(student_id_to_update))
     cursor = conn.cursor()
     try:
         cursor.execute('''
@@ -179,11 +1163,14 @@ def update_student_details(student_id_to_update):
             WHERE student_id = ? ''',
             (new_first_name, new_last_name, new_class_section, password_to_update, student_id_to_update))
         conn.commit()
+        invalidate_student(student_id_to_update)
         if cursor.rowcount > 0: print("Student details updated successfully.")
         else: print("No changes made or student not found.")
-    except sqlite3.Error as e: print(f"Error updating student details: {e}")
-    finally: conn.close()
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Error updating student details: {e}")
 
+@timed_operation
 def delete_student(student_id_to_delete):
     if CURRENT_USER_ROLE != "admin": print("Access Denied."); return
     student = get_student_by_id(student_id_to_delete)
@@ -191,56 +1178,104 @@ def delete_student(student_id_to_delete):
 
     confirm = input(f"Delete {student[1]} {student[2]} (ID: {student_id_to_delete})? (yes/no): ").lower()
     if confirm == 'yes':
-        conn = sqlite3.connect(DATABASE_NAME)
+        conn = get_connection(shard_for_student(student_id_to_delete))
         cursor = conn.cursor()
+        changes_before = conn.total_changes
         try:
             cursor.execute("DELETE FROM Students WHERE student_id = ?", (student_id_to_delete,))
             conn.commit()
+            invalidate_student(student_id_to_delete)
+            refresh_ranking(conn, student_id_to_delete, changes_before)
             if cursor.rowcount > 0: print(f"Student ID {student_id_to_delete} deleted.")
             else: print("Student not found or already deleted.")
-        except sqlite3.Error as e: print(f"Error deleting student: {e}")
-        finally: conn.close()
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"Error deleting student: {e}")
     else: print("Deletion cancelled.")
 
 # --- Subject Management Functions ---
+@timed_operation
 def add_subject(subject_name, max_marks=100):
-    conn = sqlite3.connect(DATABASE_NAME)
+    conn = get_connection()
     cursor = conn.cursor()
     try:
         cursor.execute("INSERT INTO Subjects (subject_name, max_marks) VALUES (?, ?)", (subject_name, max_marks))
+        subject_id = cursor.lastrowid
         conn.commit()
-        print(f"Subject '{subject_name}' added with ID: {cursor.lastrowid}.")
-        return cursor.lastrowid
     except sqlite3.IntegrityError:
+        conn.rollback()
         print(f"Error: Subject '{subject_name}' already exists.")
         cursor.execute("SELECT subject_id FROM Subjects WHERE subject_name = ?", (subject_name,))
-        return cursor.fetchone()[0] if cursor.fetchone() else None
-    except sqlite3.Error as e: print(f"Error adding subject: {e}"); return None
-    finally: conn.close()
+        row = cursor.fetchone()
+        return row[0] if row else None
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Error adding subject: {e}")
+        return None
+    invalidate_subject(subject_id)
+    try:
+        _replicate_subject(subject_id, subject_name, max_marks)
+    except sqlite3.Error as e:
+        print(f"Error adding subject: {e}")
+        return None
+    print(f"Subject '{subject_name}' added with ID: {subject_id}.")
+    return subject_id
 
-def view_all_subjects():
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT subject_id, subject_name, max_marks FROM Subjects ORDER BY subject_id")
-    subjects = cursor.fetchall()
-    conn.close()
-    if not subjects: print("No subjects found."); return []
-    print("\n--- All Subjects ---")
-    print("ID | Subject Name     | Max Marks")
-    print("---|------------------|-----------")
-    for sub in subjects: print(f"{sub[0]:<3}| {sub[1]:<16} | {sub[2]}")
-    print("---------------------------------")
-    return subjects
+def _replicate_subject(subject_id, subject_name, max_marks):
+    # Copies a subject the primary has committed to every shard under the same ID, which the
+    # marks' foreign keys need. A shard never holds a subject the primary lacks: if any copy
+    # fails, the subject is deleted again from the shards that took it and from the primary.
+    copied = []
+    try:
+        for shard in get_shards()[1:]:
+            shard_conn = get_connection(shard)
+            try:
+                shard_conn.execute("INSERT INTO Subjects (subject_id, subject_name, max_marks) VALUES (?, ?, ?)",
+                                   (subject_id, subject_name, max_marks))
+                shard_conn.commit()
+            except sqlite3.Error:
+                shard_conn.rollback()
+                raise
+            copied.append(shard)
+    except sqlite3.Error:
+        for database in copied + [DATABASE_NAME]:
+            undo_conn = get_connection(database)
+            undo_conn.execute("DELETE FROM Subjects WHERE subject_id = ?", (subject_id,))
+            undo_conn.commit()
+        invalidate_subject(subject_id)
+        raise
 
-def get_subject_by_id(subject_id):
-    conn = sqlite3.connect(DATABASE_NAME)
+def view_all_subjects(page_size=PAGE_SIZE):
+    if not browse_pages(lambda after, before: get_subjects_page(after, before, page_size),
+                        lambda sub: sub[0], _print_subjects_page, "All Subjects"):
+        print("No subjects found.")
+
+def _load_subject(subject_id):
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT subject_id, subject_name, max_marks FROM Subjects WHERE subject_id = ?", (subject_id,))
     subject = cursor.fetchone()
-    conn.close()
     return subject
 
+def get_subject_by_id(subject_id):
+    _check_lookup_caches()
+    return _subject_cache.get((DATABASE_NAME, subject_id), lambda: _load_subject(subject_id))
+
+def get_all_subjects():
+    # Every subject as a tuple of (subject_id, subject_name, max_marks), ordered by ID.
+    _check_lookup_caches()
+    return _subject_cache.get((DATABASE_NAME, None),
+                              lambda: tuple(get_connection().execute("SELECT subject_id, subject_name, max_marks FROM Subjects ORDER BY subject_id")))
+
 # --- Marks Management Functions ---
+# Upsert rather than INSERT OR REPLACE: REPLACE deletes the old row without
+# firing delete triggers, which would leave StudentTotals double-counted.
+_UPSERT_MARKS_SQL = '''
+    INSERT INTO Marks (student_id, subject_id, marks_obtained) VALUES (?, ?, ?)
+    ON CONFLICT(student_id, subject_id) DO UPDATE SET marks_obtained = excluded.marks_obtained
+    RETURNING mark_id'''
+
+@timed_operation
 def add_marks(student_id, subject_id, marks_obtained):
     if CURRENT_USER_ROLE != "admin": print("Access Denied."); return None
     if get_student_by_id(student_id) is None: print(f"Error: Student ID {student_id} not found."); return None
@@ -249,31 +1284,49 @@ def add_marks(student_id, subject_id, marks_obtained):
     max_m = sub_details[2]
     if not (0 <= marks_obtained <= max_m): print(f"Error: Marks ({marks_obtained}) must be 0-{max_m}."); return None
 
-    conn = sqlite3.connect(DATABASE_NAME)
+    if MARKS_WRITE_BEHIND != "off":
+        future = submit_marks(student_id, subject_id, marks_obtained)
+        if MARKS_WRITE_BEHIND == "async":
+            future.add_done_callback(functools.partial(_report_failed_marks, student_id, subject_id, marks_obtained))
+            print(f"Marks {marks_obtained} for student {student_id}, subject {subject_id} queued.")
+            return future
+        try:
+            mark_id = future.result()
+        except sqlite3.Error as e:
+            print(f"Error adding/replacing marks: {e}")
+            return None
+        print(f"Marks {marks_obtained} for student {student_id}, subject {subject_id} recorded.")
+        return mark_id
+
+    conn = get_connection(shard_for_student(student_id))
     cursor = conn.cursor()
+    changes_before = conn.total_changes
     try:
-        cursor.execute("INSERT OR REPLACE INTO Marks (student_id, subject_id, marks_obtained) VALUES (?, ?, ?)",
-                       (student_id, subject_id, marks_obtained))
+        cursor.execute(_UPSERT_MARKS_SQL, (student_id, subject_id, marks_obtained))
+        mark_id = cursor.fetchone()[0]
         conn.commit()
+        refresh_ranking(conn, student_id, changes_before)
         print(f"Marks {marks_obtained} for student {student_id}, subject {subject_id} recorded.")
-        return cursor.lastrowid 
-    except sqlite3.Error as e: print(f"Error adding/replacing marks: {e}"); return None
-    finally: conn.close()
+        return mark_id
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Error adding/replacing marks: {e}")
+        return None
 
+@timed_operation
 def view_student_marks(student_id, print_header=True):
     student = get_student_by_id(student_id)
     if not student:
         if print_header: print(f"Student with ID {student_id} not found.")
         return None, 0, 0
 
-    conn = sqlite3.connect(DATABASE_NAME)
+    conn = get_connection(shard_for_student(student_id))
     cursor = conn.cursor()
     cursor.execute('''
         SELECT s.subject_name, m.marks_obtained, s.max_marks
         FROM Marks m JOIN Subjects s ON m.subject_id = s.subject_id
         WHERE m.student_id = ? ''', (student_id,))
     marks_data = cursor.fetchall()
-    conn.close()
 
     if not marks_data:
         if print_header: print(f"No marks found for {student[1]} {student[2]} (ID: {student_id}).")
@@ -284,143 +1337,2132 @@ def view_student_marks(student_id, print_header=True):
         print("Subject          | Marks Obtained | Max Marks")
         print("-----------------|----------------|-----------")
 
-    total_obtained, total_max_marks = 0, 0
-    for row in marks_data:
-        if print_header: print(f"{row[0]:<16} | {row[1]:<14} | {row[2]}")
-        total_obtained += row[1] if row[1] is not None else 0
-        total_max_marks += row[2] if row[2] is not None else 0
-    
-    percentage = 0
+    if print_header:
+        for row in marks_data: print(f"{row[0]:<16} | {row[1]:<14} | {row[2]}")
+
+    # The same totals and rounded percentage that rankings and reports read
+    cursor.execute("SELECT total_obtained, total_max_marks, percentage FROM StudentTotals WHERE student_id = ?", (student_id,))
+    total_obtained, total_max_marks, percentage = cursor.fetchone() or (0, 0, 0.0)
     if print_header:
         print("-----------------|----------------|-----------")
         print(f"{'Total:':<16} | {total_obtained:<14} | {total_max_marks}")
-        if total_max_marks > 0:
-            percentage = (total_obtained / total_max_marks) * 100
-            print(f"Percentage: {percentage:.2f}%")
+        if total_max_marks > 0: print(f"Percentage: {percentage:.2f}%")
         else: print("Percentage: N/A")
         print("-------------------------------------------")
-    elif total_max_marks > 0: # Calculate percentage even if not printing header
-        percentage = (total_obtained / total_max_marks) * 100
-        
+
     return marks_data, total_obtained, percentage
 
+# --- Write-Behind Marks Queue ---
+# Optional (SRMS_WRITE_BEHIND=async|commit|fsync, or enable_write_behind()). add_marks checks
+# the mark against the cached student and subject rows, queues it, and one background thread
+# applies queued marks in grouped transactions of up to MARKS_BATCH_SIZE writes. Admins
+# entering marks at the same time then share one commit (and one fsync) and never contend for
+# the write lock. Durability per mode:
+#   async  - add_marks returns a Future once the mark is queued; marks not yet committed are lost if the process dies
+#   commit - add_marks waits for its batch to commit (synchronous=NORMAL, survives an application crash)
+#   fsync  - like commit, with synchronous=FULL on the writer so committed batches survive power loss
+# In async mode nobody waits on the Future, so a mark the writer couldn't save (the student was
+# deleted meanwhile, the database stayed locked, ...) is reported on stderr and counted in the
+# performance stats. logout() and interpreter exit drain the queue. The writer doesn't touch the
+# live ranking index: its commits move PRAGMA data_version for every other connection, so each
+# thread's index goes stale and is rebuilt on that thread's next ranking query.
+WRITE_BEHIND_MODES = ("off", "async", "commit", "fsync")
+MARKS_WRITE_BEHIND = os.environ.get("SRMS_WRITE_BEHIND", "off")
+MARKS_BATCH_SIZE = 500    # Most marks per transaction
+MARKS_BATCH_WINDOW = 0.02 # Seconds the writer waits to fill a batch in async mode
+
+_marks_writer = {"thread": None, "queue": None, "lock": threading.Lock(), "batches": 0, "writes": 0, "failed": 0}
+
+def enable_write_behind(mode="commit"):
+    global MARKS_WRITE_BEHIND
+    if mode not in WRITE_BEHIND_MODES: raise ValueError(f"Write-behind mode must be one of {', '.join(WRITE_BEHIND_MODES)}.")
+    flush_marks_queue()
+    MARKS_WRITE_BEHIND = mode
+
+def _marks_queue():
+    # The writer's queue, starting the writer thread on first use.
+    with _marks_writer["lock"]:
+        if _marks_writer["thread"] is None:
+            import queue
+            pending = _marks_writer["queue"] = queue.Queue()
+            _marks_writer["thread"] = threading.Thread(target=_marks_writer_loop, args=(pending,), name="srms-marks-writer", daemon=True)
+            _marks_writer["thread"].start()
+        return _marks_writer["queue"]
+
+def submit_marks(student_id, subject_id, marks_obtained):
+    # Queues an already validated write. The Future resolves to the mark ID or raises the error that stopped it.
+    import concurrent.futures
+    future = concurrent.futures.Future()
+    _marks_queue().put((shard_for_student(student_id) or DATABASE_NAME, student_id, subject_id, marks_obtained, future))
+    return future
+
+def _report_failed_marks(student_id, subject_id, marks_obtained, future):
+    # Done-callback of a mark queued in async mode; runs on the writer thread.
+    error = future.exception()
+    if error is None: return
+    with _marks_writer["lock"]: _marks_writer["failed"] += 1
+    print(f"Error: queued marks {marks_obtained} for student {student_id}, subject {subject_id} were not saved: {error}",
+          file=sys.stderr)
+
+def _marks_writer_loop(pending):
+    import queue
+    stopping = False
+    while not stopping:
+        batch = [pending.get()]
+        # Waiting callers can't add more marks until their batch commits, so only async mode
+        # waits to fill one; otherwise the batch is whatever queued up during the last commit.
+        deadline = time.monotonic() + (MARKS_BATCH_WINDOW if MARKS_WRITE_BEHIND == "async" else 0.0)
+        while batch[-1] is not None and len(batch) < MARKS_BATCH_SIZE:
+            try: batch.append(pending.get(timeout=max(0.0, deadline - time.monotonic())))
+            except queue.Empty: break
+        if batch[-1] is None: stopping = True # stop_marks_writer(): finish this batch, then exit
+        writes = [item for item in batch if item is not None]
+        try:
+            if writes: _write_marks_batch(writes)
+        except Exception as e: # The writer must outlive any one batch, and no caller may wait forever
+            for item in writes:
+                if not item[4].done(): item[4].set_exception(e)
+        finally:
+            for _ in batch: pending.task_done()
+
+def _write_marks_batch(writes):
+    by_database = {} # Keeps submission order, so a later mark for the same subject wins
+    for item in writes: by_database.setdefault(item[0], []).append(item)
+    operation = begin_operation("marks write-behind batch")
+    try:
+        for database, items in by_database.items():
+            conn, results = None, []
+            try:
+                conn = get_connection(database)
+                conn.execute(f"PRAGMA synchronous = {'FULL' if MARKS_WRITE_BEHIND == 'fsync' else DB_PRAGMAS['synchronous']}")
+                conn.execute("BEGIN IMMEDIATE")
+                for _, student_id, subject_id, marks_obtained, future in items:
+                    # A failing statement (e.g. the student was deleted meanwhile) only undoes itself.
+                    try: results.append((future, conn.execute(_UPSERT_MARKS_SQL, (student_id, subject_id, marks_obtained)).fetchone()[0]))
+                    except sqlite3.Error as e: results.append((future, e))
+                conn.commit()
+            except Exception as e: # Every future of the batch gets the error
+                try:
+                    if conn is not None and conn.in_transaction: conn.rollback()
+                except sqlite3.Error: pass
+                results = [(item[4], e) for item in items]
+            for future, result in results:
+                if isinstance(result, Exception): future.set_exception(result)
+                else: future.set_result(result)
+            with _marks_writer["lock"]:
+                _marks_writer["batches"] += 1
+                _marks_writer["writes"] += len(items)
+    finally: end_operation(operation)
+
+def flush_marks_queue():
+    # Blocks until every queued mark has been committed or has failed.
+    pending = _marks_writer["queue"]
+    if pending is not None: pending.join()
+
+def stop_marks_writer():
+    with _marks_writer["lock"]:
+        thread, pending = _marks_writer["thread"], _marks_writer["queue"]
+        _marks_writer["thread"] = _marks_writer["queue"] = None
+    if thread is None: return
+    pending.put(None)
+    thread.join()
+
+atexit.register(stop_marks_writer) # Runs before close_all_connections (atexit is last-in, first-out)
+
+# --- Bulk Import ---
+# Streams a CSV (header row required) or JSON-lines file and loads it with executemany
+# upserts. Rows are validated a batch at a time; rejected rows are reported with their
+# line number and never abort the rest of the import.
+IMPORT_BATCH_SIZE = 5000
+IMPORT_KINDS = ("students", "subjects", "marks")
+
+def _iter_import_rows(path):
+    import csv, json # Deferred: only needed for imports
+    if path.lower().endswith((".jsonl", ".ndjson", ".json")):
+        with open(path, encoding="utf-8") as f:
+            for line_no, line in enumerate(f, start=1):
+                if not line.strip(): continue
+                try: row = json.loads(line)
+                except ValueError as e:
+                    yield line_no, None, f"invalid JSON ({e})"
+                    continue
+                if isinstance(row, dict): yield line_no, row, None
+                else: yield line_no, None, "expected a JSON object"
+    else:
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, {k.strip(): v for k, v in row.items() if k}, None
+
+def _import_int(row, key):
+    value = row.get(key)
+    if value is None or str(value).strip() == "": raise ValueError(f"missing {key}")
+    try: return int(str(value).strip())
+    except ValueError: raise ValueError(f"{key} must be an integer, got {value!r}")
+
+def _import_text(row, key, required=True):
+    value = row.get(key)
+    value = str(value).strip() if value is not None else ""
+    if required and not value: raise ValueError(f"missing {key}")
+    return value or None
+
+def _validate_students_batch(cursor, batch, rejected):
+    with_id, without_id = [], []
+    for line_no, row in batch:
+        try:
+            student_id = _import_int(row, "student_id") if _import_text(row, "student_id", False) else None
+            values = (_import_text(row, "first_name"), _import_text(row, "last_name"),
+                      _import_text(row, "class_section"), _import_text(row, "password", False))
+        except ValueError as e:
+            rejected.append((line_no, str(e)))
+            continue
+        if student_id is None: without_id.append(values)
+        else: with_id.append((student_id,) + values)
+    if without_id:
+        cursor.executemany("INSERT INTO Students (first_name, last_name, class_section, password_hash) VALUES (?, ?, ?, ?)",
+                           without_id)
+    if with_id:
+        cursor.executemany('''
+            INSERT INTO Students (student_id, first_name, last_name, class_section, password_hash) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(student_id) DO UPDATE SET first_name = excluded.first_name, last_name = excluded.last_name,
+                class_section = excluded.class_section, password_hash = COALESCE(excluded.password_hash, password_hash)''',
+            with_id)
+    return len(with_id) + len(without_id)
+
+def _validate_subjects_batch(cursor, batch, rejected):
+    values = []
+    for line_no, row in batch:
+        try:
+            name = _import_text(row, "subject_name")
+            max_marks = _import_int(row, "max_marks") if _import_text(row, "max_marks", False) else 100
+            if max_marks <= 0: raise ValueError(f"max_marks must be positive, got {max_marks}")
+        except ValueError as e:
+            rejected.append((line_no, str(e)))
+            continue
+        values.append((name, max_marks))
+    cursor.executemany('''
+        INSERT INTO Subjects (subject_name, max_marks) VALUES (?, ?)
+        ON CONFLICT(subject_name) DO UPDATE SET max_marks = excluded.max_marks''', values)
+    return len(values)
+
+def _validate_marks_batch(cursor, batch, rejected, subjects):
+    parsed = []
+    for line_no, row in batch:
+        try:
+            student_id = _import_int(row, "student_id")
+            if _import_text(row, "subject_id", False): subject_id = _import_int(row, "subject_id")
+            else:
+                name = _import_text(row, "subject_name")
+                if name.lower() not in subjects["by_name"]: raise ValueError(f"subject '{name}' not found")
+                subject_id = subjects["by_name"][name.lower()]
+            marks = _import_int(row, "marks_obtained")
+        except ValueError as e:
+            rejected.append((line_no, str(e)))
+            continue
+        max_m = subjects["max_marks"].get(subject_id)
+        if max_m is None:
+            rejected.append((line_no, f"subject ID {subject_id} not found"))
+            continue
+        if not (0 <= marks <= max_m):
+            rejected.append((line_no, f"marks ({marks}) must be 0-{max_m}"))
+            continue
+        parsed.append((line_no, student_id, subject_id, marks))
+
+    # One round trip checks every student referenced by the batch.
+    ids = "[" + ",".join(str(p[1]) for p in parsed) + "]"
+    cursor.execute("SELECT student_id FROM Students WHERE student_id IN (SELECT value FROM json_each(?))", (ids,))
+    known = {r[0] for r in cursor.fetchall()}
+    values = []
+    for line_no, student_id, subject_id, marks in parsed:
+        if student_id in known: values.append((student_id, subject_id, marks))
+        else: rejected.append((line_no, f"student ID {student_id} not found"))
+    cursor.executemany('''
+        INSERT INTO Marks (student_id, subject_id, marks_obtained) VALUES (?, ?, ?)
+        ON CONFLICT(student_id, subject_id) DO UPDATE SET marks_obtained = excluded.marks_obtained''', values)
+    return len(values)
+
+@timed_operation
+def bulk_import(path, kind="marks", batch_size=IMPORT_BATCH_SIZE, single_transaction=True):
+    # Returns (rows_imported, [(line_no, reason), ...]). With single_transaction=False each
+    # batch is committed on its own, which keeps the WAL small for very large files.
+    import csv # Deferred: only needed for imports
+    if kind not in IMPORT_KINDS: raise ValueError(f"Unknown import kind '{kind}' (expected one of {', '.join(IMPORT_KINDS)}).")
+    conn = get_connection()
+    cursor = conn.cursor()
+    subjects = None
+    if kind == "marks":
+        subjects = {"max_marks": {}, "by_name": {}}
+        for sid, name, max_m in get_all_subjects():
+            subjects["max_marks"][sid] = max_m
+            subjects["by_name"][name.lower()] = sid
+
+    imported, rejected, batch = 0, [], []
+    def flush():
+        nonlocal imported
+        if kind == "students": imported += _validate_students_batch(cursor, batch, rejected)
+        elif kind == "subjects": imported += _validate_subjects_batch(cursor, batch, rejected)
+        else: imported += _validate_marks_batch(cursor, batch, rejected, subjects)
+        batch.clear()
+        if not single_transaction: conn.commit()
+    try:
+        for line_no, row, error in _iter_import_rows(path):
+            if error:
+                rejected.append((line_no, error))
+                continue
+            batch.append((line_no, row))
+            if len(batch) >= batch_size: flush()
+        if batch: flush()
+        conn.commit()
+    except (sqlite3.Error, OSError):
+        conn.rollback()
+        raise
+    except csv.Error as e:
+        conn.rollback()
+        raise ValueError(f"malformed CSV: {e}")
+    finally: # Rows are upserted by ID or name, so drop the whole cache rather than track each one
+        if kind == "students": _student_cache.clear()
+        elif kind == "subjects": _subject_cache.clear()
+    rejected.sort()
+    return imported, rejected
+
+def run_bulk_import(path, kind="marks", max_errors_shown=20):
+    if CURRENT_USER_ROLE != "admin": print("Access Denied."); return None
+    try: imported, rejected = bulk_import(path, kind)
+    except (ValueError, sqlite3.Error, OSError) as e: print(f"Import failed, nothing was saved: {e}"); return None
+    print(f"Imported {imported} {kind} row(s) from '{path}'. Rejected: {len(rejected)}.")
+    for line_no, reason in rejected[:max_errors_shown]: print(f"  line {line_no}: {reason}")
+    if len(rejected) > max_errors_shown: print(f"  ... and {len(rejected) - max_errors_shown} more.")
+    return imported, rejected
+
+# --- Bulk Loading ---
+# For seeding a database (generated or converted data) rather than day-to-day imports: inside
+# bulk_load() rows are written without the per-row triggers that maintain StudentTotals, the
+# search index and the change log. The triggers are put back and the derived tables rebuilt
+# once, in the same transaction. Nothing loaded this way reaches the change log, so replicas
+# take a full copy afterwards.
+_DERIVED_TRIGGERS = {sql.split()[5]: sql for sql in (*_STUDENT_TOTALS_SCHEMA, *_SEARCH_INDEX_SCHEMA, *_CHANGE_LOG_SCHEMA)
+                     if sql.startswith("CREATE TRIGGER")} # name -> CREATE statement
+
+def rebuild_derived_tables(conn=None):
+    # Recomputes StudentTotals and the search index from the base tables. The caller commits.
+    conn = conn or get_connection()
+    for sql in _REBUILD_TOTALS_SQL: conn.execute(sql)
+    if has_search_index(conn):
+        conn.execute("INSERT INTO StudentSearch (StudentSearch) VALUES ('rebuild')")
+        conn.execute("INSERT INTO SubjectSearch (SubjectSearch) VALUES ('rebuild')")
+
+@contextlib.contextmanager
+def bulk_load(database=None):
+    # Yields the connection inside one transaction, committed on a clean exit (don't commit
+    # inside the block) and rolled back on an exception.
+    conn = get_connection(database)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        suspended = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")
+                     if row[0] in _DERIVED_TRIGGERS]
+        for name in suspended: conn.execute(f"DROP TRIGGER {name}")
+        yield conn
+        for name in suspended: conn.execute(_DERIVED_TRIGGERS[name])
+        rebuild_derived_tables(conn)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally: clear_lookup_caches()
+
+# --- Report Totals ---
+def rebuild_student_totals():
+    # Every shard's totals cover only its own students, so each is rebuilt on its own.
+    rebuilt = 0
+    for database in get_shards() or [DATABASE_NAME]:
+        conn = get_connection(database)
+        try:
+            for sql in _REBUILD_TOTALS_SQL: conn.execute(sql)
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        rebuilt += conn.execute("SELECT COUNT(*) FROM StudentTotals").fetchone()[0]
+    return rebuilt
+
+def check_student_totals():
+    # Returns the IDs of students whose cached totals differ from a fresh aggregate.
+    mismatched = []
+    for database in get_shards() or [DATABASE_NAME]:
+        cursor = get_connection(database).cursor()
+        cursor.execute(f'''
+            SELECT live.student_id FROM ({_LIVE_TOTALS_SQL}) live
+            LEFT JOIN StudentTotals t ON t.student_id = live.student_id
+            WHERE t.student_id IS NULL OR t.total_obtained != live.total_obtained
+                  OR t.total_max_marks != live.total_max_marks
+            UNION
+            SELECT student_id FROM StudentTotals WHERE student_id NOT IN (SELECT student_id FROM Students)''')
+        mismatched += [row[0] for row in cursor.fetchall()]
+    return sorted(mismatched)
+
+def verify_student_totals(repair=False):
+    mismatched = check_student_totals()
+    if not mismatched: print("Report totals are consistent with the marks."); return True
+    shown = ", ".join(str(i) for i in mismatched[:20]) + (" ..." if len(mismatched) > 20 else "")
+    print(f"Report totals out of date for {len(mismatched)} student(s): {shown}")
+    if repair: print(f"Rebuilt report totals for {rebuild_student_totals()} student(s).")
+    return False
+
+# --- Change Data Capture ---
+# Triggers (migration 7) append every insert, update and delete on Students, Subjects and Marks
+# to ChangeLog with a full JSON image of the row, so replicas, caches and backups can follow the
+# database by reading only what changed since their last cursor (a seq). SQLite has one writer at
+# a time, so sequence numbers become visible in order and a cursor never skips a late commit.
+# Consumers apply entries as upserts/deletes keyed by (table, id); a "clear" entry (written when
+# a term closes) means every row of that table is gone.
+# compact_changelog() drops entries superseded by a later entry for the same row, but only within
+# a run of consecutive entries for one table: the survivors stay in seq order across tables, so a
+# mark is never exported ahead of the student or subject it refers to. That is safe for every
+# consumer. purge_changelog() drops everything up to a seq; consumers behind it have to start
+# over from a full copy.
+
+def get_changelog_status(conn=None):
+    conn = conn or get_connection()
+    latest, oldest, entries = conn.execute(
+        "SELECT (SELECT seq FROM sqlite_sequence WHERE name = 'ChangeLog'), MIN(seq), COUNT(*) FROM ChangeLog").fetchone()
+    purged = conn.execute("SELECT purged_through FROM ChangeLogState").fetchone()[0]
+    return {"latest_seq": latest or 0, "oldest_seq": oldest, "entries": entries, "purged_through": purged}
+
+def iter_changes(since=0, limit=None, batch_size=FETCH_BATCH_SIZE):
+    # (seq, table_name, op, row_id, changed_at, data) after cursor `since`, oldest first.
+    purged = get_connection().execute("SELECT purged_through FROM ChangeLogState").fetchone()[0]
+    if since < purged:
+        raise ValueError(f"Changes up to {purged} have been purged, so cursor {since} can't be caught up; "
+                         "start again from a full copy.")
+    return iter_query("SELECT seq, table_name, op, row_id, changed_at, data FROM ChangeLog WHERE seq > ? ORDER BY seq LIMIT ?",
+                      (since, -1 if limit is None else limit), batch_size=batch_size)
+
+def export_changes(out, since=0, limit=None):
+    # Writes one JSON object per change to out. Returns (changes written, cursor for the next export).
+    import json
+    count, cursor = 0, since
+    for seq, table, op, row_id, changed_at, data in iter_changes(since, limit):
+        # The row image is already JSON from SQLite, so it is spliced in rather than re-encoded.
+        out.write(f'{{"seq": {seq}, "table": {json.dumps(table)}, "op": {json.dumps(op)}, "id": {json.dumps(row_id)}, '
+                  f'"at": {json.dumps(changed_at)}, "row": {data or "null"}}}\n')
+        count, cursor = count + 1, seq
+    return count, cursor
+
+def compact_changelog(before_seq=None):
+    # Removes entries (with seq < before_seq; default all) that a later entry for the same row in
+    # the same single-table run supersedes, and Marks entries older than the latest clear.
+    # Returns how many were removed.
+    before_seq = float("inf") if before_seq is None else before_seq
+    conn = get_connection()
+    try:
+        removed = conn.execute('''
+            DELETE FROM ChangeLog WHERE seq IN (
+                SELECT seq FROM (
+                    SELECT seq, op, MAX(seq) OVER (PARTITION BY run, row_id) AS latest
+                    FROM (SELECT seq, op, row_id, SUM(new_run) OVER (ORDER BY seq) AS run -- Runs of one table
+                          FROM (SELECT seq, op, row_id, table_name IS NOT LAG(table_name) OVER (ORDER BY seq) AS new_run
+                                FROM ChangeLog)))
+                WHERE seq < ? AND seq != latest AND op != 'clear')''', (before_seq,)).rowcount
+        removed += conn.execute('''
+            DELETE FROM ChangeLog WHERE seq < ? AND op != 'clear' AND table_name IN (SELECT table_name FROM ChangeLog WHERE op = 'clear')
+              AND seq < (SELECT MAX(seq) FROM ChangeLog c WHERE c.table_name = ChangeLog.table_name AND c.op = 'clear')''',
+            (before_seq,)).rowcount
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    return removed
+
+def purge_changelog(through_seq):
+    # Drops every entry up to through_seq. Returns how many were removed.
+    conn = get_connection()
+    try:
+        removed = conn.execute("DELETE FROM ChangeLog WHERE seq <= ?", (through_seq,)).rowcount
+        conn.execute("UPDATE ChangeLogState SET purged_through = MAX(purged_through, ?)", (through_seq,))
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    return removed
+
+# --- Ranking Engine ---
+# Rankings are computed in SQL over StudentTotals with RANK() (competition ranking: 1, 1, 3) over the
+# same rounded score the reports display, ties listed by student ID. For top-N the
+# inner ORDER BY ... LIMIT walks the score index and stops after N rows; ranking that subset
+# gives the same ranks as ranking everyone, because every higher score is inside it.
+RANK_SORT_KEYS = ("percentage", "total_obtained")
+
+_SCORED_STUDENTS_SQL = '''
+    SELECT t.student_id AS id, st.first_name, st.last_name, st.class_section,
+           t.total_obtained, t.total_max_marks, t.percentage
+    FROM StudentTotals t JOIN Students st ON st.student_id = t.student_id '''
+
+RANKING_COLUMNS = ("rank", "id", "first_name", "last_name", "class_section",
+                   "total_obtained", "total_max_marks", "percentage")
+
+@timed_operation
+def get_ranked_students(sort_key="percentage", limit=None, by_class=False):
+    # limit applies per class when by_class is set; rank is then the rank within the class.
+    if sort_key not in RANK_SORT_KEYS: raise ValueError(f"Cannot rank by '{sort_key}'.")
+    if get_shards(): return _get_ranked_students_sharded(sort_key, limit, by_class)
+    if not by_class and limit is not None and 0 <= int(limit) <= RANK_INDEX_MAX_TOP:
+        return _get_top_from_index(sort_key, int(limit))
+    limit = -1 if limit is None else int(limit) # LIMIT -1 means no limit in SQLite
+    if by_class:
+        sql = f'''
+            SELECT rank, id, first_name, last_name, class_section, total_obtained, total_max_marks, percentage
+            FROM (SELECT *, RANK() OVER (PARTITION BY class_section ORDER BY {sort_key} DESC) AS rank,
+                         ROW_NUMBER() OVER (PARTITION BY class_section ORDER BY {sort_key} DESC, id) AS row_num
+                  FROM ({_SCORED_STUDENTS_SQL}))
+            WHERE ? < 0 OR row_num <= ?
+            ORDER BY class_section, row_num'''
+        params = (limit, limit)
+    else:
+        sql = f'''
+            SELECT RANK() OVER (ORDER BY {sort_key} DESC) AS rank, *
+            FROM ({_SCORED_STUDENTS_SQL} ORDER BY t.{sort_key} DESC, t.student_id LIMIT ?)
+            ORDER BY {sort_key} DESC, id'''
+        params = (limit,)
+    cursor = get_connection().cursor()
+    cursor.execute(sql, params)
+    return [dict(zip(RANKING_COLUMNS, row)) for row in cursor.fetchall()]
+
+def _get_top_from_index(sort_key, limit):
+    # Ranks and order from the live index; only the listed students' rows are read.
+    ranked = get_ranking_index().top(limit, sort_key)
+    if not ranked: return []
+    ids = [student_id for _, student_id in ranked]
+    rows = {row[0]: row for row in get_connection().execute(
+        f"{_SCORED_STUDENTS_SQL} WHERE t.student_id IN ({', '.join('?' * len(ids))})", ids)}
+    return [dict(zip(RANKING_COLUMNS, (rank,) + tuple(rows[student_id]))) for rank, student_id in ranked if student_id in rows]
+
+def _get_ranked_students_sharded(sort_key, limit, by_class):
+    # Ranks are assigned after merging, since a shard can't know how many higher scores the
+    # others hold. A full ranking ranks the merged performance table column-wise; for top-N
+    # each shard returns at most `limit` rows (per class) in merge order.
+    if limit is None: return get_student_performance_data().ranked(sort_key, by_class).to_dicts()
+    sql_limit = int(limit)
+    if by_class:
+        sql = f'''
+            SELECT id, first_name, last_name, class_section, total_obtained, total_max_marks, percentage
+            FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY class_section ORDER BY {sort_key} DESC, id) AS row_num
+                  FROM ({_SCORED_STUDENTS_SQL}))
+            WHERE ? < 0 OR row_num <= ?
+            ORDER BY class_section, row_num'''
+        params = (sql_limit, sql_limit)
+    else:
+        sql = f"{_SCORED_STUDENTS_SQL} ORDER BY t.{sort_key} DESC, t.student_id LIMIT ?"
+        params = (sql_limit,)
+    return _merge_ranked(fan_out_query(sql, params), sort_key, sql_limit, by_class)
+
+def _print_ranking_table(ranked_list, by_class=False):
+    write_report(ranked_list, RANKING_REPORT, group_by=("Class", "class_section") if by_class else None)
+
+# --- Live Ranking Index ---
+# In-process order statistics over StudentTotals, so "rank of student X", top-N and "how many
+# below a threshold" don't scan the score index. Per sort key a Fenwick tree counts students per
+# score bucket (percentage in hundredths, which is exactly how it is stored, or total marks) and
+# a bucket -> IDs map lists who is in it. Built on first use; add_student, delete_student and
+# add_marks then update the one student in O(log n). Any other write (imports, rebuilds, term
+# closes, another process) makes the next query rebuild it: each thread remembers the
+# PRAGMA data_version (commits by other connections) and total_changes (writes on its own
+# connection) the index was current for. Sharded databases rank with fan-out queries instead.
+RANK_INDEX_MAX_TOP = 1000 # Bigger top-N requests walk the score index in SQL
+
+class FenwickTree:
+    # Counts per bucket 0..size-1 with O(log n) prefix sums and k-th element search.
+    def __init__(self, counts):
+        self.size = len(counts)
+        self._tree = [0] + list(counts)
+        for i in range(1, self.size + 1): # O(n) build
+            parent = i + (i & -i)
+            if parent <= self.size: self._tree[parent] += self._tree[i]
+
+    def add(self, bucket, delta):
+        i = bucket + 1
+        while i <= self.size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def prefix(self, bucket):
+        # Total count in buckets 0..bucket.
+        i, total = min(bucket, self.size - 1) + 1, 0
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def find(self, k):
+        # Smallest bucket whose prefix() reaches k (1 <= k <= total count).
+        position, step = 0, 1 << self.size.bit_length()
+        while step:
+            if position + step <= self.size and self._tree[position + step] < k:
+                position += step
+                k -= self._tree[position]
+            step >>= 1
+        return position
+
+class RankingIndex:
+    # One sort key: student ID -> bucket, ranked highest bucket first, ties by ID like the SQL.
+    def __init__(self, buckets, size):
+        self.buckets = buckets
+        self.members = collections.defaultdict(set)
+        counts = [0] * size
+        for student_id, bucket in buckets.items():
+            self.members[bucket].add(student_id)
+            counts[bucket] += 1
+        self.tree = FenwickTree(counts)
+
+    def fits(self, bucket):
+        return 0 <= bucket < self.tree.size
+
+    def set(self, student_id, bucket):
+        old = self.buckets.get(student_id)
+        if old == bucket: return
+        if old is not None: self.remove(student_id)
+        self.buckets[student_id] = bucket
+        self.members[bucket].add(student_id)
+        self.tree.add(bucket, 1)
+
+    def remove(self, student_id):
+        bucket = self.buckets.pop(student_id, None)
+        if bucket is None: return
+        self.members[bucket].discard(student_id)
+        if not self.members[bucket]: del self.members[bucket]
+        self.tree.add(bucket, -1)
+
+    def count_above(self, bucket):
+        return len(self.buckets) - self.tree.prefix(bucket)
+
+    def count_below(self, bucket):
+        return self.tree.prefix(bucket - 1) if bucket > 0 else 0
+
+    def top(self, n):
+        # [(rank, student_id)] for the first n students in ranking order.
+        ranked, position, n = [], 1, min(n, len(self.buckets))
+        while position <= n:
+            bucket = self.tree.find(len(self.buckets) - position + 1) # position-th highest
+            tied = sorted(self.members[bucket])
+            ranked.extend((position, student_id) for student_id in tied[:n - position + 1])
+            position += len(tied)
+        return ranked
+
+def _score_bucket(sort_key, score):
+    return round(score * 100) if sort_key == "percentage" else int(score)
+
+class LiveRankingIndex:
+    def __init__(self, database):
+        self.database = database
+        self.builds = self.updates = 0
+        self._lock = threading.Lock() # The API's query threads share the index
+        self._by_key = None           # sort key -> RankingIndex; None until (re)built
+        self._ungraded = set()        # Students with no graded subject (never "below threshold")
+
+    def _stamp(self, conn):
+        return (id(conn), conn.execute("PRAGMA data_version").fetchone()[0], conn.total_changes)
+
+    def _current(self):
+        # Caller holds the lock. Rebuilds unless this thread's connection has seen no change since.
+        conn = get_connection(self.database)
+        stamps = getattr(_local, "ranking_stamps", None)
+        if stamps is None: stamps = _local.ranking_stamps = {}
+        stamp = self._stamp(conn)
+        if self._by_key is None or stamps.get(self.database) != stamp: self._build(conn)
+        stamps[self.database] = stamp
+        return self._by_key
+
+    def _build(self, conn):
+        rows = conn.execute("SELECT student_id, total_obtained, total_max_marks, percentage FROM StudentTotals").fetchall()
+        most_marks = conn.execute("SELECT COALESCE(SUM(max_marks), 0) FROM Subjects").fetchone()[0]
+        self._by_key = {}
+        for sort_key, column in (("percentage", 3), ("total_obtained", 1)):
+            buckets = {row[0]: _score_bucket(sort_key, row[column]) for row in rows}
+            size = max(10001 if sort_key == "percentage" else most_marks + 1, max(buckets.values(), default=0) + 1)
+            self._by_key[sort_key] = RankingIndex(buckets, size)
+        self._ungraded = {row[0] for row in rows if not row[2]}
+        self.builds += 1
+
+    def refresh_student(self, conn, student_id, changes_before):
+        # After a write on conn that only touched this student's totals: update the index in
+        # place if it was current just before the write, otherwise leave it to be rebuilt.
+        with self._lock:
+            stamps = getattr(_local, "ranking_stamps", {})
+            if self._by_key is None or stamps.get(self.database) != self._stamp(conn)[:2] + (changes_before,): return
+            row = conn.execute("SELECT total_obtained, total_max_marks, percentage FROM StudentTotals WHERE student_id = ?",
+                               (student_id,)).fetchone()
+            for sort_key, index in self._by_key.items():
+                if row is None:
+                    index.remove(student_id)
+                    continue
+                bucket = _score_bucket(sort_key, row[2] if sort_key == "percentage" else row[0])
+                if not index.fits(bucket):
+                    self._by_key = None
+                    return
+                index.set(student_id, bucket)
+            if row is not None and row[1]: self._ungraded.discard(student_id)
+            else: self._ungraded.add(student_id)
+            stamps[self.database] = self._stamp(conn)
+            self.updates += 1
+
+    def rank(self, student_id, sort_key="percentage"):
+        # (rank, students ranked) or None if the student has no totals row.
+        with self._lock:
+            index = self._current()[sort_key]
+            bucket = index.buckets.get(student_id)
+            return None if bucket is None else (index.count_above(bucket) + 1, len(index.buckets))
+
+    def top(self, n, sort_key="percentage"):
+        with self._lock: return self._current()[sort_key].top(n)
+
+    def position(self, sort_key, score, student_id):
+        # (students with a higher score, students tied on score with a lower ID).
+        with self._lock:
+            index = self._current()[sort_key]
+            bucket = _score_bucket(sort_key, score)
+            return index.count_above(bucket), sum(1 for other in index.members.get(bucket, ()) if other < student_id)
+
+    def count_below(self, threshold):
+        # Graded students whose percentage is below threshold (what get_failed_students lists).
+        with self._lock:
+            index = self._current()["percentage"]
+            cutoff = max(0, math.ceil(threshold * 100))
+            while cutoff > 0 and (cutoff - 1) / 100 >= threshold: cutoff -= 1 # Float edge cases
+            while cutoff / 100 < threshold: cutoff += 1
+            return index.count_below(cutoff) - (len(self._ungraded) if cutoff > 0 else 0)
+
+    def stats(self):
+        with self._lock:
+            return {"students": len(self._by_key["percentage"].buckets) if self._by_key else 0,
+                    "builds": self.builds, "updates": self.updates}
+
+_ranking_indexes = {} # DATABASE_NAME -> LiveRankingIndex
+
+def get_ranking_index():
+    # The live index for DATABASE_NAME, or None for a sharded database.
+    if get_shards(): return None
+    index = _ranking_indexes.get(DATABASE_NAME)
+    if index is None: index = _ranking_indexes.setdefault(DATABASE_NAME, LiveRankingIndex(DATABASE_NAME))
+    return index
+
+def refresh_ranking(conn, student_id, changes_before):
+    index = _ranking_indexes.get(DATABASE_NAME)
+    if index is not None: index.refresh_student(conn, student_id, changes_before)
+
+def get_student_rank(student_id, sort_key="percentage"):
+    # (rank, students ranked) as in the overall rankings, or None.
+    if sort_key not in RANK_SORT_KEYS: raise ValueError(f"Cannot rank by '{sort_key}'.")
+    index = get_ranking_index()
+    if index is not None: return index.rank(student_id, sort_key)
+    row = get_connection(shard_for_student(student_id) or DATABASE_NAME).execute(
+        f"SELECT {sort_key} FROM StudentTotals WHERE student_id = ?", (student_id,)).fetchone()
+    if row is None: return None
+    counts = [conn.execute(f"SELECT COUNT(*), SUM({sort_key} > ?) FROM StudentTotals", (row[0],)).fetchone()
+              for conn in map(get_connection, get_shards())]
+    return sum(c[1] or 0 for c in counts) + 1, sum(c[0] for c in counts)
+
+def count_students_below(threshold=40.0):
+    index = get_ranking_index()
+    if index is not None: return index.count_below(threshold)
+    return sum(rows[0][0] for rows in fan_out_query(
+        "SELECT COUNT(*) FROM StudentTotals WHERE percentage < ? AND total_max_marks > 0", (threshold,)))
+
+# --- Performance Table ---
+# Column-oriented performance data: one array per numeric column (8 bytes a value), class
+# sections stored once and referenced by a small code, names in plain lists. Filtering,
+# ordering, ranking and top-k work on whole columns, in NumPy when it is installed and in
+# plain Python otherwise. Iterating or indexing yields PerformanceRecord views that read like
+# the old dicts (record["percentage"], record.get(...), dict(record)), so callers written for
+# the list of dicts keep working.
+PERFORMANCE_COLUMNS = ("id", "first_name", "last_name", "class_section", "total_obtained", "total_max_marks", "percentage")
+_TABLE_OPS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge, "==": operator.eq, "!=": operator.ne}
+
+def _optional_numpy():
+    try: import numpy
+    except ImportError: return None
+    return numpy
+
+def _as_numpy(np, column):
+    # Zero-copy NumPy view of an array.array column.
+    dtype = {"q": np.int64, "d": np.float64, "i": np.int32}[column.typecode]
+    return np.frombuffer(column, dtype=dtype) if len(column) else np.zeros(0, dtype=dtype)
+
+def _array_from(np, typecode, values):
+    column = array.array(typecode)
+    column.frombytes(np.ascontiguousarray(values, dtype={"q": np.int64, "d": np.float64, "i": np.int32}[typecode]).tobytes())
+    return column
+
+class PerformanceRecord(collections.abc.Mapping):
+    # Read-only view of one table row; holds no data of its own.
+    __slots__ = ("_table", "_row")
+
+    def __init__(self, table, row):
+        self._table, self._row = table, row
+
+    def __getitem__(self, key):
+        if key not in self._table.columns: raise KeyError(key)
+        return self._table.value(key, self._row)
+
+    def __iter__(self):
+        return iter(self._table.columns)
+
+    def __len__(self):
+        return len(self._table.columns)
+
+    def __repr__(self):
+        return f"PerformanceRecord({dict(self)!r})"
+
+class PerformanceTable:
+    __slots__ = ("ids", "first_names", "last_names", "class_codes", "classes", "totals", "max_totals", "percentages", "ranks")
+
+    def __init__(self):
+        self.ids, self.totals, self.max_totals = array.array("q"), array.array("q"), array.array("q")
+        self.percentages = array.array("d")
+        self.first_names, self.last_names = [], []
+        self.class_codes, self.classes = array.array("i"), [] # classes[code] is the class_section
+        self.ranks = None # array("q") on tables returned by ranked()
+
+    @classmethod
+    def from_rows(cls, rows):
+        # rows of PERFORMANCE_COLUMNS values, e.g. straight from a cursor.
+        table, codes = cls(), {}
+        for student_id, first_name, last_name, class_section, total, max_total, percentage in rows:
+            code = codes.get(class_section)
+            if code is None:
+                code = codes[class_section] = len(table.classes)
+                table.classes.append(class_section)
+            table.ids.append(student_id)
+            table.first_names.append(first_name)
+            table.last_names.append(last_name)
+            table.class_codes.append(code)
+            table.totals.append(total)
+            table.max_totals.append(max_total)
+            table.percentages.append(percentage)
+        return table
+
+    @property
+    def columns(self):
+        return PERFORMANCE_COLUMNS if self.ranks is None else RANKING_COLUMNS
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, row):
+        if isinstance(row, slice): return self.take(range(len(self))[row])
+        if row < 0: row += len(self)
+        if not 0 <= row < len(self): raise IndexError("PerformanceTable index out of range")
+        return PerformanceRecord(self, row)
+
+    def __iter__(self):
+        return (PerformanceRecord(self, row) for row in range(len(self)))
+
+    def value(self, key, row):
+        if key == "class_section": return self.classes[self.class_codes[row]]
+        return self._column(key)[row]
+
+    def _column(self, key):
+        return {"id": self.ids, "first_name": self.first_names, "last_name": self.last_names, "total_obtained": self.totals,
+                "total_max_marks": self.max_totals, "percentage": self.percentages, "rank": self.ranks}[key]
+
+    def column(self, key):
+        # A whole column: an array for numbers, a list for text.
+        if key == "class_section": return [self.classes[code] for code in self.class_codes]
+        return self._column(key)
+
+    def to_dicts(self):
+        return [dict(record) for record in self]
+
+    def take(self, rows):
+        # New table with the rows at these positions, in this order (classes are shared).
+        np, table = _optional_numpy(), PerformanceTable()
+        if np is not None:
+            rows = np.asarray(rows if hasattr(rows, "__len__") else list(rows), dtype=np.intp)
+            take = lambda column: _array_from(np, column.typecode, _as_numpy(np, column)[rows])
+            rows = rows.tolist()
+        else:
+            rows = list(rows)
+            take = lambda column: array.array(column.typecode, [column[row] for row in rows])
+        table.ids, table.totals, table.max_totals = take(self.ids), take(self.totals), take(self.max_totals)
+        table.percentages, table.class_codes = take(self.percentages), take(self.class_codes)
+        table.first_names = [self.first_names[row] for row in rows]
+        table.last_names = [self.last_names[row] for row in rows]
+        table.classes = self.classes
+        if self.ranks is not None: table.ranks = take(self.ranks)
+        return table
+
+    def where(self, key, op, value):
+        # Rows where `column op value`, e.g. where("percentage", "<", 40) or where("class_section", "==", "10A").
+        if op not in _TABLE_OPS: raise ValueError(f"Unsupported comparison '{op}'.")
+        compare = _TABLE_OPS[op]
+        if key == "class_section":
+            if op not in ("==", "!="): raise ValueError("Class sections can only be compared with == or !=.")
+            column, value = self.class_codes, self.classes.index(value) if value in self.classes else -1
+        else: column = self._column(key)
+        np = _optional_numpy()
+        if np is not None and isinstance(column, array.array): return self.take(np.flatnonzero(compare(_as_numpy(np, column), value)))
+        return self.take(row for row, item in enumerate(column) if compare(item, value))
+
+    def order(self, sort_key="percentage", by_class=False):
+        # Row positions in ranking order: score descending, ties by ID (grouped by class first).
+        np = _optional_numpy()
+        class_ranks = self._class_ranks() if by_class else None
+        if np is not None:
+            keys = [_as_numpy(np, self.ids), -_as_numpy(np, self._column(sort_key))]
+            if by_class: keys.append(np.asarray(class_ranks, dtype=np.intp)[_as_numpy(np, self.class_codes)])
+            return np.lexsort(keys)
+        scores, ids, codes = self._column(sort_key), self.ids, self.class_codes
+        if by_class: return sorted(range(len(self)), key=lambda row: (class_ranks[codes[row]], -scores[row], ids[row]))
+        return sorted(range(len(self)), key=lambda row: (-scores[row], ids[row]))
+
+    def top_k(self, k, sort_key="percentage"):
+        # The first k rows in ranking order, without sorting the rest.
+        if k <= 0 or not len(self): return self.take([])
+        if k >= len(self): return self.take(self.order(sort_key))
+        np = _optional_numpy()
+        if np is None:
+            scores, ids = self._column(sort_key), self.ids
+            return self.take(heapq.nsmallest(k, range(len(self)), key=lambda row: (-scores[row], ids[row])))
+        scores = _as_numpy(np, self._column(sort_key))
+        cutoff = np.partition(scores, len(self) - k)[len(self) - k] # k-th highest score
+        candidates = np.flatnonzero(scores >= cutoff) # Everything above it plus all ties on it
+        ordered = candidates[np.lexsort((_as_numpy(np, self.ids)[candidates], -scores[candidates]))]
+        return self.take(ordered[:k])
+
+    def ranked(self, sort_key="percentage", by_class=False, limit=None):
+        # Copy in ranking order with a competition "rank" column (1, 1, 3), restarting per
+        # class when by_class. limit keeps the top N overall and is ignored with by_class.
+        if sort_key not in RANK_SORT_KEYS: raise ValueError(f"Cannot rank by '{sort_key}'.")
+        table = self.top_k(limit, sort_key) if limit is not None and not by_class else self.take(self.order(sort_key, by_class))
+        np, n = _optional_numpy(), len(table)
+        if np is not None and n:
+            scores, codes, positions = _as_numpy(np, table._column(sort_key)), _as_numpy(np, table.class_codes), np.arange(n)
+            class_starts = np.zeros(n, dtype=bool)
+            class_starts[0] = True
+            if by_class: class_starts[1:] = codes[1:] != codes[:-1]
+            tie_starts = class_starts.copy()
+            tie_starts[1:] |= scores[1:] != scores[:-1]
+            ranks = (np.maximum.accumulate(np.where(tie_starts, positions, 0))
+                     - np.maximum.accumulate(np.where(class_starts, positions, 0)) + 1)
+            table.ranks = _array_from(np, "q", ranks)
+            return table
+        scores, codes, ranks = table._column(sort_key), table.class_codes, array.array("q")
+        rank = start = 0
+        for position in range(n):
+            new_class = by_class and position > 0 and codes[position] != codes[position - 1]
+            if new_class: start = position
+            if position == 0 or new_class or scores[position] != scores[position - 1]: rank = position - start + 1
+            ranks.append(rank)
+        table.ranks = ranks
+        return table
+
+    def _class_ranks(self):
+        # Sort position of each class code, in SQL order (NULL first).
+        order = sorted(range(len(self.classes)), key=lambda code: _class_order(self.classes[code]))
+        ranks = [0] * len(self.classes)
+        for position, code in enumerate(order): ranks[code] = position
+        return ranks
+
+# --- Report Rendering ---
+# Tabular reports are formatted REPORT_BATCH_SIZE rows at a time into one string and written
+# with a single write() per batch rather than a print() per row. Column widths come from the
+# data: every row of a list, or the first batch of a stream (a wider value further down widens
+# its column from that line on). report_output() sends a report to a file or, when stdout is a
+# terminal, through a pager: SRMS_PAGER, else PAGER, else "less -FRX" (SRMS_PAGER="" turns
+# paging off). CSV and TSV exports go through the same writer and need no widths.
+REPORT_BATCH_SIZE = 2000
+REPORT_PAGER = os.environ.get("SRMS_PAGER", os.environ.get("PAGER", "less -FRX"))
+REPORT_FORMATS = ("table", "csv", "tsv")
+REPORT_SAVE_PROMPT = "Save to file (.txt, .csv or .tsv; Enter to view): "
+
+def _report_name(row):
+    return f"{row['first_name']} {row['last_name']}"
+
+# Columns are (heading, field, key[, format]). The heading labels the table; field names the
+# column in CSV/TSV headers, so exports always carry the same snake_case names. key indexes the
+# row (dict key or tuple position) or is a function of it; format (e.g. "{:.2f}%") applies to
+# the table only, exports get raw values.
+RANKING_REPORT = (("Rank", "rank", "rank"), ("ID", "id", "id"), ("Name", "name", _report_name),
+                  ("Class", "class_section", "class_section"), ("Tot. Obt.", "total_obtained", "total_obtained"),
+                  ("Tot. Max", "total_max_marks", "total_max_marks"), ("Percentage", "percentage", "percentage", "{:.2f}%"))
+FAILED_REPORT = (("ID", "id", "id"), ("Name", "name", _report_name), ("Class", "class_section", "class_section"),
+                 ("Percentage", "percentage", "percentage", "{:.2f}%"))
+STUDENT_REPORT = (("ID", "student_id", 0), ("First Name", "first_name", 1), ("Last Name", "last_name", 2),
+                  ("Class/Section", "class_section", 3))
+SUBJECT_REPORT = (("ID", "subject_id", 0), ("Subject Name", "subject_name", 1), ("Max Marks", "max_marks", 2))
+
+def _report_getters(columns):
+    return [key if callable(key) else operator.itemgetter(key) for _, _, key, *_ in columns]
+
+def _report_cells(batch, getters, columns):
+    # Formatted cells of one batch, column by column.
+    cells = []
+    for get, column in zip(getters, columns):
+        text = column[3].format if len(column) > 3 else str
+        cells.append(["" if value is None else text(value) for value in map(get, batch)])
+    return cells
+
+def report_format(path):
+    # Export format implied by a file name: .csv, .tsv/.tab, anything else a plain table.
+    extension = os.path.splitext(path or "")[1].lower()
+    return "csv" if extension == ".csv" else "tsv" if extension in (".tsv", ".tab") else "table"
+
+def _report_batches(rows, batch_size):
+    rows = iter(rows)
+    return iter(lambda: list(itertools.islice(rows, batch_size)), [])
+
+def _report_widths(widths, cells):
+    return [max(width, max(map(len, column))) for width, column in zip(widths, cells)]
+
+def _report_line(widths):
+    return "".join(f"{{:<{width}}} | " for width in widths[:-1]) + "{}\n" # Last column unpadded
+
+def write_report(rows, columns, out=None, fmt="table", group_by=None, header=True, batch_size=REPORT_BATCH_SIZE):
+    # Writes rows (a list, or any iterable consumed once) and returns how many there were.
+    # group_by is a (label, key) pair: a "[label value]" line starts each run of equal values.
+    if fmt not in REPORT_FORMATS: raise ValueError(f"Unknown report format '{fmt}'.")
+    out, count, buffer, getters = out or sys.stdout, 0, io.StringIO(), _report_getters(columns)
+    if fmt != "table":
+        import csv
+        writer = csv.writer(buffer, delimiter="," if fmt == "csv" else "\t", lineterminator="\n")
+        if header: writer.writerow([column[1] for column in columns])
+        for batch in _report_batches(rows, batch_size):
+            writer.writerows(zip(*(map(get, batch) for get in getters)))
+            out.write(buffer.getvalue())
+            buffer.seek(0)
+            buffer.truncate()
+            count += len(batch)
+        out.write(buffer.getvalue())
+        return count
+
+    widths = [len(column[0]) for column in columns]
+    if isinstance(rows, collections.abc.Sized): # Already in memory: format it all once and size on every row
+        rows = list(rows)
+        formatted = _report_cells(rows, getters, columns)
+        widths = _report_widths(widths, formatted) if rows else widths
+        chunks = ((rows[i:i + batch_size], [column[i:i + batch_size] for column in formatted]) for i in range(0, len(rows), batch_size))
+    else: chunks = ((batch, _report_cells(batch, getters, columns)) for batch in _report_batches(rows, batch_size))
+    group = None if group_by is None else group_by[1] if callable(group_by[1]) else operator.itemgetter(group_by[1])
+    last_group, line = object(), _report_line(widths)
+    for batch, cells in chunks:
+        if _report_widths(widths, cells) != widths:
+            widths = _report_widths(widths, cells)
+            line = _report_line(widths)
+        if not count and header:
+            buffer.write(line.format(*(column[0] for column in columns)) + "-|-".join("-" * width for width in widths) + "\n")
+        if group is None: buffer.write("".join(map(line.format, *cells)))
+        else:
+            for row, values in zip(batch, zip(*cells)):
+                if group(row) != last_group:
+                    last_group = group(row)
+                    buffer.write(f"[{group_by[0]} {last_group}]\n")
+                buffer.write(line.format(*values))
+        out.write(buffer.getvalue())
+        buffer.seek(0)
+        buffer.truncate()
+        count += len(batch)
+    if not count and header: buffer.write(line.format(*(column[0] for column in columns)) + "-|-".join("-" * width for width in widths) + "\n")
+    buffer.write("-" * (sum(widths) + 3 * (len(widths) - 1)) + "\n")
+    out.write(buffer.getvalue())
+    return count
+
+@contextlib.contextmanager
+def report_output(path=None):
+    # Stream for one report: the file at path, the pager when both ends are a terminal, else stdout.
+    if path:
+        with open(path, "w", encoding="utf-8", newline="") as out: yield out
+        return
+    pager = None
+    if REPORT_PAGER and sys.stdin.isatty() and sys.stdout.isatty():
+        import shlex, subprocess
+        sys.stdout.flush() # Whatever was printed before the report stays above it
+        try: pager = subprocess.Popen(shlex.split(REPORT_PAGER), stdin=subprocess.PIPE, text=True, encoding="utf-8", errors="replace")
+        except (OSError, ValueError): pager = None # No such pager: print directly
+    if pager is None:
+        yield sys.stdout
+        return
+    try: yield pager.stdin
+    except BrokenPipeError: pass # Pager quit before the end of the report
+    finally:
+        try: pager.stdin.close()
+        except BrokenPipeError: pass
+        pager.wait()
+
+def show_report(title, rows, columns, path=None, group_by=None):
+    # Pages a titled table, or saves it to path as a table, CSV or TSV (see report_format).
+    fmt, count = report_format(path), 0
+    try:
+        with report_output(path) as out:
+            if fmt == "table": out.write(f"\n--- {title} ---\n")
+            count = write_report(rows, columns, out, fmt, group_by)
+    except OSError as e: print(f"Error writing report to '{path}': {e}"); return None
+    if path: print(f"Saved {count} rows to '{path}'.")
+    return count
+
 # --- Reporting and Ranking Functions ---
+@timed_operation
 def get_student_performance_data():
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute('''
+    sql = '''
         SELECT st.student_id, st.first_name, st.last_name, st.class_section,
-               COALESCE(SUM(m.marks_obtained), 0) as total_obtained,
-               COALESCE(SUM(su.max_marks), 0) as total_max_marks
+               COALESCE(t.total_obtained, 0), COALESCE(t.total_max_marks, 0), COALESCE(t.percentage, 0)
         FROM Students st
-        LEFT JOIN Marks m ON st.student_id = m.student_id
-        LEFT JOIN Subjects su ON m.subject_id = su.subject_id
-        GROUP BY st.student_id, st.first_name, st.last_name, st.class_section
-        ORDER BY st.student_id ''')
-    perf_data = []
-    for row in cursor.fetchall():
-        perc = 0
-        total_obt, total_max = row[4] or 0, row[5] or 0
-        if total_max > 0: perc = (total_obt / total_max) * 100
-        perf_data.append({
-            "id": row[0], "first_name": row[1], "last_name": row[2], "class_section": row[3],
-            "total_obtained": total_obt, "total_max_marks": total_max, "percentage": round(perc, 2)
-        })
-    conn.close()
-    return perf_data
-
-def rank_students(performance_data_list, sort_key="percentage"):
-    if not performance_data_list: print("No performance data to rank."); return []
-    ranked_list = sorted(performance_data_list, key=lambda x: x.get(sort_key, 0), reverse=True)
-    print(f"\n--- Student Rankings (by {sort_key.replace('_', ' ').title()}) ---")
-    print("Rank | ID | Name                | Class | Tot. Obt. | Tot. Max | Percentage")
-    print("-----|----|---------------------|-------|-----------|----------|-----------")
-    current_rank, last_score = 0, -1
-    for i, stud in enumerate(ranked_list):
-        score = stud.get(sort_key, 0)
-        if score != last_score: current_rank, last_score = i + 1, score
-        name = f"{stud['first_name']} {stud['last_name']}"
-        print(f"{current_rank:<5}| {stud['id']:<2} | {name:<19} | {stud['class_section']:<5} | "
-              f"{stud['total_obtained']:<9} | {stud['total_max_marks']:<8} | {stud['percentage']:.2f}%")
-    print("--------------------------------------------------------------------------------")
+        LEFT JOIN StudentTotals t ON t.student_id = st.student_id
+        ORDER BY st.student_id '''
+    if get_shards(): rows = heapq.merge(*fan_out_query(sql), key=lambda row: row[0])
+    else: rows = get_connection().execute(sql)
+    return PerformanceTable.from_rows(rows)
+
+def _ranking_title(sort_key, by_class):
+    scope = " within each Class" if by_class else ""
+    return f"Student Rankings (by {sort_key.replace('_', ' ').title()}{scope})"
+
+@timed_operation
+def rank_students(performance_data_list=None, sort_key="percentage", by_class=False, path=None):
+    # Without a list the ranking comes straight from SQL; a PerformanceTable (e.g. filtered
+    # performance data) is ranked column-wise, and a plain list of dicts in Python. With a
+    # path the report is saved there instead of shown (see show_report); a ranking from SQL
+    # is then streamed from iter_rankings() and the number of rows saved is returned.
+    if performance_data_list is None and path:
+        rows = iter_rankings(sort_key, by_class=by_class)
+        first = next(rows, None)
+        if first is None:
+            print("No performance data to rank.")
+            return 0
+        return show_report(_ranking_title(sort_key, by_class), itertools.chain([first], rows), RANKING_REPORT,
+                           path, ("Class", "class_section") if by_class else None)
+    if performance_data_list is None: ranked_list = get_ranked_students(sort_key, by_class=by_class)
+    elif isinstance(performance_data_list, PerformanceTable): ranked_list = performance_data_list.ranked(sort_key, by_class)
+    else:
+        ranked_list = [dict(stud) for stud in sorted(performance_data_list, key=lambda x: x.get(sort_key, 0), reverse=True)]
+        current_rank, last_score = 0, -1
+        for i, stud in enumerate(ranked_list):
+            score = stud.get(sort_key, 0)
+            if score != last_score: current_rank, last_score = i + 1, score
+            stud["rank"] = current_rank
+        by_class = False
+    if not ranked_list: print("No performance data to rank."); return []
+    show_report(_ranking_title(sort_key, by_class), ranked_list, RANKING_REPORT,
+                path, ("Class", "class_section") if by_class else None)
     return ranked_list
 
-def view_top_n_students(top_n=10, sort_key="percentage"):
+@timed_operation
+def view_top_n_students(top_n=10, sort_key="percentage", by_class=False, path=None):
     if CURRENT_USER_ROLE != "admin": print("Access Denied."); return
-    perf_data = get_student_performance_data()
-    if not perf_data: print("No student performance data."); return
-    ranked = sorted(perf_data, key=lambda x: x.get(sort_key, 0), reverse=True)
-    
-    print(f"\n--- Top {top_n} Students (by {sort_key.replace('_', ' ').title()}) ---")
-    if not ranked: print("No students to rank."); return
-    print("Rank | ID | Name                | Class | Tot. Obt. | Tot. Max | Percentage")
-    print("-----|----|---------------------|-------|-----------|----------|-----------")
-    curr_rank, last_scr, disp_count = 0, -1, 0
-    for i, stud in enumerate(ranked):
-        if disp_count >= top_n: break
-        score = stud.get(sort_key, 0)
-        if score != last_scr: curr_rank, last_scr = i + 1, score
-        name = f"{stud['first_name']} {stud['last_name']}"
-        print(f"{curr_rank:<5}| {stud['id']:<2} | {name:<19} | {stud['class_section']:<5} | "
-              f"{stud['total_obtained']:<9} | {stud['total_max_marks']:<8} | {stud['percentage']:.2f}%")
-        disp_count += 1
-    print("--------------------------------------------------------------------------------")
-    if not disp_count: print(f"No students for top {top_n}.")
-
-def view_failed_list(threshold=40.0):
+    if top_n <= 0: print(f"No students for top {top_n}."); return
+    ranked = get_ranked_students(sort_key, limit=top_n, by_class=by_class)
+    if not ranked: print("No student performance data."); return
+    scope = " per Class" if by_class else ""
+    show_report(f"Top {top_n} Students{scope} (by {sort_key.replace('_', ' ').title()})", ranked, RANKING_REPORT,
+                path, ("Class", "class_section") if by_class else None)
+    return ranked
+
+def get_failed_students(threshold=40.0):
+    # Students with at least one graded subject and an overall percentage below threshold.
+    sql = f'''{_SCORED_STUDENTS_SQL}
+        WHERE t.percentage < ? AND t.total_max_marks > 0
+        ORDER BY t.percentage, t.student_id'''
+    if get_shards(): rows = heapq.merge(*fan_out_query(sql, (threshold,)), key=lambda row: (row[6], row[0]))
+    else: rows = get_connection().execute(sql, (threshold,)).fetchall()
+    return [dict(zip(RANKING_COLUMNS[1:], row)) for row in rows]
+
+@timed_operation
+def view_failed_list(threshold=40.0, path=None):
     if CURRENT_USER_ROLE != "admin": print("Access Denied."); return
-    perf_data = get_student_performance_data()
-    if not perf_data: print("No student performance data."); return
-    failed = [s for s in perf_data if s.get("percentage", 101) < threshold and s.get("total_max_marks",0) > 0]
+    if count_students_below(threshold) == 0: print(f"No students below {threshold}%."); return
+    failed = get_failed_students(threshold)
     if not failed: print(f"No students below {threshold}%."); return
+    show_report(f"Students Below {threshold}% Overall", failed, FAILED_REPORT, path)
+    return failed
 
-    print(f"\n--- Students Below {threshold}% Overall ---")
-    print("ID | Name                | Class | Percentage")
-    print("---|---------------------|-------|-----------")
-    for stud in sorted(failed, key=lambda x: x.get("percentage", 101)):
-        name = f"{stud['first_name']} {stud['last_name']}"
-        print(f"{stud['id']:<2} | {name:<19} | {stud['class_section']:<5} | {stud['percentage']:.2f}%")
-    print("-------------------------------------------")
 
+# --- Search ---
+SEARCH_RESULT_LIMIT = 50
+
+def has_search_index(conn=None):
+    conn = conn or get_connection()
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'StudentSearch'").fetchone() is not None
+
+def rebuild_search_index():
+    # Also creates the index on databases migrated before FTS5 was available.
+    conn = get_connection()
+    try:
+        created = create_search_index(conn)
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    return created
+
+def _fts_phrase(term):
+    return '"' + term.replace('"', '""') + '"'
+
+def _like_escape(term):
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def _like_prefix(term):
+    return _like_escape(term) + "%"
+
+@timed_operation
+def find_students(term, limit=SEARCH_RESULT_LIMIT, database=None):
+    # An exact ID match comes first, then names starting with the term, then other
+    # substring matches by FTS relevance. Trigrams need 3+ characters, so shorter terms
+    # take the name prefixes from the NOCASE name indexes first and fill the rest of the
+    # limit from a LIKE substring scan in ID order, which stops once the limit is reached.
+    # A sharded database is searched shard by shard and the matches regrouped the same way.
+    term = term.strip().lower()
+    if not term: return []
+    if database is None and get_shards():
+        results = [row for shard in get_shards() for row in find_students(term, limit, shard)]
+        results.sort(key=lambda row: (str(row[0]) != term, not (row[1].lower().startswith(term) or row[2].lower().startswith(term))))
+        return results[:limit]
+    conn = get_connection(database)
+    cursor = conn.cursor()
+    results = []
+    if term.isdigit():
+        cursor.execute("SELECT student_id, first_name, last_name, class_section FROM Students WHERE student_id = ?", (int(term),))
+        results = cursor.fetchall()
+    exclude_id = results[0][0] if results else None
+    if not has_search_index(conn): # LIKE substring scan, as before the FTS index existed
+        cursor.execute("""SELECT student_id, first_name, last_name, class_section FROM Students
+                          WHERE (LOWER(first_name) LIKE ? OR LOWER(last_name) LIKE ?) AND student_id IS NOT ?
+                          ORDER BY student_id LIMIT ?""", (f"%{term}%", f"%{term}%", exclude_id, limit - len(results)))
+    elif len(term) < 3:
+        prefix, contains = _like_prefix(term), f"%{_like_escape(term)}%"
+        cursor.execute("""SELECT student_id, first_name, last_name, class_section FROM Students
+                          WHERE (first_name LIKE ? ESCAPE '\\' OR last_name LIKE ? ESCAPE '\\') AND student_id IS NOT ?
+                          ORDER BY student_id LIMIT ?""", (prefix, prefix, exclude_id, limit - len(results)))
+        results += cursor.fetchall()
+        cursor.execute("""SELECT student_id, first_name, last_name, class_section FROM Students
+                          WHERE (first_name LIKE ? ESCAPE '\\' OR last_name LIKE ? ESCAPE '\\')
+                                AND NOT (first_name LIKE ? ESCAPE '\\' OR last_name LIKE ? ESCAPE '\\') AND student_id IS NOT ?
+                          ORDER BY student_id LIMIT ?""", (contains, contains, prefix, prefix, exclude_id, limit - len(results)))
+    else:
+        cursor.execute('''
+            SELECT s.student_id, s.first_name, s.last_name, s.class_section
+            FROM StudentSearch f JOIN Students s ON s.student_id = f.rowid
+            WHERE StudentSearch MATCH ? AND s.student_id IS NOT ?
+            ORDER BY (s.first_name LIKE ? ESCAPE '\\' OR s.last_name LIKE ? ESCAPE '\\') DESC, f.rank, s.student_id
+            LIMIT ?''', (_fts_phrase(term), exclude_id, _like_prefix(term), _like_prefix(term), limit - len(results)))
+    return results + cursor.fetchall()
+
+@timed_operation
+def find_subjects(term, limit=SEARCH_RESULT_LIMIT):
+    term = term.strip().lower()
+    if not term: return []
+    conn = get_connection()
+    cursor = conn.cursor()
+    if len(term) >= 3 and has_search_index(conn):
+        cursor.execute('''
+            SELECT s.subject_id, s.subject_name, s.max_marks
+            FROM SubjectSearch f JOIN Subjects s ON s.subject_id = f.rowid
+            WHERE SubjectSearch MATCH ?
+            ORDER BY s.subject_name LIKE ? ESCAPE '\\' DESC, f.rank, s.subject_id LIMIT ?''', (_fts_phrase(term), _like_prefix(term), limit))
+    else:
+        cursor.execute("SELECT subject_id, subject_name, max_marks FROM Subjects WHERE LOWER(subject_name) LIKE ? ORDER BY subject_id LIMIT ?",
+                       (f"%{term}%", limit))
+    return cursor.fetchall()
 
 def search_students():
     if CURRENT_USER_ROLE != "admin": print("Access Denied."); return
     term = input("\nSearch Student (ID or Name part): ").strip().lower()
     if not term: print("Search term empty."); return
-
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    query = """SELECT student_id, first_name, last_name, class_section FROM Students 
-               WHERE CAST(student_id AS TEXT) = ? OR LOWER(first_name) LIKE ? OR LOWER(last_name) LIKE ?
-               ORDER BY student_id"""
-    cursor.execute(query, (term, f"%{term}%", f"%{term}%"))
-    results = cursor.fetchall()
-    conn.close()
+    results = find_students(term)
 
     if not results: print(f"No students match '{term}'."); return
     print("\n--- Student Search Results ---")
-    print("ID | First Name | Last Name  | Class/Section")
-    print("---|------------|------------|---------------")
-    for s in results: print(f"{s[0]:<3}| {s[1]:<10} | {s[2]:<10} | {s[3]}")
-    print("-------------------------------------------")
+    _print_students_page(results)
+    if len(results) >= SEARCH_RESULT_LIMIT: print(f"Showing the best {SEARCH_RESULT_LIMIT} matches; refine the search to narrow them down.")
 
 def search_subjects():
     term = input("\nSearch Subject (Name part): ").strip().lower()
     if not term: print("Search term empty."); return
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    query = "SELECT subject_id, subject_name, max_marks FROM Subjects WHERE LOWER(subject_name) LIKE ? ORDER BY subject_id"
-    cursor.execute(query, (f"%{term}%",))
-    results = cursor.fetchall()
-    conn.close()
+    results = find_subjects(term)
 
     if not results: print(f"No subjects match '{term}'."); return
     print("\n--- Subject Search Results ---")
-    print("ID | Subject Name     | Max Marks")
-    print("---|------------------|-----------")
-    for s in results: print(f"{s[0]:<3}| {s[1]:<16} | {s[2]}")
-    print("---------------------------------")
+    _print_subjects_page(results)
+    if len(results) >= SEARCH_RESULT_LIMIT: print(f"Showing the best {SEARCH_RESULT_LIMIT} matches; refine the search to narrow them down.")
+
+# --- Statistics Engine ---
+# Subject and class analytics computed with NumPy. Marks are small integers, so SQLite hands
+# over each subject's distribution - one (subject, mark, count) row per distinct mark, read
+# straight off the covering (subject_id, marks_obtained) index - rather than a row per mark;
+# class percentages arrive the same way. Every statistic is taken from these weighted rows
+# with sorts, bincount and index arithmetic, never a Python loop over marks.
+PASS_PERCENTAGE = 40.0
+GRADE_BANDS = [(90, "A+"), (80, "A"), (70, "B"), (60, "C"), (50, "D"), (40, "E"), (0, "F")] # (min %, grade)
+STAT_PERCENTILES = (25, 50, 75, 90)
+
+def _require_numpy():
+    try: import numpy
+    except ImportError: raise RuntimeError("Statistics reports need NumPy (pip install numpy).")
+    return numpy
+
+def load_marks_distribution(database=None):
+    # Returns (subject_ids, marks, counts) arrays: how many students got each mark in each subject.
+    np = _require_numpy()
+    cursor = get_connection(database).cursor()
+    cursor.execute('''
+        SELECT subject_id, marks_obtained, COUNT(*) FROM Marks
+        WHERE subject_id IS NOT NULL AND marks_obtained >= 0 GROUP BY 1, 2''')
+    rows = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 3)
+    return rows[:, 0], rows[:, 1], rows[:, 2]
+
+def _grouped_stats(np, groups, values, weights, n_groups, percentiles, bands, pass_percentage, percent_values):
+    # Per-group count/mean/std/min/max/percentiles of `values`, each occurring `weights`
+    # times, plus pass rate and grade band counts of `percent_values`. Percentiles use
+    # linear interpolation (numpy default) over the expanded values.
+    count = np.bincount(groups, weights=weights, minlength=n_groups).astype(np.int64)
+    safe = np.maximum(count, 1)
+    total = np.bincount(groups, weights=values * weights, minlength=n_groups)
+    mean = total / safe
+    var = np.bincount(groups, weights=values * values * weights, minlength=n_groups) / safe - mean * mean
+    std = np.sqrt(np.maximum(var, 0))
+
+    order = np.lexsort((values, groups))
+    sorted_values = np.append(values[order].astype(np.float64), np.nan) # Sentinel keeps empty-group indexes valid
+    ends = np.cumsum(weights[order]) # The expanded index k falls in row searchsorted(ends, k, "right")
+    starts = np.concatenate(([0], np.cumsum(count)[:-1]))
+    last = np.maximum(count - 1, 0)
+    def value_at(k):
+        return sorted_values[np.searchsorted(ends, k, side="right")]
+    quantiles = {}
+    for q in percentiles:
+        pos = starts + last * (q / 100.0)
+        lo, hi = np.floor(pos).astype(np.int64), np.ceil(pos).astype(np.int64)
+        low_value = value_at(lo)
+        quantiles[q] = np.where(count > 0, low_value + (value_at(hi) - low_value) * (pos - lo), np.nan)
+    minimum = np.where(count > 0, value_at(starts), np.nan)
+    maximum = np.where(count > 0, value_at(starts + last), np.nan)
+
+    passed = np.bincount(groups, weights=(percent_values >= pass_percentage) * weights, minlength=n_groups)
+    thresholds = np.array([b[0] for b in bands][::-1], dtype=np.float64) # ascending
+    band_index = len(bands) - np.searchsorted(thresholds, percent_values, side="right") # 0 = best band
+    band_counts = np.bincount(groups * len(bands) + band_index, weights=weights,
+                              minlength=n_groups * len(bands)).astype(np.int64).reshape(n_groups, len(bands))
+    return {"count": count, "mean": np.where(count > 0, mean, np.nan), "std": np.where(count > 0, std, np.nan),
+            "min": minimum, "max": maximum, "percentiles": quantiles,
+            "pass_rate": np.where(count > 0, passed / safe * 100, np.nan), "bands": band_counts}
+
+def _stats_rows(np, keys, stats, percentiles, bands):
+    rows = []
+    for i, key in enumerate(keys):
+        if not stats["count"][i]: continue
+        row = dict(key)
+        row.update({"count": int(stats["count"][i]), "mean": float(stats["mean"][i]), "median": float(stats["percentiles"][50][i]),
+                    "std": float(stats["std"][i]), "min": float(stats["min"][i]), "max": float(stats["max"][i]),
+                    "percentiles": {q: float(stats["percentiles"][q][i]) for q in percentiles},
+                    "pass_rate": float(stats["pass_rate"][i]),
+                    "grade_bands": {grade: int(n) for (_, grade), n in zip(bands, stats["bands"][i])}})
+        rows.append(row)
+    return rows
+
+@timed_operation
+def compute_statistics(pass_percentage=PASS_PERCENTAGE, percentiles=STAT_PERCENTILES, bands=GRADE_BANDS):
+    # Returns {"subjects": [...], "classes": [...]}. Subject stats are over raw marks
+    # (grade bands/pass rate over marks as a % of max_marks); class stats are over each
+    # student's overall percentage, as used by the rankings.
+    np = _require_numpy()
+    percentiles = tuple(sorted(set(percentiles) | {50}))
+    databases = get_shards() or [DATABASE_NAME] # Shards' rows simply add up: every row carries its count
+    subject_ids, marks, mark_counts = (np.concatenate(parts) for parts in zip(*map(load_marks_distribution, databases)))
+    cursor = get_connection().cursor()
+
+    cursor.execute("SELECT subject_id, subject_name, max_marks FROM Subjects ORDER BY subject_id")
+    subjects = cursor.fetchall()
+    subject_slot = np.full(int(max([s[0] for s in subjects] + [int(subject_ids.max()) if len(subject_ids) else 0])) + 1, -1)
+    subject_slot[[s[0] for s in subjects]] = np.arange(len(subjects))
+    subject_max = np.array([s[2] or 0 for s in subjects] + [0], dtype=np.float64) # Trailing 0 for unknown subjects
+    slots = subject_slot[subject_ids]
+    max_of_mark = subject_max[slots] # Slot -1 picks the trailing 0
+    known = (slots >= 0) & (max_of_mark > 0)
+    subject_marks = marks[known].astype(np.float64)
+    subject_stats = _grouped_stats(np, slots[known], subject_marks, mark_counts[known], len(subjects), percentiles, bands,
+                                   pass_percentage, subject_marks / max_of_mark[known] * 100)
+
+    # Overall percentages come from StudentTotals, so they match the rankings exactly.
+    class_rows = [row for database in databases for row in get_connection(database).execute('''
+        SELECT COALESCE(st.class_section, ''), t.percentage, COUNT(*)
+        FROM StudentTotals t JOIN Students st ON st.student_id = t.student_id
+        WHERE t.total_max_marks > 0 GROUP BY 1, 2''')]
+    class_names = sorted({row[0] for row in class_rows})
+    class_slot = {name: i for i, name in enumerate(class_names)}
+    class_groups = np.array([class_slot[row[0]] for row in class_rows], dtype=np.int64)
+    student_pct = np.array([row[1] for row in class_rows], dtype=np.float64)
+    class_stats = _grouped_stats(np, class_groups, student_pct, np.array([row[2] for row in class_rows], dtype=np.int64),
+                                 len(class_names), percentiles, bands, pass_percentage, student_pct)
+
+    return {"subjects": _stats_rows(np, [{"subject_id": s[0], "subject_name": s[1], "max_marks": s[2]} for s in subjects],
+                                    subject_stats, percentiles, bands),
+            "classes": _stats_rows(np, [{"class_section": name or None} for name in class_names], class_stats, percentiles, bands)}
+
+def _print_stats_table(rows, label, width, name_of, unit=""):
+    pct_heads = " | ".join(f"P{q:<4}" for q in STAT_PERCENTILES if q != 50)
+    print(f"{label:<{width}} | Count  | Mean   | Median | Std    | {pct_heads} | Pass %")
+    print(f"{'-' * width}-|--------|--------|--------|--------|-" + "-|-".join("-" * 5 for q in STAT_PERCENTILES if q != 50) + "-|-------")
+    for row in rows:
+        pcts = " | ".join(f"{row['percentiles'][q]:<5.1f}" for q in STAT_PERCENTILES if q != 50)
+        print(f"{name_of(row)[:width]:<{width}} | {row['count']:<6} | {row['mean']:<6.2f} | {row['median']:<6.2f} | "
+              f"{row['std']:<6.2f} | {pcts} | {row['pass_rate']:.1f}%")
+    print("\nGrade bands (" + ", ".join(f"{g} >= {m}%" for m, g in GRADE_BANDS[:-1]) + f", {GRADE_BANDS[-1][1]} below):")
+    for row in rows:
+        print(f"  {name_of(row)[:width]:<{width}} " + "  ".join(f"{g}:{n}" for g, n in row["grade_bands"].items()))
+
+def view_subject_statistics():
+    if CURRENT_USER_ROLE != "admin": print("Access Denied."); return
+    try: stats = compute_statistics()
+    except RuntimeError as e: print(e); return
+    if not stats["subjects"]: print("No marks recorded yet."); return
+    print(f"\n--- Subject Statistics (marks; pass mark {PASS_PERCENTAGE:g}% of max) ---")
+    _print_stats_table(stats["subjects"], "Subject (max)", 22, lambda r: f"{r['subject_name']} ({r['max_marks']})")
+    print("-------------------------------------------")
+    return stats["subjects"]
+
+def view_class_statistics():
+    if CURRENT_USER_ROLE != "admin": print("Access Denied."); return
+    try: stats = compute_statistics()
+    except RuntimeError as e: print(e); return
+    if not stats["classes"]: print("No marks recorded yet."); return
+    print(f"\n--- Class/Section Statistics (overall student %; pass at {PASS_PERCENTAGE:g}%) ---")
+    _print_stats_table(stats["classes"], "Class", 12, lambda r: r["class_section"] or "(none)")
+    print("-------------------------------------------")
+    return stats["classes"]
+
+# --- Academic Terms ---
+# The live database holds the current term only: Marks has no term column, and every mark in
+# it belongs to the open row in Terms. Closing a term copies its students, subjects, marks and
+# totals into an archive file of their own (<db>_archive/term_<id>.db), then empties Marks so
+# the next term starts from zero and the hot tables never grow past one term. History and
+# trend reports ATTACH the archives one at a time, only when asked for.
+_ARCHIVE_SCHEMA = [
+    "CREATE TABLE term_archive.TermInfo (term_id INTEGER PRIMARY KEY, name TEXT NOT NULL, started_at TEXT, closed_at TEXT)",
+    "CREATE TABLE term_archive.Students (student_id INTEGER PRIMARY KEY, first_name TEXT, last_name TEXT, class_section TEXT)",
+    "CREATE TABLE term_archive.Subjects (subject_id INTEGER PRIMARY KEY, subject_name TEXT, max_marks INTEGER)",
+    '''CREATE TABLE term_archive.Marks (student_id INTEGER NOT NULL, subject_id INTEGER NOT NULL, marks_obtained INTEGER,
+        PRIMARY KEY (student_id, subject_id)) WITHOUT ROWID''',
+    # Plain REAL rather than a generated column: the archive keeps the percentages the term closed with.
+    '''CREATE TABLE term_archive.StudentTotals (student_id INTEGER PRIMARY KEY, total_obtained INTEGER,
+        total_max_marks INTEGER, percentage REAL)''',
+    "CREATE INDEX term_archive.idx_archive_percentage ON StudentTotals(percentage DESC, student_id)",
+]
+
+def _archive_abspath(archive_path, database=None):
+    return os.path.join(os.path.dirname(os.path.abspath(database or DATABASE_NAME)), archive_path)
+
+def get_current_term():
+    row = get_connection().execute("SELECT term_id, name, started_at FROM Terms WHERE closed_at IS NULL").fetchone()
+    return {"term_id": row[0], "name": row[1], "started_at": row[2]} if row else None
+
+def list_terms():
+    cursor = get_connection().execute("SELECT term_id, name, started_at, closed_at, archive_path FROM Terms ORDER BY term_id")
+    return [dict(zip(("term_id", "name", "started_at", "closed_at", "archive_path"), row)) for row in cursor]
+
+@contextlib.contextmanager
+def attached_term_archive(conn, term):
+    # Attaches a closed term's archive as `term_archive` for the duration of the block.
+    path = _archive_abspath(term["archive_path"])
+    if not os.path.exists(path): raise FileNotFoundError(f"archive for term '{term['name']}' not found at '{path}'")
+    conn.execute("ATTACH DATABASE ? AS term_archive", (path,))
+    try: yield conn
+    finally: conn.execute("DETACH DATABASE term_archive")
+
+@timed_operation
+def close_term(next_term_name):
+    # Archives the current term and starts next_term_name. Returns the closed term's dict.
+    conn = get_connection()
+    term = get_current_term()
+    if term is None: raise ValueError("There is no open term to close.")
+    if conn.execute("SELECT 1 FROM Terms WHERE name = ?", (next_term_name,)).fetchone():
+        raise ValueError(f"A term named '{next_term_name}' already exists.")
+    base = os.path.splitext(os.path.basename(DATABASE_NAME))[0]
+    term["archive_path"] = os.path.join(f"{base}_archive", f"term_{term['term_id']}.db")
+    path = _archive_abspath(term["archive_path"])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    for leftover in (tmp_path, tmp_path + "-journal", tmp_path + "-wal", tmp_path + "-shm"):
+        if os.path.exists(leftover): os.remove(leftover)
+    flush_marks_queue() # Marks queued before the close belong to this term
+
+    # 1. Write the archive under a temp name; it only takes its real name once complete. The
+    # write lock keeps every other connection out while the marks are copied.
+    conn.execute("ATTACH DATABASE ? AS term_archive", (tmp_path,))
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        archived_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        for sql in _ARCHIVE_SCHEMA: conn.execute(sql)
+        conn.execute("INSERT INTO term_archive.TermInfo VALUES (?, ?, ?, datetime('now'))",
+                     (term["term_id"], term["name"], term["started_at"]))
+        conn.execute('''INSERT INTO term_archive.Students
+                        SELECT student_id, first_name, last_name, class_section FROM main.Students
+                        WHERE student_id IN (SELECT student_id FROM main.Marks)''')
+        conn.execute("INSERT INTO term_archive.Subjects SELECT subject_id, subject_name, max_marks FROM main.Subjects")
+        conn.execute('''INSERT INTO term_archive.Marks SELECT student_id, subject_id, marks_obtained FROM main.Marks
+                        ORDER BY student_id, subject_id''')
+        conn.execute('''INSERT INTO term_archive.StudentTotals
+                        SELECT student_id, total_obtained, total_max_marks, percentage FROM main.StudentTotals
+                        WHERE student_id IN (SELECT student_id FROM term_archive.Students)''')
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally: conn.execute("DETACH DATABASE term_archive")
+    os.replace(tmp_path, path)
+
+    # 2. Empty the live marks and open the next term. data_version only moves for other
+    # connections' commits: if one committed since the copy, its marks aren't in the archive, so
+    # nothing is deleted. The per-row totals and change log triggers are dropped for the bulk
+    # delete (every total becomes zero anyway; the log gets one "clear" entry instead of a
+    # delete per mark) and restored in the same transaction.
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute("PRAGMA data_version").fetchone()[0] != archived_version:
+            os.remove(path)
+            raise ValueError("The database changed while the term was being archived; nothing was closed, try again.")
+        conn.execute("DROP TRIGGER trg_totals_marks_delete")
+        conn.execute("DROP TRIGGER trg_changes_marks_delete")
+        conn.execute("DELETE FROM Marks")
+        conn.execute(_DERIVED_TRIGGERS["trg_totals_marks_delete"])
+        conn.execute(_DERIVED_TRIGGERS["trg_changes_marks_delete"])
+        conn.execute("INSERT INTO ChangeLog (table_name, op) VALUES ('Marks', 'clear')")
+        conn.execute("UPDATE StudentTotals SET total_obtained = 0, total_max_marks = 0")
+        conn.execute("UPDATE Terms SET closed_at = datetime('now'), archive_path = ? WHERE term_id = ?",
+                     (term["archive_path"], term["term_id"]))
+        conn.execute("INSERT INTO Terms (name) VALUES (?)", (next_term_name,))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return term
+
+def run_close_term(next_term_name):
+    if CURRENT_USER_ROLE != "admin": print("Access Denied."); return None
+    try: term = close_term(next_term_name)
+    except (ValueError, sqlite3.Error, OSError) as e: print(f"Could not close the term: {e}"); return None
+    print(f"Term '{term['name']}' archived to '{term['archive_path']}'. Current term is now '{next_term_name}'.")
+    return term
+
+def get_student_history(student_id):
+    # One entry per term (oldest first, current term last) in which the student has marks.
+    conn = get_connection()
+    history = []
+    for term in list_terms():
+        if term["closed_at"] is None: prefix = "main."
+        elif term["archive_path"]: prefix = "term_archive."
+        else: continue
+        context = attached_term_archive(conn, term) if prefix == "term_archive." else contextlib.nullcontext()
+        with context:
+            row = conn.execute(f'''
+                SELECT total_obtained, total_max_marks, percentage, rank, students FROM (
+                    SELECT student_id, total_obtained, total_max_marks, percentage,
+                           RANK() OVER (ORDER BY percentage DESC) AS rank, COUNT(*) OVER () AS students
+                    FROM {prefix}StudentTotals WHERE total_max_marks > 0)
+                WHERE student_id = ?''', (student_id,)).fetchone()
+            if row is None: continue
+            marks = conn.execute(f'''
+                SELECT s.subject_name, m.marks_obtained, s.max_marks
+                FROM {prefix}Marks m JOIN {prefix}Subjects s ON s.subject_id = m.subject_id
+                WHERE m.student_id = ? ORDER BY m.subject_id''', (student_id,)).fetchall()
+        history.append({"term": term["name"], "current": term["closed_at"] is None, "total_obtained": row[0],
+                        "total_max_marks": row[1], "percentage": row[2], "rank": row[3], "students": row[4], "marks": marks})
+    return history
+
+def get_term_trends(class_section=None, pass_percentage=PASS_PERCENTAGE):
+    # Per-term summary (oldest first): students graded, average/best percentage and pass rate.
+    conn = get_connection()
+    trends = []
+    for term in list_terms():
+        if term["closed_at"] is None: prefix = "main."
+        elif term["archive_path"]: prefix = "term_archive."
+        else: continue
+        where = "WHERE t.total_max_marks > 0" + (" AND st.class_section = ?" if class_section is not None else "")
+        context = attached_term_archive(conn, term) if prefix == "term_archive." else contextlib.nullcontext()
+        with context:
+            row = conn.execute(f'''
+                SELECT COUNT(*), AVG(t.percentage), MAX(t.percentage), AVG(t.percentage >= ?) * 100
+                FROM {prefix}StudentTotals t JOIN {prefix}Students st ON st.student_id = t.student_id
+                {where}''', (pass_percentage,) + ((class_section,) if class_section is not None else ())).fetchone()
+        trends.append({"term": term["name"], "current": term["closed_at"] is None, "students": row[0],
+                       "average_percentage": round(row[1] or 0, 2), "best_percentage": round(row[2] or 0, 2),
+                       "pass_rate": round(row[3] or 0, 1)})
+    return trends
+
+def view_student_history(student_id):
+    history = get_student_history(student_id)
+    if not history: print(f"No results on record for student ID {student_id} in any term."); return history
+    print(f"\n--- Term History for Student ID {student_id} ---")
+    print("Term                 | Tot. Obt. | Tot. Max | Percentage | Rank")
+    print("---------------------|-----------|----------|------------|-----------")
+    previous = None
+    for entry in history:
+        change = "" if previous is None else f" ({entry['percentage'] - previous:+.2f})"
+        label = entry["term"] + (" *" if entry["current"] else "")
+        print(f"{label[:20]:<20} | {entry['total_obtained']:<9} | {entry['total_max_marks']:<8} | "
+              f"{entry['percentage']:>6.2f}%{change:<10} | {entry['rank']} of {entry['students']}")
+        previous = entry["percentage"]
+    print("(* current term)")
+    return history
+
+def view_term_trends(class_section=None):
+    trends = get_term_trends(class_section)
+    scope = f"Class {class_section}" if class_section else "All Classes"
+    print(f"\n--- Term Trends ({scope}; pass mark {PASS_PERCENTAGE:g}%) ---")
+    print("Term                 | Students | Average % | Best %  | Pass Rate")
+    print("---------------------|----------|-----------|---------|----------")
+    for entry in trends:
+        label = entry["term"] + (" *" if entry["current"] else "")
+        print(f"{label[:20]:<20} | {entry['students']:<8} | {entry['average_percentage']:<9.2f} | "
+              f"{entry['best_percentage']:<7.2f} | {entry['pass_rate']:.1f}%")
+    print("(* current term)")
+    return trends
+
+# --- Batch Marksheet Generation ---
+# Marksheets for a class (or the whole school) come from one query ordered by student,
+# grouped in a single streaming pass, and rendered/written by a process pool. Each file is
+# written to a temp name and renamed into place, so an interrupted run can simply be
+# started again: students whose marksheet already exists are skipped.
+MARKSHEET_FORMATS = ("txt", "html", "csv")
+MARKSHEET_CHUNK_SIZE = 250 # Marksheets per worker task
+
+def iter_marksheets(class_section=None):
+    where = "WHERE st.class_section = ?" if class_section is not None else ""
+    sql = f'''
+        SELECT st.student_id, st.first_name, st.last_name, st.class_section, s.subject_name, m.marks_obtained, s.max_marks
+        FROM Students st
+        LEFT JOIN Marks m ON m.student_id = st.student_id
+        LEFT JOIN Subjects s ON s.subject_id = m.subject_id
+        {where}
+        ORDER BY st.student_id, m.subject_id'''
+    params = (class_section,) if class_section is not None else ()
+    # A student's rows all come from one shard, so merging on the ID keeps them together.
+    rows = iter_all_shards(sql, params, key=lambda row: row[0]) if get_shards() else iter_query(sql, params)
+    for student_id, group in itertools.groupby(rows, key=lambda row: row[0]):
+        group = list(group)
+        marks = [(row[4], row[5], row[6]) for row in group if row[4] is not None] # Same rows as view_student_marks
+        total_obtained = sum(m[1] or 0 for m in marks)
+        total_max_marks = sum(m[2] or 0 for m in marks)
+        yield {"id": student_id, "first_name": group[0][1], "last_name": group[0][2], "class_section": group[0][3],
+               "marks": marks, "total_obtained": total_obtained, "total_max_marks": total_max_marks,
+               "percentage": calculate_percentage(total_obtained, total_max_marks)}
+
+def render_marksheet(sheet, fmt="txt"):
+    name = f"{sheet['first_name']} {sheet['last_name']}"
+    if fmt == "csv":
+        import csv
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(["student_id", "name", "class_section", "subject", "marks_obtained", "max_marks"])
+        for subject, obtained, max_m in sheet["marks"]:
+            writer.writerow([sheet["id"], name, sheet["class_section"], subject, obtained, max_m])
+        writer.writerow([sheet["id"], name, sheet["class_section"], "Total", sheet["total_obtained"], sheet["total_max_marks"]])
+        return out.getvalue()
+    if fmt == "html":
+        import html
+        rows = "".join(f"<tr><td>{html.escape(str(s))}</td><td>{o}</td><td>{m}</td></tr>" for s, o, m in sheet["marks"])
+        pct = f"{sheet['percentage']:.2f}%" if sheet["total_max_marks"] > 0 else "N/A"
+        return (f"<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>Marksheet - {html.escape(name)}</title></head><body>\n"
+                f"<h1>Marksheet for {html.escape(name)}</h1>\n"
+                f"<p>Student ID: {sheet['id']} | Class: {html.escape(str(sheet['class_section']))}</p>\n"
+                f"<table border=\"1\"><tr><th>Subject</th><th>Marks Obtained</th><th>Max Marks</th></tr>{rows}"
+                f"<tr><th>Total</th><th>{sheet['total_obtained']}</th><th>{sheet['total_max_marks']}</th></tr></table>\n"
+                f"<p>Percentage: {pct}</p>\n</body></html>\n")
+    lines = [f"--- Marksheet for {name} (ID: {sheet['id']}, Class: {sheet['class_section']}) ---",
+             "Subject          | Marks Obtained | Max Marks",
+             "-----------------|----------------|-----------"]
+    lines += [f"{s:<16} | {o if o is not None else '':<14} | {m}" for s, o, m in sheet["marks"]]
+    lines += ["-----------------|----------------|-----------",
+              f"{'Total:':<16} | {sheet['total_obtained']:<14} | {sheet['total_max_marks']}",
+              f"Percentage: {sheet['percentage']:.2f}%" if sheet["total_max_marks"] > 0 else "Percentage: N/A",
+              "-------------------------------------------"]
+    return "\n".join(lines) + "\n"
+
+def marksheet_filename(student_id, fmt):
+    return f"marksheet_{student_id}.{fmt}"
+
+def _write_marksheet_chunk(output_dir, fmt, sheets):
+    # Runs in a worker process: render each marksheet and rename it into place.
+    for sheet in sheets:
+        path = os.path.join(output_dir, marksheet_filename(sheet["id"], fmt))
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, "w", encoding="utf-8", newline="") as f: f.write(render_marksheet(sheet, fmt))
+        os.replace(tmp_path, path)
+    return len(sheets)
+
+@timed_operation
+def generate_marksheets(output_dir, class_section=None, fmt="txt", workers=None, overwrite=False, progress=True):
+    # Returns (written, skipped). workers=1 renders in this process.
+    if fmt not in MARKSHEET_FORMATS: raise ValueError(f"Unknown marksheet format '{fmt}' (expected one of {', '.join(MARKSHEET_FORMATS)}).")
+    os.makedirs(output_dir, exist_ok=True)
+    existing = set() if overwrite else set(os.listdir(output_dir))
+    cursor = get_connection().cursor()
+    if class_section is None: cursor.execute("SELECT COUNT(*) FROM Students")
+    else: cursor.execute("SELECT COUNT(*) FROM Students WHERE class_section = ?", (class_section,))
+    total = cursor.fetchone()[0]
+    workers = workers or os.cpu_count() or 1
+    written, skipped, last_report = 0, 0, 0
+
+    def report(force=False):
+        nonlocal last_report
+        done = written + skipped
+        if progress and done != last_report and (force or done - last_report >= max(total // 20, MARKSHEET_CHUNK_SIZE)):
+            print(f"  {done}/{total} marksheets ({written} written, {skipped} already present)")
+            last_report = done
+
+    def chunks():
+        nonlocal skipped
+        chunk = []
+        for sheet in iter_marksheets(class_section):
+            if marksheet_filename(sheet["id"], fmt) in existing:
+                skipped += 1
+                continue
+            chunk.append(sheet)
+            if len(chunk) >= MARKSHEET_CHUNK_SIZE:
+                yield chunk
+                chunk = []
+        if chunk: yield chunk
+
+    if workers == 1:
+        for chunk in chunks():
+            written += _write_marksheet_chunk(output_dir, fmt, chunk)
+            report()
+    else:
+        from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = set()
+            for chunk in chunks():
+                pending.add(pool.submit(_write_marksheet_chunk, output_dir, fmt, chunk))
+                if len(pending) >= workers * 2: # Bound the rows held in memory
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    written += sum(f.result() for f in done)
+                    report()
+            for future in pending: written += future.result()
+    report(force=True)
+    return written, skipped
+
+def run_marksheet_generation(output_dir, class_section=None, fmt="txt", workers=None):
+    if CURRENT_USER_ROLE != "admin": print("Access Denied."); return None
+    scope = f"class {class_section}" if class_section else "all students"
+    print(f"Generating {fmt} marksheets for {scope} into '{output_dir}'...")
+    try: written, skipped = generate_marksheets(output_dir, class_section, fmt, workers)
+    except (ValueError, OSError) as e: print(f"Marksheet generation failed: {e}"); return None
+    print(f"Done: {written} marksheet(s) written, {skipped} already present.")
+    return written, skipped
+
+# --- Published Results Snapshot ---
+# "Publishing" compiles every marksheet, total, percentage and rank into one read-only file,
+# after which lookups need no SQLite at all. The file is a fixed header, then a fixed-width
+# index with one (offset, length) slot per student ID from min_id to max_id (length 0 for
+# IDs that don't exist), then one compact JSON record per student. Readers mmap the file and
+# find a record with a single index read, returning a memoryview over the mapped bytes.
+# The file is written under a temp name and renamed into place, so readers see the old
+# snapshot or the new one, never a partial file, and processes share its page cache.
+SNAPSHOT_MAGIC = b"SRMSRES1"
+_SNAPSHOT_HEADER = struct.Struct("<8sIIQQQQ") # magic, format, reserved, published_at, students, min_id, slots
+_SNAPSHOT_SLOT = struct.Struct("<QI")         # record offset, record length
+SNAPSHOT_CHECK_INTERVAL = 1.0 # Seconds between checks for a newly published file
+
+def results_snapshot_path(database=None):
+    return os.path.splitext(database or DATABASE_NAME)[0] + ".results"
+
+@timed_operation
+def publish_results(path=None):
+    # Returns the number of students published.
+    import json
+    path = path or results_snapshot_path()
+    conn = get_connection()
+    in_transaction = conn.in_transaction
+    if not in_transaction: conn.execute("BEGIN") # One consistent read of marks and ranks
+    try:
+        min_id, max_id = conn.execute("SELECT MIN(student_id), MAX(student_id) FROM Students").fetchone()
+        ranks = {row[0]: row[1:] for row in conn.execute('''
+            SELECT t.student_id, RANK() OVER (ORDER BY t.percentage DESC),
+                   RANK() OVER (PARTITION BY st.class_section ORDER BY t.percentage DESC)
+            FROM StudentTotals t JOIN Students st ON st.student_id = t.student_id''')}
+        slots = 0 if min_id is None else max_id - min_id + 1
+        index = bytearray(slots * _SNAPSHOT_SLOT.size)
+        data_start = _SNAPSHOT_HEADER.size + len(index)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        count = 0
+        try:
+            with open(tmp_path, "wb") as f:
+                f.seek(data_start)
+                offset = data_start
+                for sheet in iter_marksheets():
+                    rank, class_rank = ranks.get(sheet["id"], (None, None))
+                    record = json.dumps({"student_id": sheet["id"], "first_name": sheet["first_name"], "last_name": sheet["last_name"],
+                                         "class_section": sheet["class_section"],
+                                         "marks": [{"subject_name": s, "marks_obtained": o, "max_marks": m} for s, o, m in sheet["marks"]],
+                                         "total_obtained": sheet["total_obtained"], "total_max_marks": sheet["total_max_marks"],
+                                         "percentage": sheet["percentage"], "rank": rank, "class_rank": class_rank},
+                                        separators=(",", ":")).encode()
+                    f.write(record)
+                    _SNAPSHOT_SLOT.pack_into(index, (sheet["id"] - min_id) * _SNAPSHOT_SLOT.size, offset, len(record))
+                    offset += len(record)
+                    count += 1
+                f.seek(0)
+                f.write(_SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, 1, 0, int(time.time()), count, min_id or 0, slots))
+                f.write(index)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+            raise
+    finally:
+        if not in_transaction: conn.rollback() # Read-only transaction; just end it
+    return count
+
+class ResultsSnapshot:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self.identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, file_format, _, self.published_at, self.student_count, self._min_id, self._slots = \
+            _SNAPSHOT_HEADER.unpack_from(self._map, 0)
+        if magic != SNAPSHOT_MAGIC or file_format != 1:
+            self._map.close()
+            raise ValueError(f"'{path}' is not a results snapshot.")
+        self._view = memoryview(self._map)
+        self.path = path
+
+    def get_bytes(self, student_id):
+        # The student's JSON record as a memoryview into the mapping (no copy), or None.
+        slot = student_id - self._min_id
+        if not 0 <= slot < self._slots: return None
+        offset, length = _SNAPSHOT_SLOT.unpack_from(self._map, _SNAPSHOT_HEADER.size + slot * _SNAPSHOT_SLOT.size)
+        return self._view[offset:offset + length] if length else None
+
+    def get(self, student_id):
+        import json
+        record = self.get_bytes(student_id)
+        return None if record is None else json.loads(bytes(record))
+
+_snapshots = {} # path -> [ResultsSnapshot or None, monotonic time of the last file check]
+_snapshots_lock = threading.Lock()
+
+def get_results_snapshot(path=None):
+    # The currently published snapshot, or None. A republished file is picked up within
+    # SNAPSHOT_CHECK_INTERVAL seconds; until then lookups cost no system calls.
+    path = path or results_snapshot_path()
+    entry = _snapshots.get(path)
+    now = time.monotonic()
+    if entry is not None and now - entry[1] < SNAPSHOT_CHECK_INTERVAL: return entry[0]
+    with _snapshots_lock:
+        snapshot = entry[0] if entry else None
+        try:
+            stat = os.stat(path)
+            if snapshot is None or snapshot.identity != (stat.st_ino, stat.st_mtime_ns, stat.st_size):
+                snapshot = ResultsSnapshot(path) # The old mapping is released once no view refers to it
+        except (OSError, ValueError): snapshot = None
+        _snapshots[path] = [snapshot, now]
+    return snapshot
+
+def run_publish_results(path=None):
+    if CURRENT_USER_ROLE != "admin": print("Access Denied."); return None
+    path = path or results_snapshot_path()
+    try: count = publish_results(path)
+    except (sqlite3.Error, OSError) as e: print(f"Publishing failed, the previous snapshot is unchanged: {e}"); return None
+    print(f"Published results for {count} student(s) to '{path}'.")
+    return count
+
+def view_published_marksheet(student_id, path=None):
+    # Prints the student's published result. Returns False when nothing is published.
+    snapshot = get_results_snapshot(path)
+    if snapshot is None: return False
+    sheet = snapshot.get(student_id)
+    published = time.strftime("%Y-%m-%d %H:%M", time.localtime(snapshot.published_at))
+    if sheet is None: print(f"No published result for student ID {student_id} (results published {published})."); return True
+    print(f"\n--- Published Results for {sheet['first_name']} {sheet['last_name']} "
+          f"(ID: {student_id}, Class: {sheet['class_section']}) ---")
+    print("Subject          | Marks Obtained | Max Marks")
+    print("-----------------|----------------|-----------")
+    for mark in sheet["marks"]: print(f"{mark['subject_name']:<16} | {mark['marks_obtained']:<14} | {mark['max_marks']}")
+    print("-----------------|----------------|-----------")
+    print(f"{'Total:':<16} | {sheet['total_obtained']:<14} | {sheet['total_max_marks']}")
+    print(f"Percentage: {sheet['percentage']:.2f}%" if sheet["total_max_marks"] > 0 else "Percentage: N/A")
+    if sheet["rank"] is not None:
+        print(f"Rank: {sheet['rank']} of {snapshot.student_count} (class {sheet['class_section']}: {sheet['class_rank']})")
+    print(f"Results published {published}.")
+    print("-------------------------------------------")
+    return True
+
+# --- Streaming and Paged Listings ---
+# Generators walk a cursor with fetchmany, so memory stays flat however large the table.
+# Page functions use keyset pagination (WHERE key > last_key LIMIT n) and return
+# (rows, more), where `more` says whether rows exist beyond the page in that direction.
+def iter_query(sql, params=(), batch_size=FETCH_BATCH_SIZE, database=None):
+    cursor = get_connection(database).cursor()
+    cursor.execute(sql, params)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows: return
+        yield from rows
+
+def iter_students(batch_size=FETCH_BATCH_SIZE):
+    sql = "SELECT student_id, first_name, last_name, class_section FROM Students ORDER BY student_id"
+    if get_shards(): return iter_all_shards(sql, key=lambda row: row[0])
+    return iter_query(sql, batch_size=batch_size)
+
+def iter_subjects(batch_size=FETCH_BATCH_SIZE):
+    return iter_query("SELECT subject_id, subject_name, max_marks FROM Subjects ORDER BY subject_id",
+                      batch_size=batch_size)
+
+def iter_rankings(sort_key="percentage", batch_size=FETCH_BATCH_SIZE, by_class=False):
+    # Same ranks as get_ranked_students(), computed while streaming the score index.
+    # by_class lists class by class and ranks within each one.
+    if sort_key not in RANK_SORT_KEYS: raise ValueError(f"Cannot rank by '{sort_key}'.")
+    order = f"st.class_section, t.{sort_key} DESC, t.student_id" if by_class else f"t.{sort_key} DESC, t.student_id"
+    sql = f"{_SCORED_STUDENTS_SQL} ORDER BY {order}"
+    score_at = RANKING_COLUMNS.index(sort_key) - 1
+    if get_shards():
+        key = (lambda row: (row[3], -row[score_at], row[0])) if by_class else (lambda row: (-row[score_at], row[0]))
+        rows = iter_all_shards(sql, key=key)
+    else:
+        rows = iter_query(sql, batch_size=batch_size)
+    position, rank, last_score, last_class = 0, 0, None, object()
+    for row in rows:
+        stud = dict(zip(RANKING_COLUMNS[1:], row))
+        if by_class and stud["class_section"] != last_class:
+            position, last_score, last_class = 0, None, stud["class_section"]
+        position += 1
+        if stud[sort_key] != last_score:
+            rank, last_score = position, stud[sort_key]
+        stud["rank"] = rank
+        yield stud
+
+def _keyset_page(sql_after, sql_before, after, before, page_size, shard_key=None):
+    # shard_key (the ORDER BY of sql_after as a Python key) lets a sharded database build the
+    # page from every shard's page; without it the query runs on the primary only.
+    if shard_key and get_shards():
+        backwards = before is not None
+        sql, params = (sql_before, tuple(before)) if backwards else (sql_after, tuple(after))
+        rows = sorted((row for shard in get_shards() for row in get_connection(shard).execute(sql, params + (page_size + 1,))),
+                      key=shard_key, reverse=backwards)[:page_size + 1]
+        return (rows[:page_size][::-1] if backwards else rows[:page_size]), len(rows) > page_size
+    cursor = get_connection().cursor()
+    if before is not None:
+        cursor.execute(sql_before, tuple(before) + (page_size + 1,))
+        rows = cursor.fetchall()
+        return rows[:page_size][::-1], len(rows) > page_size
+    cursor.execute(sql_after, tuple(after) + (page_size + 1,))
+    rows = cursor.fetchall()
+    return rows[:page_size], len(rows) > page_size
+
+def get_students_page(after_id=None, before_id=None, page_size=PAGE_SIZE):
+    columns = "SELECT student_id, first_name, last_name, class_section FROM Students"
+    return _keyset_page(f"{columns} WHERE student_id > ? ORDER BY student_id LIMIT ?",
+                        f"{columns} WHERE student_id < ? ORDER BY student_id DESC LIMIT ?",
+                        (after_id if after_id is not None else -1,), None if before_id is None else (before_id,), page_size,
+                        shard_key=lambda row: row[0])
+
+def get_subjects_page(after_id=None, before_id=None, page_size=PAGE_SIZE):
+    columns = "SELECT subject_id, subject_name, max_marks FROM Subjects"
+    return _keyset_page(f"{columns} WHERE subject_id > ? ORDER BY subject_id LIMIT ?",
+                        f"{columns} WHERE subject_id < ? ORDER BY subject_id DESC LIMIT ?",
+                        (after_id if after_id is not None else -1,), None if before_id is None else (before_id,), page_size)
+
+def get_rankings_page(sort_key="percentage", after=None, before=None, page_size=PAGE_SIZE):
+    # after/before are (score, student_id) of the row at the page edge. Ranks are derived
+    # from the position of the first row, found in the live ranking index (or, when sharded,
+    # with two counts per shard on the score index).
+    if sort_key not in RANK_SORT_KEYS: raise ValueError(f"Cannot rank by '{sort_key}'.")
+    key = f"t.{sort_key}"
+    rows, more = _keyset_page(
+        f"{_SCORED_STUDENTS_SQL} WHERE {key} < ? OR ({key} = ? AND t.student_id > ?) ORDER BY {key} DESC, t.student_id LIMIT ?",
+        f"{_SCORED_STUDENTS_SQL} WHERE {key} > ? OR ({key} = ? AND t.student_id < ?) ORDER BY {key} ASC, t.student_id DESC LIMIT ?",
+        (after[0], after[0], after[1]) if after else (float("inf"), float("inf"), -1),
+        (before[0], before[0], before[1]) if before else None, page_size,
+        shard_key=lambda row: (-row[RANKING_COLUMNS.index(sort_key) - 1], row[0]))
+    if not rows: return [], more
+    page = [dict(zip(RANKING_COLUMNS[1:], row)) for row in rows]
+    first_score, first_id = page[0][sort_key], page[0]["id"]
+    index = get_ranking_index()
+    if index is not None: higher, tied_before = index.position(sort_key, first_score, first_id)
+    else:
+        higher = tied_before = 0
+        for database in get_shards():
+            cursor = get_connection(database).cursor()
+            cursor.execute(f"SELECT COUNT(*) FROM StudentTotals t WHERE {key} > ?", (first_score,))
+            higher += cursor.fetchone()[0]
+            cursor.execute(f"SELECT COUNT(*) FROM StudentTotals t WHERE {key} = ? AND t.student_id < ?", (first_score, first_id))
+            tied_before += cursor.fetchone()[0]
+    first_position = higher + tied_before + 1
+    rank, last_score = higher + 1, first_score
+    for offset, stud in enumerate(page):
+        if stud[sort_key] != last_score: rank, last_score = first_position + offset, stud[sort_key]
+        stud["rank"] = rank
+    return page, more
+
+def browse_pages(fetch_page, page_key, print_page, title):
+    # Interactive next/previous navigation over a keyset-paginated listing.
+    rows, has_next = fetch_page(None, None)
+    if not rows: return False
+    page_no, has_prev = 1, False
+    while True:
+        print(f"\n--- {title} (page {page_no}) ---")
+        print_page(rows)
+        options = (["(n)ext"] if has_next else []) + (["(p)revious"] if has_prev else []) + ["(q)uit"]
+        choice = input(f"{', '.join(options)}: ").lower().strip()
+        if choice == 'n' and has_next:
+            new_rows, more = fetch_page(page_key(rows[-1]), None)
+            if new_rows: rows, has_next, has_prev, page_no = new_rows, more, True, page_no + 1
+            else: has_next = False
+        elif choice == 'p' and has_prev:
+            new_rows, more = fetch_page(None, page_key(rows[0]))
+            if new_rows: rows, has_prev, has_next, page_no = new_rows, more, True, page_no - 1
+            else: has_prev = False
+        elif choice in ('q', ''): return True
+        else: print("Invalid choice.")
+
+def _print_students_page(students):
+    write_report(students, STUDENT_REPORT)
+
+def _print_subjects_page(subjects):
+    write_report(subjects, SUBJECT_REPORT)
+
+def browse_rankings(sort_key="percentage", page_size=PAGE_SIZE):
+    if not browse_pages(lambda after, before: get_rankings_page(sort_key, after, before, page_size),
+                        lambda stud: (stud[sort_key], stud["id"]), _print_ranking_table,
+                        f"Student Rankings (by {sort_key.replace('_', ' ').title()})"):
+        print("No performance data to rank.")
+
+# --- Results API ---
+# Read-only HTTP/JSON service for results day (`srms serve`), stdlib only. The asyncio loop
+# just parses requests and writes responses; the queries run on a bounded thread pool whose
+# threads each hold a read-only connection, so lookups never block on (or take) a write lock.
+# Identical requests arriving while one is in flight wait for that one's result instead of
+# queueing another query. Once results are published, marksheets are answered straight from
+# the mmapped snapshot on the event loop, with no query at all.
+#   GET /students/<id>/marksheet
+#   GET /rankings?by=percentage|total&top=N&per_class=1
+#   GET /subjects
+API_WORKERS = 8
+API_DEFAULT_TOP = 100
+API_MAX_TOP = 1000
+API_MAX_HEADER_BYTES = 8192
+
+@timed_operation
+def get_student_marksheet(student_id):
+    # Profile plus marks as one dict (no password hash), or None if the student doesn't exist.
+    student = get_student_by_id(student_id)
+    if not student: return None
+    marks, total, percentage = view_student_marks(student_id, print_header=False)
+    record = dict(zip(STUDENT_COLUMNS, student[:4]))
+    record.update({"marks": [{"subject_name": s, "marks_obtained": o, "max_marks": m} for s, o, m in marks or []],
+                   "total_obtained": total, "percentage": round(percentage, 2)})
+    return record
+
+def _api_resolve(path, query):
+    # Maps a request to a canonical query key, or to an (status, message) error. Requests
+    # that normalize to the same key are answered by a single query.
+    parts = [p for p in path.split("/") if p]
+    if len(parts) == 3 and parts[0] == "students" and parts[2] == "marksheet":
+        if not parts[1].isdigit(): return 400, "Student ID must be a number."
+        return ("marksheet", int(parts[1]))
+    if parts == ["rankings"]:
+        sort_key = {"percentage": "percentage", "total": "total_obtained"}.get(query.get("by", "percentage"))
+        if sort_key is None: return 400, "'by' must be 'percentage' or 'total'."
+        top = query.get("top", str(API_DEFAULT_TOP))
+        if not top.isdigit() or not 0 < int(top) <= API_MAX_TOP: return 400, f"'top' must be between 1 and {API_MAX_TOP}."
+        return ("rankings", sort_key, int(top), query.get("per_class", "0").lower() in ("1", "true", "yes"))
+    if parts == ["subjects"]: return ("subjects",)
+    return 404, f"No such endpoint: {path}"
+
+def _api_execute(key):
+    # Runs on a pool thread; returns (status, JSON body bytes).
+    import json
+    try:
+        if key[0] == "marksheet":
+            result = get_student_marksheet(key[1])
+            if result is None: return 404, json.dumps({"error": f"Student with ID {key[1]} not found."}).encode()
+        elif key[0] == "rankings": result = get_ranked_students(key[1], limit=key[2], by_class=key[3])
+        else: result = [dict(zip(SUBJECT_COLUMNS, row)) for row in get_all_subjects()]
+        return 200, json.dumps(result).encode()
+    except sqlite3.Error as e: return 503, json.dumps({"error": f"Database error: {e}"}).encode()
+
+def serve_results_api(host="127.0.0.1", port=8080, workers=API_WORKERS, snapshot_path=None):
+    import asyncio
+    import concurrent.futures
+    import http
+    import json
+    import urllib.parse
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="srms-api",
+                                                     initializer=use_read_only_connections)
+    inflight = {} # Query key -> future shared by every request waiting on it
+    snapshot_path = snapshot_path or results_snapshot_path()
+
+    async def fetch(key):
+        future = inflight.get(key)
+        if future is None:
+            future = inflight[key] = asyncio.get_running_loop().run_in_executor(executor, _api_execute, key)
+            future.add_done_callback(lambda _: inflight.pop(key, None))
+        return await asyncio.shield(future) # A client hanging up must not cancel it for the others
+
+    async def respond(writer, status, body, keep_alive, head_only=False):
+        writer.write((f"HTTP/1.1 {status} {http.HTTPStatus(status).phrase}\r\n"
+                      f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                      f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode("latin-1"))
+        if not head_only: writer.write(body)
+        await writer.drain()
+
+    def error_body(message):
+        return json.dumps({"error": message}).encode()
+
+    async def handle_connection(reader, writer):
+        try:
+            while True: # One request per iteration; HTTP/1.1 connections stay open for the next
+                try: head = await reader.readuntil(b"\r\n\r\n")
+                except asyncio.IncompleteReadError: break # Client closed the connection
+                except asyncio.LimitOverrunError:
+                    await respond(writer, 431, error_body("Request header too large."), False); break
+                lines = head.decode("latin-1").split("\r\n")
+                request_line = lines[0].split()
+                if len(request_line) != 3:
+                    await respond(writer, 400, error_body("Malformed request line."), False); break
+                method, target, version = request_line
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(":")
+                    if name: headers[name.strip().lower()] = value.strip()
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+                body_length = headers.get("content-length", "0")
+                if not body_length.isdigit():
+                    await respond(writer, 400, error_body("Invalid Content-Length."), False); break
+                if int(body_length): await reader.readexactly(int(body_length)) # Ignored; every endpoint is a GET
+
+                if method not in ("GET", "HEAD"):
+                    await respond(writer, 405, error_body("Only GET is supported."), keep_alive); continue
+                url = urllib.parse.urlsplit(target)
+                key = _api_resolve(urllib.parse.unquote(url.path), dict(urllib.parse.parse_qsl(url.query)))
+                snapshot = get_results_snapshot(snapshot_path) if key[0] == "marksheet" else None
+                if isinstance(key[0], int): status, body = key[0], error_body(key[1])
+                elif snapshot is not None:
+                    body = snapshot.get_bytes(key[1])
+                    status, body = (200, body) if body is not None else (404, error_body(f"Student with ID {key[1]} not found."))
+                else: status, body = await fetch(key)
+                await respond(writer, status, body, keep_alive, head_only=method == "HEAD")
+                if not keep_alive: break
+        except (ConnectionError, asyncio.IncompleteReadError): pass
+        finally: writer.close()
+
+    async def run():
+        server = await asyncio.start_server(handle_connection, host, port, limit=API_MAX_HEADER_BYTES, backlog=1024)
+        print(f"Serving results API on http://{host}:{port} with {workers} query threads (Ctrl+C to stop).")
+        if get_results_snapshot(snapshot_path): print(f"Marksheets are served from the published results in '{snapshot_path}'.")
+        async with server: await server.serve_forever()
+
+    try: asyncio.run(run())
+    except KeyboardInterrupt: print("\nResults API stopped.")
+    except OSError as e: print(f"Could not start the results API: {e}"); return False
+    finally: executor.shutdown(wait=True)
+    return True
+
 # --- Menus ---
+# Refused when sharded. Bulk import (12) would have to route every row to its student's shard
+# in one transaction per file; term history, trends and closing (19, 20, 22) need each term's
+# archive to match one file's marks, and the snapshot (23) one consistent read of everything.
+# None of these can be atomic across several database files.
+SINGLE_DATABASE_CHOICES = {"12", "19", "20", "22", "23"}
+
 def admin_menu():
     while True:
         print("\n╔══════════════════════════════════════════════╗")
@@ -442,18 +3484,31 @@ def admin_menu():
         print("║ Marks Management:                            ║")
         print("║  10. Add or Update Student Marks             ║")
         print("║  11. View Student Marksheet (by ID)          ║")
+        print("║  12. Bulk Import from CSV/JSON-lines File    ║")
         print("║----------------------------------------------║")
         print("║ Reports:                                     ║")
-        print("║  12. View Overall Student Rankings           ║")
-        print("║  13. View Top N Performing Students          ║")
-        print("║  14. View List of Students Below Threshold   ║")
+        print("║  13. View Overall Student Rankings           ║")
+        print("║  14. View Top N Performing Students          ║")
+        print("║  15. View List of Students Below Threshold   ║")
+        print("║  16. Subject Statistics (mean/median/bands)  ║")
+        print("║  17. Class/Section Statistics                ║")
+        print("║  18. Generate Marksheet Files (Class/School) ║")
+        print("║  19. Student Term History                    ║")
+        print("║  20. Term Trends                             ║")
         print("║----------------------------------------------║")
         print("║ System:                                      ║")
-        print("║  15. Logout                                  ║")
+        print("║  21. Verify/Rebuild Report Totals            ║")
+        print("║  22. Close Current Term and Start the Next   ║")
+        print("║  23. Publish Results Snapshot                ║")
+        print("║  24. Performance Stats                       ║")
+        print("║  25. Logout                                  ║")
         print("╚══════════════════════════════════════════════╝")
 
-        choice = input("Admin choice (1-15): ").strip()
+        choice = input("Admin choice (1-25): ").strip()
+        operation = begin_operation(f"admin menu {choice}")
         try:
+            if choice in SINGLE_DATABASE_CHOICES and get_shards():
+                print("This option works on a single database and this one is sharded."); continue
             if choice == '1': # Add Student
                 fn = input("Enter student's first name: ").strip()
                 ln = input("Enter student's last name: ").strip()
@@ -510,31 +3565,65 @@ def admin_menu():
                     view_student_marks(int(stud_id_str))
                 else:
                     print("Invalid Student ID format.")
-            elif choice == '12': # View Overall Student Rankings
-                data = get_student_performance_data()
-                if data:
-                    rc = input("Rank by (p)ercentage (default) or (t)otal marks? ").lower().strip()
-                    rank_students(data, "total_obtained" if rc == 't' else "percentage")
-                else:
-                    print("No data available to generate rankings.")
-            elif choice == '13': # View Top N Performing Students
+            elif choice == '12': # Bulk Import
+                kind = input(f"Import what? ({'/'.join(IMPORT_KINDS)}, default marks): ").strip().lower() or "marks"
+                path = input("Path to .csv or .jsonl file: ").strip()
+                if path: run_bulk_import(path, kind)
+                else: print("Error: File path cannot be empty.")
+            elif choice == '13': # View Overall Student Rankings
+                rc = input("Rank by (p)ercentage (default) or (t)otal marks? ").lower().strip()
+                per_class = input("Rank within each class/section? (y/n, default n): ").lower().strip() == 'y'
+                path = input(REPORT_SAVE_PROMPT).strip() or None
+                if per_class or path: rank_students(sort_key="total_obtained" if rc == 't' else "percentage", by_class=per_class, path=path)
+                else: browse_rankings("total_obtained" if rc == 't' else "percentage")
+            elif choice == '14': # View Top N Performing Students
                 top_n_str = input("Enter N for Top N students (default 10): ").strip()
                 top_n = int(top_n_str) if top_n_str.isdigit() else 10
                 sc = input("Sort Top N by (p)ercentage (default) or (t)otal marks? ").lower().strip()
-                view_top_n_students(top_n, "total_obtained" if sc == 't' else "percentage")
-            elif choice == '14': # View List of Students Below Threshold
+                per_class = input("Top N within each class/section? (y/n, default n): ").lower().strip() == 'y'
+                view_top_n_students(top_n, "total_obtained" if sc == 't' else "percentage", per_class, input(REPORT_SAVE_PROMPT).strip() or None)
+            elif choice == '15': # View List of Students Below Threshold
                 th_str = input("Enter failing percentage threshold (default 40%): ").strip()
                 threshold = float(th_str) if th_str else 40.0 # Add better validation for float
-                view_failed_list(threshold)
-            elif choice == '15': # Logout
+                view_failed_list(threshold, input(REPORT_SAVE_PROMPT).strip() or None)
+            elif choice == '16': # Subject Statistics
+                view_subject_statistics()
+            elif choice == '17': # Class/Section Statistics
+                view_class_statistics()
+            elif choice == '18': # Generate Marksheet Files
+                cs = input("Class/section (Enter for the whole school): ").strip() or None
+                fmt = input(f"Format ({'/'.join(MARKSHEET_FORMATS)}, default txt): ").strip().lower() or "txt"
+                out_dir = input("Output directory (default marksheets): ").strip() or "marksheets"
+                run_marksheet_generation(out_dir, cs, fmt)
+            elif choice == '19': # Student Term History
+                stud_id_str = input("Enter Student ID: ").strip()
+                if stud_id_str.isdigit(): view_student_history(int(stud_id_str))
+                else: print("Invalid Student ID format.")
+            elif choice == '20': # Term Trends
+                view_term_trends(input("Class/section (Enter for all classes): ").strip() or None)
+            elif choice == '21': # Verify/Rebuild Report Totals
+                if not verify_student_totals() and input("Rebuild report totals now? (y/n): ").lower().strip() == 'y':
+                    print(f"Rebuilt report totals for {rebuild_student_totals()} student(s).")
+            elif choice == '22': # Close Current Term and Start the Next
+                term = get_current_term()
+                print(f"Current term: {term['name'] if term else 'none'}. Its marks will be archived and cleared.")
+                name = input("Name of the next term (Enter to cancel): ").strip()
+                if name: run_close_term(name)
+                else: print("Cancelled.")
+            elif choice == '23': # Publish Results Snapshot
+                run_publish_results()
+            elif choice == '24': # Performance Stats
+                performance_stats_menu()
+            elif choice == '25': # Logout
                 logout()
                 break # Exit the admin menu loop
             else:
-                print("Invalid choice. Please enter a number between 1 and 15.")
+                print("Invalid choice. Please enter a number between 1 and 25.")
         except ValueError:
             print("Invalid input type. Please ensure you enter numbers where expected (e.g., for IDs, marks).")
         except Exception as e: # Catch any other unexpected errors during menu operation
             print(f"An unexpected error occurred in the admin menu: {e}")
+        finally: end_operation(operation)
 
 # ... (The rest of your srms.py code: student_menu, main_application_loop, all other functions, if __name__ == "__main__":)
 
@@ -547,20 +3636,30 @@ def student_menu():
     name = f"{stud_data[1]} {stud_data[2]}"
 
     while True:
+        standing = get_student_rank(CURRENT_USER_ID)
+        standing = f"Rank {standing[0]} of {standing[1]}" if standing else "Not ranked yet"
         print(f"\n╔═══ Student Dashboard - {name[:15]:<15}═══╗")
+        print(f"║ {standing[:35]:<35} ║")
         print(f"║ 1. View My Profile & Marksheet      ║")
-        print(f"║ 2. Logout                           ║")
+        print(f"║ 2. View My Term History             ║")
+        print(f"║ 3. Logout                           ║")
         print(f"╚═════════════════════════════════════╝")
-        choice = input(f"{name}, your choice (1-2): ").strip()
+        choice = input(f"{name}, your choice (1-3): ").strip()
         try:
-            if choice == '1': view_student_profile(CURRENT_USER_ID)
-            elif choice == '2': logout(); break
+            if choice == '1': # Published results when there are any, otherwise the live record
+                if not view_published_marksheet(CURRENT_USER_ID): view_student_profile(CURRENT_USER_ID)
+            elif choice == '2': view_student_history(CURRENT_USER_ID)
+            elif choice == '3': logout(); break
             else: print("Invalid choice.")
         except Exception as e: print(f"Student menu error: {e}")
 
 def main_application_loop():
     if not os.path.exists(DATABASE_NAME):
         print("Database not found. Initializing..."); initialize_database()
+    else: apply_migrations()
+    if MEMORY_SESSION and not get_shards():
+        start_memory_session()
+        print(f"Working on an in-memory copy of '{DATABASE_NAME}' (saved every {MEMORY_CHECKPOINT_INTERVAL:g}s, on logout and at exit).")
     while True:
         if CURRENT_USER_ROLE is None:
             if not login():
@@ -571,6 +3670,341 @@ def main_application_loop():
         if CURRENT_USER_ROLE is None and input("Return to login? (y/n): ").lower() != 'y':
              print("Exiting system."); break
 
+# --- Headless Command Mode ---
+# `python srms.py <command> ...` runs one operation without the login/menu flow, as the
+# admin, and exits. --format json/csv/tsv writes machine-readable output to stdout; the usual
+# human-readable messages from the underlying functions go to stderr in those modes.
+STUDENT_COLUMNS = ("student_id", "first_name", "last_name", "class_section")
+SUBJECT_COLUMNS = ("subject_id", "subject_name", "max_marks")
+
+_cli_data_stream = None # Real stdout while a machine-readable command runs
+
+def emit_records(rows, columns, fmt, print_table=None):
+    # Streams rows (tuples or dicts) as a JSON array, CSV, TSV, or - for the table format -
+    # hands them to print_table (tab-separated when there is none).
+    out = _cli_data_stream or sys.stdout
+    if fmt == "table" and print_table:
+        print_table(rows)
+        return
+    records = (r if isinstance(r, dict) else dict(zip(columns, r)) for r in rows)
+    if fmt == "json":
+        import json
+        out.write("[")
+        for i, record in enumerate(records):
+            out.write(("," if i else "") + "\n  " + json.dumps({c: record.get(c) for c in columns}))
+        out.write("\n]\n")
+    else: # CSV/TSV with a header; tab-separated without one for a table that has no printer
+        write_report(records, [(c, c, c) for c in columns], out, "tsv" if fmt == "table" else fmt, header=fmt != "table")
+
+def emit_object(obj, fmt):
+    out = _cli_data_stream or sys.stdout
+    if fmt == "json":
+        import json
+        print(json.dumps(obj, indent=2), file=out)
+    elif fmt in ("csv", "tsv"): emit_records([obj], tuple(obj), fmt)
+    else:
+        for key, value in obj.items(): print(f"{key}: {value}", file=out)
+
+def _cmd_students_list(args):
+    if args.class_section is None: rows = iter_students()
+    else:
+        sql = "SELECT student_id, first_name, last_name, class_section FROM Students WHERE class_section = ? ORDER BY student_id"
+        if get_shards(): rows = iter_all_shards(sql, (args.class_section,), key=lambda row: row[0]) # Moved students stay in their shard
+        else: rows = iter_query(sql, (args.class_section,))
+    emit_records(rows, STUDENT_COLUMNS, args.format, _print_students_page)
+
+def _cmd_students_show(args):
+    student = get_student_by_id(args.student_id)
+    if not student: print(f"Student with ID {args.student_id} not found.", file=sys.stderr); return 1
+    if args.format == "table":
+        view_student_profile(args.student_id)
+        return 0
+    record = get_student_marksheet(args.student_id)
+    if args.format == "json": emit_object(record, "json")
+    else: emit_records(record["marks"], ("subject_name", "marks_obtained", "max_marks"), args.format)
+    return 0
+
+def _cmd_students_add(args):
+    student_id = add_student(args.first_name, args.last_name, args.class_section, args.password)
+    if student_id is None: return 1
+    if args.format != "table": emit_object({"student_id": student_id}, args.format)
+
+def _cmd_students_search(args):
+    emit_records(find_students(args.term, args.limit), STUDENT_COLUMNS, args.format, _print_students_page)
+
+def _cmd_subjects_list(args):
+    emit_records(iter_subjects(), SUBJECT_COLUMNS, args.format, _print_subjects_page)
+
+def _cmd_subjects_add(args):
+    subject_id = add_subject(args.subject_name, args.max_marks)
+    if subject_id is None: return 1
+    if args.format != "table": emit_object({"subject_id": subject_id}, args.format)
+
+def _cmd_subjects_search(args):
+    emit_records(find_subjects(args.term, args.limit), SUBJECT_COLUMNS, args.format, _print_subjects_page)
+
+def _cmd_marks_set(args):
+    mark_id = add_marks(args.student_id, args.subject_id, args.marks)
+    if hasattr(mark_id, "result"): # Write-behind async mode: the command still reports the outcome
+        try: mark_id = mark_id.result()
+        except sqlite3.Error as e: print(f"Error adding/replacing marks: {e}", file=sys.stderr); return 1
+    if mark_id is None: return 1
+    if args.format != "table": emit_object({"mark_id": mark_id, "student_id": args.student_id,
+                                            "subject_id": args.subject_id, "marks_obtained": args.marks}, args.format)
+
+def _cmd_report_rank(args):
+    sort_key = "total_obtained" if args.by == "total" else "percentage"
+    if args.top is None: rows = iter_rankings(sort_key, by_class=args.per_class) # Streams, whatever the roster size
+    else: rows = get_ranked_students(sort_key, limit=args.top, by_class=args.per_class)
+    emit_records(rows, RANKING_COLUMNS, args.format, lambda rows: _print_ranking_table(rows, args.per_class))
+
+def _cmd_report_failed(args):
+    if args.format == "table": view_failed_list(args.threshold)
+    else: emit_records(get_failed_students(args.threshold), RANKING_COLUMNS[1:], args.format)
+
+def _cmd_report_stats(args):
+    try: stats = compute_statistics(pass_percentage=args.pass_percentage)
+    except RuntimeError as e: print(e, file=sys.stderr); return 1
+    rows = stats[args.scope]
+    if args.format == "json":
+        emit_object(rows, "json")
+        return 0
+    key_columns = ("subject_id", "subject_name", "max_marks") if args.scope == "subjects" else ("class_section",)
+    flat = [dict({k: r[k] for k in key_columns}, count=r["count"], mean=r["mean"], median=r["median"], std=r["std"],
+                 min=r["min"], max=r["max"], pass_rate=r["pass_rate"],
+                 **{f"p{q}": v for q, v in r["percentiles"].items()}, **r["grade_bands"]) for r in rows]
+    columns = tuple(flat[0].keys()) if flat else key_columns
+    if args.format in ("csv", "tsv"): emit_records(flat, columns, args.format)
+    elif args.scope == "subjects": view_subject_statistics()
+    else: view_class_statistics()
+
+def _cmd_import(args):
+    result = run_bulk_import(args.file, args.kind)
+    if result is None: return 1
+    if args.format != "table":
+        emit_object({"imported": result[0], "rejected": [{"line": n, "reason": r} for n, r in result[1]]}, args.format)
+    return 0 if not result[1] else 1
+
+def _cmd_marksheets(args):
+    result = run_marksheet_generation(args.output_dir, args.class_section, args.marksheet_format, args.workers)
+    return 0 if result else 1
+
+def _cmd_serve(args):
+    return 0 if serve_results_api(args.host, args.port, args.workers, args.snapshot) else 1
+
+def _cmd_results_publish(args):
+    count = run_publish_results(args.output)
+    if count is None: return 1
+    if args.format != "table": emit_object({"students": count, "path": args.output or results_snapshot_path()}, args.format)
+
+def _cmd_results_show(args):
+    snapshot = get_results_snapshot(args.snapshot)
+    if snapshot is None: print("No published results found. Run 'srms results publish' first.", file=sys.stderr); return 1
+    record = snapshot.get(args.student_id)
+    if record is None: print(f"No published result for student ID {args.student_id}.", file=sys.stderr); return 1
+    if args.format == "table":
+        view_published_marksheet(args.student_id, args.snapshot)
+        return 0
+    if args.format == "json": emit_object(record, "json")
+    else: emit_records(record["marks"], ("subject_name", "marks_obtained", "max_marks"), args.format)
+
+def _cmd_terms_list(args):
+    emit_records(list_terms(), ("term_id", "name", "started_at", "closed_at", "archive_path"), args.format)
+
+def _cmd_terms_close(args):
+    term = run_close_term(args.next_term)
+    if term is None: return 1
+    if args.format != "table": emit_object({"closed": term["name"], "archive_path": term["archive_path"], "current": args.next_term}, args.format)
+
+def _cmd_terms_history(args):
+    if args.format == "table": return 0 if view_student_history(args.student_id) else 1
+    history = get_student_history(args.student_id)
+    if args.format == "json": emit_object(history, "json")
+    else: emit_records(history, ("term", "current", "total_obtained", "total_max_marks", "percentage", "rank", "students"), args.format)
+    return 0 if history else 1
+
+def _cmd_terms_trends(args):
+    if args.format == "table": view_term_trends(args.class_section)
+    else: emit_records(get_term_trends(args.class_section),
+                       ("term", "current", "students", "average_percentage", "best_percentage", "pass_rate"), args.format)
+
+def _cmd_changes_status(args):
+    status = get_changelog_status()
+    if args.format != "table":
+        emit_object(status, args.format)
+        return
+    print(f"Latest change: {status['latest_seq']} ({status['entries']} entries kept, oldest {status['oldest_seq'] or '-'})")
+    if status["purged_through"]: print(f"Purged through: {status['purged_through']} (exports must start after it)")
+
+def _cmd_changes_export(args):
+    out = open(args.output, "w", encoding="utf-8") if args.output else (_cli_data_stream or sys.stdout)
+    try: count, cursor = export_changes(out, args.since, args.limit)
+    except ValueError as e: print(e, file=sys.stderr); return 1
+    finally:
+        if args.output: out.close()
+    print(f"Exported {count} change(s); next cursor: {cursor}", file=sys.stderr)
+
+def _cmd_changes_compact(args):
+    print(f"Removed {compact_changelog(args.before)} superseded change(s).")
+
+def _cmd_changes_purge(args):
+    print(f"Purged {purge_changelog(args.through)} change(s); cursors before {args.through} now need a full copy.")
+
+def _cmd_db_init(args):
+    initialize_database()
+
+def _cmd_db_migrate(args):
+    if not os.path.exists(DATABASE_NAME): print(f"Database '{DATABASE_NAME}' not found.", file=sys.stderr); return 1
+    applied = apply_migrations()
+    print(f"Schema is at version {get_schema_version()}" + ("" if applied else " (already up to date)") + ".")
+
+def _cmd_db_check_plans(args):
+    return 0 if run_query_plan_check() else 1
+
+def _cmd_db_check_totals(args):
+    return 0 if verify_student_totals(repair=args.repair) else 1
+
+def _cmd_db_shard(args):
+    return 0 if run_configure_shards(args.paths) else 1
+
+def _cmd_db_rebuild_search(args):
+    print("Search index rebuilt." if rebuild_search_index() else "FTS5 trigram search is not available; using LIKE search.")
+
+def build_cli_parser():
+    import argparse
+    parser = argparse.ArgumentParser(prog="srms", description="Student Result Management System. Run without arguments for the interactive menu.")
+    parser.add_argument("--db", help=f"database file (default: {DATABASE_NAME})")
+    parser.add_argument("--instrument", action="store_true", help="time every statement and print performance stats to stderr")
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument("--format", choices=("table", "json", "csv", "tsv"), default="table", help="output format (default: table)")
+    output.add_argument("--json", dest="format", action="store_const", const="json", help="shorthand for --format json")
+    output.add_argument("--csv", dest="format", action="store_const", const="csv", help="shorthand for --format csv")
+    output.add_argument("--tsv", dest="format", action="store_const", const="tsv", help="shorthand for --format tsv")
+    commands = parser.add_subparsers(dest="command", metavar="command", required=True)
+
+    def group(name, help_text):
+        return commands.add_parser(name, help=help_text).add_subparsers(dest="action", metavar="action", required=True)
+    def command(subparsers, name, handler, help_text, needs_db=True, sharded_ok=True):
+        cmd = subparsers.add_parser(name, help=help_text, parents=[output])
+        cmd.set_defaults(handler=handler, needs_db=needs_db, sharded_ok=sharded_ok)
+        return cmd
+
+    students = group("students", "list, show, add or search students")
+    cmd = command(students, "list", _cmd_students_list, "list students")
+    cmd.add_argument("--class", dest="class_section", help="only this class/section")
+    command(students, "show", _cmd_students_show, "profile and marksheet").add_argument("student_id", type=int)
+    cmd = command(students, "add", _cmd_students_add, "add a student")
+    cmd.add_argument("first_name")
+    cmd.add_argument("last_name")
+    cmd.add_argument("class_section")
+    cmd.add_argument("--password")
+    cmd = command(students, "search", _cmd_students_search, "search by ID or name part")
+    cmd.add_argument("term")
+    cmd.add_argument("--limit", type=int, default=SEARCH_RESULT_LIMIT)
+
+    subjects = group("subjects", "list, add or search subjects")
+    command(subjects, "list", _cmd_subjects_list, "list subjects")
+    cmd = command(subjects, "add", _cmd_subjects_add, "add a subject")
+    cmd.add_argument("subject_name")
+    cmd.add_argument("--max-marks", type=int, default=100)
+    cmd = command(subjects, "search", _cmd_subjects_search, "search by name part")
+    cmd.add_argument("term")
+    cmd.add_argument("--limit", type=int, default=SEARCH_RESULT_LIMIT)
+
+    marks = group("marks", "record or view marks")
+    cmd = command(marks, "set", _cmd_marks_set, "add or update one mark")
+    cmd.add_argument("student_id", type=int)
+    cmd.add_argument("subject_id", type=int)
+    cmd.add_argument("marks", type=int)
+    command(marks, "show", _cmd_students_show, "a student's marksheet").add_argument("student_id", type=int)
+
+    report = group("report", "rankings and analytics")
+    cmd = command(report, "rank", _cmd_report_rank, "student rankings")
+    cmd.add_argument("--by", choices=("percentage", "total"), default="percentage")
+    cmd.add_argument("--top", type=int, help="only the top N (per class with --per-class)")
+    cmd.add_argument("--per-class", action="store_true", help="rank within each class/section")
+    cmd = command(report, "failed", _cmd_report_failed, "students below a percentage")
+    cmd.add_argument("--threshold", type=float, default=40.0)
+    cmd = command(report, "stats", _cmd_report_stats, "subject or class statistics (needs NumPy)")
+    cmd.add_argument("scope", choices=("subjects", "classes"))
+    cmd.add_argument("--pass-percentage", type=float, default=PASS_PERCENTAGE)
+
+    cmd = command(commands, "import", _cmd_import, "bulk import a CSV or JSON-lines file", sharded_ok=False)
+    cmd.add_argument("kind", choices=IMPORT_KINDS)
+    cmd.add_argument("file")
+    cmd = command(commands, "marksheets", _cmd_marksheets, "write marksheet files for a class or the school")
+    cmd.add_argument("output_dir")
+    cmd.add_argument("--class", dest="class_section")
+    cmd.add_argument("--as", dest="marksheet_format", choices=MARKSHEET_FORMATS, default="txt", help="file format (default: txt)")
+    cmd.add_argument("--workers", type=int, help="worker processes (default: CPU count)")
+
+    cmd = command(commands, "serve", _cmd_serve, "run the read-only results HTTP API")
+    cmd.add_argument("--host", default="127.0.0.1")
+    cmd.add_argument("--port", type=int, default=8080)
+    cmd.add_argument("--workers", type=int, default=API_WORKERS, help=f"query threads (default: {API_WORKERS})")
+    cmd.add_argument("--snapshot", help="published results file (default: next to the database)")
+
+    terms = group("terms", "academic terms and their archives")
+    command(terms, "list", _cmd_terms_list, "all terms, current last")
+    command(terms, "close", _cmd_terms_close, "archive the current term and start the next", sharded_ok=False).add_argument("next_term")
+    command(terms, "history", _cmd_terms_history, "a student's results across terms", sharded_ok=False).add_argument("student_id", type=int)
+    command(terms, "trends", _cmd_terms_trends, "per-term averages and pass rates", sharded_ok=False).add_argument("--class", dest="class_section")
+
+    results = group("results", "publish or read the results snapshot")
+    command(results, "publish", _cmd_results_publish, "compile all results into the snapshot file", sharded_ok=False).add_argument("--output")
+    cmd = command(results, "show", _cmd_results_show, "a student's published result", needs_db=False)
+    cmd.add_argument("student_id", type=int)
+    cmd.add_argument("--snapshot")
+
+    changes = group("changes", "change log for replicas and incremental backups")
+    command(changes, "status", _cmd_changes_status, "latest sequence number and log size", sharded_ok=False)
+    cmd = command(changes, "export", _cmd_changes_export, "changes after a cursor, as JSON lines", sharded_ok=False)
+    cmd.add_argument("--since", type=int, default=0, help="cursor from the previous export (default: 0)")
+    cmd.add_argument("--limit", type=int, help="at most this many changes")
+    cmd.add_argument("--output", help="write to this file instead of stdout")
+    cmd = command(changes, "compact", _cmd_changes_compact, "drop entries superseded by later ones (safe for all cursors)", sharded_ok=False)
+    cmd.add_argument("--before", type=int, help="only entries before this seq (default: all)")
+    cmd = command(changes, "purge", _cmd_changes_purge, "drop every entry up to a seq (older cursors must resync)", sharded_ok=False)
+    cmd.add_argument("through", type=int)
+
+    db = group("db", "database maintenance")
+    command(db, "init", _cmd_db_init, "create the database", needs_db=False)
+    command(db, "migrate", _cmd_db_migrate, "apply pending schema migrations", needs_db=False)
+    command(db, "check-plans", _cmd_db_check_plans, "fail if a hot query does a full table scan")
+    command(db, "check-totals", _cmd_db_check_totals, "verify report totals").add_argument("--repair", action="store_true")
+    command(db, "rebuild-search", _cmd_db_rebuild_search, "rebuild the full-text search index", sharded_ok=False)
+    cmd = command(db, "shard", _cmd_db_shard, "spread students over these extra database files (empty database only)")
+    cmd.add_argument("paths", nargs="+", metavar="PATH")
+    return parser
+
+def run_cli(argv):
+    global DATABASE_NAME, CURRENT_USER_ROLE, _cli_data_stream
+    args = build_cli_parser().parse_args(argv)
+    command_name = " ".join(filter(None, ("srms", args.command, getattr(args, "action", None))))
+    if args.db: DATABASE_NAME = args.db
+    if args.instrument: enable_instrumentation()
+    if args.needs_db:
+        if not os.path.exists(DATABASE_NAME):
+            print(f"Database '{DATABASE_NAME}' not found. Run 'srms db init' first.", file=sys.stderr); return 1
+        if get_schema_version() < SCHEMA_VERSION: apply_migrations(verbose=False) # Only a PRAGMA read when current
+        if not args.sharded_ok and get_shards():
+            print(f"'{command_name}' works on a single database and '{DATABASE_NAME}' is sharded.", file=sys.stderr); return 1
+    CURRENT_USER_ROLE = "admin"
+    operation = begin_operation(command_name)
+    try:
+        if args.format == "table": return args.handler(args) or 0
+        _cli_data_stream = sys.stdout
+        with contextlib.redirect_stdout(sys.stderr): # Status messages must not corrupt the data
+            return args.handler(args) or 0
+    except BrokenPipeError: # e.g. piped into `head`; silence the final flush at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 0
+    finally:
+        _cli_data_stream = None
+        end_operation(operation)
+        if args.instrument:
+            with contextlib.redirect_stdout(sys.stderr): view_performance_stats()
 
 if __name__ == "__main__":
-    main_application_loop()
\ No newline at end of file
+    if len(sys.argv) > 1: sys.exit(run_cli(sys.argv[1:]))
+    main_application_loop()
@@ -0,0 +1,219 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import time
+
+import srms
+
+# Synthetic data and benchmarks for srms.py.
+#   python srms_bench.py generate big.db --students 100000 --subjects 50 --density 0.9
+#   python srms_bench.py run --sizes 1000x20,20000x50 --output results.json --baseline baseline.json
+# Datasets are deterministic for a given seed and size, and are cached in --data-dir.
+# Every run works on a scratch copy, so the write benchmarks never dirty the cache. Results
+# are JSON; --baseline compares each operation's median and exits 1 on a regression.
+
+FIRST_NAMES = ("Aarav", "Aisha", "Arjun", "Diya", "Ishaan", "Kavya", "Meera", "Neha", "Priya", "Rahul", "Rohan",
+               "Sara", "Tanvi", "Vihaan", "Zara", "Anika", "Kabir", "Myra", "Reyansh", "Siddharth")
+LAST_NAMES = ("Sharma", "Patel", "Reddy", "Iyer", "Khan", "Gupta", "Nair", "Das", "Mehta", "Joshi", "Rao",
+              "Singh", "Verma", "Kulkarni", "Chopra", "Bose", "Pillai", "Malhotra", "Menon", "Agarwal")
+SUBJECT_NAMES = ("Mathematics", "Physics", "Chemistry", "Biology", "English", "Hindi", "History", "Geography",
+                 "Economics", "Computer Science", "Civics", "Accountancy", "Art", "Music", "Physical Education")
+CLASS_SECTIONS = tuple(f"{grade}{section}" for grade in range(6, 13) for section in "ABCDE")
+MAX_MARKS_CHOICES = (50, 80, 100, 100, 100)
+
+DEFAULT_SIZES = "1000x20,10000x50"
+DEFAULT_DENSITY = 0.9
+DEFAULT_SEED = 42
+DEFAULT_THRESHOLD = 0.25 # Allowed slowdown of a median before it counts as a regression
+NOISE_FLOOR_MS = 0.1     # Ignore differences smaller than this; they are timer noise
+
+def parse_size(text):
+    students, _, subjects = text.lower().partition("x")
+    try: return int(students), int(subjects)
+    except ValueError: raise argparse.ArgumentTypeError(f"size must look like 10000x50, got {text!r}")
+
+def generate_dataset(path, students, subjects, density=DEFAULT_DENSITY, seed=DEFAULT_SEED):
+    # Builds a fresh database at path. Each student has an ability and each subject a
+    # difficulty, so totals, rankings and pass rates have a realistic spread.
+    if os.path.exists(path): raise FileExistsError(f"'{path}' already exists.")
+    rng = random.Random(seed)
+    srms.DATABASE_NAME = path
+    with quiet(): srms.initialize_database()
+    abilities = [min(0.98, max(0.1, rng.gauss(0.62, 0.15))) for _ in range(students)]
+    difficulties = [rng.uniform(-0.08, 0.08) for _ in range(subjects)]
+    max_marks = [rng.choice(MAX_MARKS_CHOICES) for _ in range(subjects)]
+
+    def mark_rows():
+        for student_id in range(1, students + 1):
+            ability = abilities[student_id - 1]
+            for subject_id in range(1, subjects + 1):
+                if rng.random() >= density: continue
+                score = ability - difficulties[subject_id - 1] + rng.gauss(0, 0.1)
+                top = max_marks[subject_id - 1]
+                yield student_id, subject_id, min(top, max(0, round(score * top)))
+
+    # Generated data is the starting state, not a change history, and per-row totals
+    # maintenance would dominate a load this size: bulk_load() skips both.
+    with srms.bulk_load() as conn:
+        conn.executemany("INSERT INTO Students (student_id, first_name, last_name, class_section) VALUES (?, ?, ?, ?)",
+                         ((i, rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), rng.choice(CLASS_SECTIONS))
+                          for i in range(1, students + 1)))
+        conn.executemany("INSERT INTO Subjects (subject_id, subject_name, max_marks) VALUES (?, ?, ?)",
+                         ((i, SUBJECT_NAMES[(i - 1) % len(SUBJECT_NAMES)] + ("" if i <= len(SUBJECT_NAMES) else f" {(i - 1) // len(SUBJECT_NAMES) + 1}"),
+                           max_marks[i - 1]) for i in range(1, subjects + 1)))
+        conn.executemany("INSERT INTO Marks (student_id, subject_id, marks_obtained) VALUES (?, ?, ?)", mark_rows())
+    marks = conn.execute("SELECT COUNT(*) FROM Marks").fetchone()[0]
+    conn.execute("PRAGMA optimize")
+    srms.close_all_connections()
+    return marks
+
+def dataset_path(data_dir, students, subjects, density, seed):
+    return os.path.join(data_dir, f"srms_{students}x{subjects}_d{density:g}_s{seed}.db")
+
+def ensure_dataset(data_dir, students, subjects, density, seed):
+    path = dataset_path(data_dir, students, subjects, density, seed)
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        started = time.perf_counter()
+        tmp_path = path + ".tmp"
+        for leftover in (tmp_path, tmp_path + "-wal", tmp_path + "-shm"):
+            if os.path.exists(leftover): os.remove(leftover)
+        marks = generate_dataset(tmp_path, students, subjects, density, seed)
+        os.replace(tmp_path, path) # Connections are closed and checkpointed, so the file is complete
+        print(f"Generated {os.path.basename(path)} ({marks} marks) in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    return path
+
+@contextlib.contextmanager
+def quiet():
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull): yield
+
+@contextlib.contextmanager
+def scripted_input(answers):
+    # The interactive functions call input(); a module global shadows the builtin.
+    answers = iter(answers)
+    srms.input = lambda prompt="": next(answers)
+    try: yield
+    finally: del srms.input
+
+def benchmarks(rng, students, subjects, calls):
+    # (name, calls per timed repetition, function). Interactive and printing functions
+    # are called as-is; their output goes to /dev/null.
+    student_ids = [rng.randint(1, students) for _ in range(calls)]
+    mark_args = [(rng.randint(1, students), rng.randint(1, subjects), rng.randint(0, 50)) for _ in range(calls)]
+    terms = [rng.choice(FIRST_NAMES + LAST_NAMES)[:rng.randint(2, 5)] for _ in range(calls)]
+
+    def add_marks():
+        for args in mark_args: srms.add_marks(*args)
+    def search_students():
+        with scripted_input(terms):
+            for _ in terms: srms.search_students()
+    def view_student_marks():
+        for student_id in student_ids: srms.view_student_marks(student_id)
+    return [
+        ("get_student_performance_data", 1, srms.get_student_performance_data),
+        ("rank_students", 1, srms.rank_students),
+        ("rank_students_by_class", 1, lambda: srms.rank_students(by_class=True)),
+        ("view_top_n_students", 1, lambda: srms.view_top_n_students(10)),
+        ("view_failed_list", 1, lambda: srms.view_failed_list(40.0)),
+        ("search_students", calls, search_students),
+        ("view_student_marks", calls, view_student_marks),
+        ("add_marks", calls, add_marks), # Last: it changes the data the others read
+    ]
+
+def run_benchmarks(data_dir, sizes, density=DEFAULT_DENSITY, seed=DEFAULT_SEED, repeat=5, calls=200, only=None):
+    results = {}
+    for students, subjects in sizes:
+        source = ensure_dataset(data_dir, students, subjects, density, seed)
+        scratch = os.path.join(data_dir, "scratch.db")
+        shutil.copyfile(source, scratch)
+        srms.DATABASE_NAME = scratch
+        srms.CURRENT_USER_ROLE = "admin"
+        srms.clear_lookup_caches()
+        label = f"{students}x{subjects}"
+        results[label] = {}
+        try:
+            with quiet():
+                for name, n_calls, func in benchmarks(random.Random(seed), students, subjects, calls):
+                    if only and name not in only: continue
+                    func() # Warm-up: statement cache, lookup cache, OS page cache
+                    timings = []
+                    for _ in range(repeat):
+                        started = time.perf_counter()
+                        func()
+                        timings.append((time.perf_counter() - started) * 1000 / n_calls)
+                    results[label][name] = {"median_ms": round(statistics.median(timings), 4), "min_ms": round(min(timings), 4),
+                                            "mean_ms": round(statistics.fmean(timings), 4), "calls": n_calls, "repeat": repeat}
+                    print(f"{label:<12} {name:<30} {results[label][name]['median_ms']:>10.3f} ms", file=sys.stderr)
+        finally:
+            srms.close_all_connections()
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(scratch + suffix): os.remove(scratch + suffix)
+    return {"meta": {"python": platform.python_version(), "sqlite": sqlite3.sqlite_version, "platform": platform.platform(),
+                     "density": density, "seed": seed, "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+            "results": results}
+
+def compare_results(current, baseline, threshold=DEFAULT_THRESHOLD):
+    # Returns [(size, operation, baseline_ms, current_ms, ratio)] for every operation whose
+    # median slowed down by more than threshold (0.25 = 25%).
+    regressions = []
+    for label, operations in current["results"].items():
+        for name, result in operations.items():
+            before = baseline.get("results", {}).get(label, {}).get(name)
+            if before is None: continue
+            old_ms, new_ms = before["median_ms"], result["median_ms"]
+            if new_ms - old_ms > NOISE_FLOOR_MS and new_ms > old_ms * (1 + threshold):
+                regressions.append((label, name, old_ms, new_ms, new_ms / old_ms if old_ms else float("inf")))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate SRMS test data and benchmark srms.py operations.")
+    commands = parser.add_subparsers(dest="command", metavar="command", required=True)
+    gen = commands.add_parser("generate", help="write a synthetic database")
+    gen.add_argument("path")
+    gen.add_argument("--students", type=int, default=100000)
+    gen.add_argument("--subjects", type=int, default=50)
+    gen.add_argument("--density", type=float, default=DEFAULT_DENSITY, help="share of student/subject pairs with a mark")
+    gen.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    run = commands.add_parser("run", help="time srms operations across dataset sizes")
+    run.add_argument("--sizes", default=DEFAULT_SIZES, help="comma-separated STUDENTSxSUBJECTS (default: %(default)s)")
+    run.add_argument("--density", type=float, default=DEFAULT_DENSITY)
+    run.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    run.add_argument("--repeat", type=int, default=5, help="timed repetitions per operation (default: %(default)s)")
+    run.add_argument("--calls", type=int, default=200, help="calls per repetition for per-item operations (default: %(default)s)")
+    run.add_argument("--only", help="comma-separated operation names")
+    run.add_argument("--data-dir", default="bench_data", help="where generated datasets are cached (default: %(default)s)")
+    run.add_argument("--output", help="write results JSON here")
+    run.add_argument("--baseline", help="compare against this results JSON; exit 1 on a regression")
+    run.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="allowed slowdown, 0.25 = 25%% (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        started = time.perf_counter()
+        try: marks = generate_dataset(args.path, args.students, args.subjects, args.density, args.seed)
+        except FileExistsError as e: print(e, file=sys.stderr); return 1
+        print(f"Wrote {args.students} students, {args.subjects} subjects and {marks} marks to '{args.path}' "
+              f"in {time.perf_counter() - started:.1f}s.")
+        return 0
+
+    sizes = [parse_size(s) for s in args.sizes.split(",")]
+    only = set(args.only.split(",")) if args.only else None
+    current = run_benchmarks(args.data_dir, sizes, args.density, args.seed, args.repeat, args.calls, only)
+    if args.output:
+        with open(args.output, "w") as f: json.dump(current, f, indent=2)
+    if not args.baseline: return 0
+    with open(args.baseline) as f: baseline = json.load(f)
+    regressions = compare_results(current, baseline, args.threshold)
+    for label, name, old_ms, new_ms, ratio in regressions:
+        print(f"REGRESSION {label} {name}: {old_ms:.3f} ms -> {new_ms:.3f} ms ({ratio:.2f}x)")
+    print(f"{len(regressions)} regression(s) against '{args.baseline}' (threshold {args.threshold:.0%}).")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+import argparse
+import asyncio
+import random
+import time
+import urllib.parse
+
+# Load test for the results API (`python srms.py serve`). Each simulated client keeps one
+# HTTP/1.1 connection open and sends a weighted mix of marksheet, ranking and subject list
+# requests; at the end it reports throughput and latency percentiles.
+#   python srms_loadtest.py --concurrency 200 --duration 20 --max-student-id 5000
+
+DEFAULT_MIX = "marksheet=8,rankings=1,subjects=1"
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ("marksheet", "rankings", "subjects"): raise argparse.ArgumentTypeError(f"unknown endpoint '{name}'")
+        mix[name] = int(weight or 1)
+    return mix
+
+def make_path(endpoint, rng, max_student_id):
+    if endpoint == "marksheet": return f"/students/{rng.randint(1, max_student_id)}/marksheet"
+    if endpoint == "rankings": return "/rankings?by=" + rng.choice(("percentage", "total")) + "&top=" + rng.choice(("10", "100"))
+    return "/subjects"
+
+def percentile(sorted_values, pct):
+    if not sorted_values: return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values) + 0.5) - 1)) # Nearest rank
+    return sorted_values[index]
+
+async def fetch(reader, writer, host, path):
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+    await writer.drain()
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split()[1])
+    length, keep_alive = 0, True
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        if name.lower() == "content-length": length = int(value)
+        elif name.lower() == "connection": keep_alive = value.strip().lower() != "close"
+    await reader.readexactly(length)
+    return status, keep_alive
+
+async def client(host, port, paths, deadline, remaining, latencies, statuses, errors):
+    conn = None
+    while time.perf_counter() < deadline and remaining[0] > 0:
+        remaining[0] -= 1
+        path = next(paths)
+        try:
+            if conn is None: conn = await asyncio.open_connection(host, port)
+            started = time.perf_counter()
+            status, keep_alive = await fetch(*conn, host, path)
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+        except (OSError, asyncio.IncompleteReadError, ValueError, IndexError) as e:
+            errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            keep_alive = False
+        if not keep_alive and conn is not None:
+            conn[1].close(); conn = None
+    if conn is not None: conn[1].close()
+
+def request_paths(mix, max_student_id, seed):
+    rng = random.Random(seed)
+    endpoints, weights = list(mix), list(mix.values())
+    while True: yield make_path(rng.choices(endpoints, weights)[0], rng, max_student_id)
+
+async def run(args):
+    url = urllib.parse.urlsplit(args.url)
+    host, port = url.hostname or "127.0.0.1", url.port or 80
+    latencies, statuses, errors = [], {}, {}
+    paths = request_paths(args.mix, args.max_student_id, args.seed)
+    remaining = [args.requests or float("inf")] # Shared request budget
+    started = time.perf_counter()
+    deadline = started + args.duration
+    await asyncio.gather(*(client(host, port, paths, deadline, remaining, latencies, statuses, errors)
+                           for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"Requests:     {len(latencies)} in {elapsed:.2f}s with {args.concurrency} connections")
+    print(f"Throughput:   {len(latencies) / elapsed:.1f} requests/sec")
+    print("Latency (ms): " + "  ".join(f"p{p}={percentile(latencies, p) * 1000:.2f}" for p in (50, 90, 99))
+          + f"  max={latencies[-1] * 1000 if latencies else 0:.2f}")
+    print("Statuses:     " + (", ".join(f"{code}: {n}" for code, n in sorted(statuses.items())) or "none"))
+    if errors: print("Errors:       " + ", ".join(f"{name}: {n}" for name, n in sorted(errors.items())))
+    return 0 if latencies and not errors and all(code < 500 for code in statuses) else 1
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the SRMS results API.")
+    parser.add_argument("--url", default="http://127.0.0.1:8080", help="API base URL (default: %(default)s)")
+    parser.add_argument("--concurrency", type=int, default=100, help="simultaneous connections (default: %(default)s)")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run (default: %(default)s)")
+    parser.add_argument("--requests", type=int, help="stop after this many requests instead")
+    parser.add_argument("--max-student-id", type=int, default=1000, help="marksheets are requested for IDs 1..N")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="endpoint weights (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+    if args.requests: args.duration = float("inf")
+    return asyncio.run(run(args))
+
+if __name__ == "__main__":
+    raise SystemExit(main())
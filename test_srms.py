@@ -0,0 +1,195 @@
+import json
+import os
+import random
+import shutil
+import sqlite3
+
+import pytest
+
+import srms
+
+SHIPPED_DATABASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "student_results.db")
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    # A fresh, fully migrated database with an admin logged in.
+    monkeypatch.setattr(srms, "DATABASE_NAME", str(tmp_path / "test.db"))
+    monkeypatch.setattr(srms, "CURRENT_USER_ROLE", "admin")
+    monkeypatch.setattr(srms, "MARKS_WRITE_BEHIND", "off")
+    srms.initialize_database()
+    yield srms.get_connection()
+    srms.stop_marks_writer()
+    srms.close_all_connections()
+    srms.clear_lookup_caches()
+
+
+def populate(students=40, subjects=4, seed=7):
+    # Random marks, with plenty of tied scores. Returns (student IDs, subject IDs).
+    rng = random.Random(seed)
+    subject_ids = [srms.add_subject(f"Subject {i}", rng.choice((50, 100))) for i in range(subjects)]
+    student_ids = [srms.add_student(f"First{i}", f"Last{i}", rng.choice("ABC")) for i in range(students)]
+    max_marks = dict(srms.get_connection().execute("SELECT subject_id, max_marks FROM Subjects"))
+    for student_id in student_ids[:-3]: # The last few stay ungraded
+        for subject_id in rng.sample(subject_ids, rng.randint(1, subjects)):
+            srms.add_marks(student_id, subject_id, rng.randrange(0, max_marks[subject_id] + 1, 5))
+    return student_ids, subject_ids
+
+
+def changelog(conn):
+    return [(table, op, row_id) for table, op, row_id in
+            conn.execute("SELECT table_name, op, row_id FROM ChangeLog ORDER BY seq")]
+
+
+# --- Report totals ---
+def test_totals_triggers_follow_every_write(db):
+    student_ids, subject_ids = populate()
+    assert srms.check_student_totals() == []
+    db.execute("UPDATE Marks SET marks_obtained = marks_obtained / 2 WHERE student_id = ?", (student_ids[0],))
+    db.execute("DELETE FROM Marks WHERE student_id = ? AND subject_id = ?", (student_ids[1], subject_ids[0]))
+    db.execute("UPDATE Subjects SET max_marks = max_marks * 2 WHERE subject_id = ?", (subject_ids[1],))
+    db.execute("DELETE FROM Subjects WHERE subject_id = ?", (subject_ids[2],))
+    db.execute("DELETE FROM Students WHERE student_id = ?", (student_ids[3],))
+    db.commit()
+    assert srms.check_student_totals() == []
+    totals = db.execute("SELECT total_obtained, total_max_marks FROM StudentTotals WHERE student_id = ?",
+                        (student_ids[0],)).fetchone()
+    live = db.execute('''SELECT SUM(m.marks_obtained), SUM(s.max_marks) FROM Marks m
+                         JOIN Subjects s ON s.subject_id = m.subject_id WHERE m.student_id = ?''', (student_ids[0],)).fetchone()
+    assert totals == live
+
+
+def test_check_student_totals_reports_and_repairs_drift(db):
+    student_ids, _ = populate()
+    db.execute("UPDATE StudentTotals SET total_obtained = total_obtained + 1 WHERE student_id = ?", (student_ids[5],))
+    db.commit()
+    assert srms.check_student_totals() == [student_ids[5]]
+    srms.rebuild_student_totals()
+    assert srms.check_student_totals() == []
+
+
+# --- Ranking index ---
+def assert_index_matches_sql(sort_key):
+    ranked = srms.get_ranked_students(sort_key) # No limit: RANK() in SQL
+    expected = [(row["rank"], row["id"]) for row in ranked]
+    assert srms.get_ranking_index().top(len(expected), sort_key) == expected
+    for row in ranked:
+        assert srms.get_student_rank(row["id"], sort_key) == (row["rank"], len(ranked))
+    assert srms.get_ranked_students(sort_key, limit=10) == ranked[:10]
+
+
+@pytest.mark.parametrize("sort_key", srms.RANK_SORT_KEYS)
+def test_ranking_index_matches_sql_ranks(db, sort_key):
+    student_ids, subject_ids = populate()
+    assert_index_matches_sql(sort_key)
+    # Incremental updates on this connection
+    srms.add_marks(student_ids[-1], subject_ids[0], 0)
+    srms.add_marks(student_ids[0], subject_ids[0], 50)
+    srms.add_student("New", "Student", "A")
+    assert_index_matches_sql(sort_key)
+    # A commit by another connection makes the index rebuild
+    other = sqlite3.connect(srms.DATABASE_NAME)
+    other.execute("UPDATE Marks SET marks_obtained = 0 WHERE student_id = ?", (student_ids[2],))
+    other.commit()
+    other.close()
+    assert_index_matches_sql(sort_key)
+
+
+def test_iter_rankings_matches_get_ranked_students(db):
+    populate()
+    for sort_key in srms.RANK_SORT_KEYS:
+        for by_class in (False, True):
+            assert list(srms.iter_rankings(sort_key, by_class=by_class)) == srms.get_ranked_students(sort_key, by_class=by_class)
+
+
+# --- Migrations ---
+STUDENTS_SQL = "SELECT student_id, first_name, last_name, class_section FROM Students ORDER BY student_id"
+
+
+def test_migrates_shipped_database(tmp_path, monkeypatch):
+    path = tmp_path / "student_results.db"
+    shutil.copyfile(SHIPPED_DATABASE, path)
+    monkeypatch.setattr(srms, "DATABASE_NAME", str(path))
+    try:
+        baseline = srms.get_connection()
+        students = baseline.execute(STUDENTS_SQL).fetchall()
+        marks = baseline.execute("SELECT * FROM Marks ORDER BY mark_id").fetchall()
+        assert srms.get_schema_version(baseline) < srms.SCHEMA_VERSION
+        srms.initialize_database()
+        conn = srms.get_connection()
+        assert srms.get_schema_version(conn) == srms.SCHEMA_VERSION
+        assert conn.execute(STUDENTS_SQL).fetchall() == students
+        assert conn.execute("SELECT * FROM Marks ORDER BY mark_id").fetchall() == marks
+        assert srms.check_student_totals() == []
+        assert conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+        srms.apply_migrations(conn, verbose=False) # Nothing left to do
+        assert srms.get_schema_version(conn) == srms.SCHEMA_VERSION
+    finally:
+        srms.close_all_connections()
+        srms.clear_lookup_caches()
+
+
+# --- Write-behind marks queue ---
+@pytest.mark.parametrize("mode", ["async", "commit"])
+def test_write_behind_drains_queue(db, mode):
+    student_ids = [srms.add_student(f"First{i}", f"Last{i}", "A") for i in range(30)]
+    subject_ids = [srms.add_subject(f"Subject {i}") for i in range(3)]
+    srms.enable_write_behind(mode)
+    try:
+        results = [srms.add_marks(student_id, subject_id, (student_id * subject_id) % 101)
+                   for student_id in student_ids for subject_id in subject_ids]
+        srms.flush_marks_queue()
+    finally:
+        srms.enable_write_behind("off")
+    if mode == "async":
+        assert all(future.done() and future.exception() is None for future in results)
+        results = [future.result() for future in results]
+    assert None not in results
+    assert db.execute("SELECT COUNT(*) FROM Marks").fetchone()[0] == len(student_ids) * len(subject_ids)
+    assert srms.check_student_totals() == []
+
+
+def test_write_behind_keeps_last_mark_for_a_subject(db):
+    student_id = srms.add_student("Only", "Student", "A")
+    subject_id = srms.add_subject("Maths")
+    srms.enable_write_behind("async")
+    try:
+        for marks in (10, 20, 30):
+            srms.add_marks(student_id, subject_id, marks)
+        srms.flush_marks_queue()
+    finally:
+        srms.enable_write_behind("off")
+    assert db.execute("SELECT marks_obtained FROM Marks").fetchall() == [(30,)]
+
+
+# --- Change log ---
+def test_compaction_keeps_seq_order_across_tables(db):
+    student_id = srms.add_student("Ada", "One", "A")
+    db.execute("UPDATE Students SET first_name = 'Ann' WHERE student_id = ?", (student_id,))
+    db.execute("UPDATE Students SET class_section = 'B' WHERE student_id = ?", (student_id,))
+    db.commit()
+    subject_id = srms.add_subject("Maths")
+    srms.add_marks(student_id, subject_id, 40)
+    srms.add_marks(student_id, subject_id, 45)
+    db.execute("UPDATE Students SET last_name = 'Two' WHERE student_id = ?", (student_id,))
+    db.commit()
+    assert changelog(db) == [("Students", "insert", student_id), ("Students", "update", student_id),
+                             ("Students", "update", student_id), ("Subjects", "insert", subject_id),
+                             ("Marks", "insert", 1), ("Marks", "update", 1), ("Students", "update", student_id)]
+    assert srms.compact_changelog() == 3
+    # The first run's latest image of the student stays ahead of the mark that refers to it
+    assert changelog(db) == [("Students", "update", student_id), ("Subjects", "insert", subject_id),
+                             ("Marks", "update", 1), ("Students", "update", student_id)]
+    rows = [json.loads(data) for (data,) in db.execute("SELECT data FROM ChangeLog ORDER BY seq")]
+    assert (rows[0]["first_name"], rows[0]["class_section"]) == ("Ann", "B")
+    assert rows[2]["marks_obtained"] == 45
+
+
+def test_compaction_respects_before_seq(db):
+    student_id = srms.add_student("Ada", "One", "A")
+    for name in ("B", "C", "D"):
+        db.execute("UPDATE Students SET first_name = ? WHERE student_id = ?", (name, student_id))
+        db.commit()
+    seqs = [seq for (seq,) in db.execute("SELECT seq FROM ChangeLog ORDER BY seq")]
+    assert srms.compact_changelog(before_seq=seqs[2]) == 2
+    assert [seq for (seq,) in db.execute("SELECT seq FROM ChangeLog ORDER BY seq")] == seqs[2:]